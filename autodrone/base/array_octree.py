@@ -0,0 +1,410 @@
+import numpy as np
+from mathutils import Vector
+
+from autodrone.base.octree import Octree, NEIGHBOUR_DIRECTIONS
+from autodrone.base.raycast import EdgeVisibilityCache
+
+# Flag values of ArrayOctree.occupied, since a node can also never have been evaluated
+OCCUPANCY_UNKNOWN = -1
+OCCUPANCY_FREE = 0
+OCCUPANCY_OCCUPIED = 1
+
+# Offsets of the eight children relative to their parent center, in units of
+# a quarter of the parent size. The order matches OctreeNode.subdivide (x,
+# then y, then z), so child k of a node is in octant k.
+CHILD_OFFSETS = np.array(
+    [(i, j, k) for i in (-1, 1) for j in (-1, 1) for k in (-1, 1)],
+    dtype=np.float64,
+)
+
+# Names of the arrays holding the data of the nodes
+ARRAY_NAMES = (
+    "centers",
+    "sizes",
+    "depths",
+    "parents",
+    "first_child",
+    "occupied",
+    "vectors",
+    "outgoing_graph_edges",
+)
+
+
+class ArrayOctreeNode:
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index: int):
+        """Lightweight view on one node of an ArrayOctree.
+
+        Exposes the same API as an OctreeVectorNode, but does not hold any data
+        itself : every attribute is read from (and written to) the arrays of
+        the tree. Views are cheap to create and are created on demand, so two
+        views of the same node compare equal.
+
+        Args:
+            tree (ArrayOctree): The tree holding the node data.
+            index (int): Index of the node in the arrays of the tree.
+        """
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, ArrayOctreeNode)
+            and other.tree is self.tree
+            and other.index == self.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self) -> str:
+        return f"ArrayOctreeNode({self.index})"
+
+    def __str__(self) -> str:
+        return f"Octree Node {self.id}, center {self.center}, size {self.size}, children {self.children}, outgoing_graph_edges {self.outgoing_graph_edges}, is occupied {self.is_occupied}"
+
+    @property
+    def id(self) -> int:
+        return self.index
+
+    @property
+    def center(self) -> Vector:
+        return Vector(self.tree.centers[self.index])
+
+    @property
+    def size(self) -> float:
+        return float(self.tree.sizes[self.index])
+
+    @property
+    def depth(self) -> int:
+        return int(self.tree.depths[self.index])
+
+    @property
+    def parent(self):
+        parent = self.tree.parents[self.index]
+        if parent < 0:
+            return None
+        return ArrayOctreeNode(self.tree, int(parent))
+
+    @property
+    def children(self):
+        first_child = self.tree.first_child[self.index]
+        if first_child < 0:
+            return None
+        return [ArrayOctreeNode(self.tree, int(first_child) + k) for k in range(8)]
+
+    @property
+    def outgoing_graph_edges(self) -> int:
+        return int(self.tree.outgoing_graph_edges[self.index])
+
+    @outgoing_graph_edges.setter
+    def outgoing_graph_edges(self, value: int):
+        self.tree.outgoing_graph_edges[self.index] = value
+
+    @property
+    def vector(self) -> Vector:
+        return Vector(self.tree.vectors[self.index])
+
+    @vector.setter
+    def vector(self, value: Vector):
+        self.tree.vectors[self.index] = tuple(value)
+
+    @property
+    def is_occupied(self):
+        flag = self.tree.occupied[self.index]
+        if flag == OCCUPANCY_UNKNOWN:
+            return None
+        return bool(flag)
+
+    @is_occupied.setter
+    def is_occupied(self, value: object):
+        if value is None:
+            self.tree.occupied[self.index] = OCCUPANCY_UNKNOWN
+        else:
+            self.tree.occupied[self.index] = (
+                OCCUPANCY_OCCUPIED if value else OCCUPANCY_FREE
+            )
+
+    def subdivide(self, node_class=None):
+        """Subdivide the node into eight child nodes
+
+        Args:
+            node_class (_type_, optional): Ignored, kept for compatibility with
+                OctreeNode.subdivide. Children are always stored in the tree
+                arrays.
+
+        Raises:
+            ValueError: If the node already has children.
+        """
+        self.tree.subdivide(self.index)
+
+
+class ArrayOctree(Octree):
+    def __init__(
+        self,
+        root_center: Vector,
+        root_size: float,
+        max_depth=13,
+        node_class=None,
+        initial_capacity=1024,
+    ):
+        """Octree storing its nodes in contiguous NumPy arrays (structure of
+        arrays) instead of one Python object per node.
+
+        Nodes are identified by their integer index in the arrays, the root
+        being node 0. The eight children of a node are stored contiguously,
+        so a node only records the index of its first child (-1 for a leaf).
+        The OctreeNode API remains available through ArrayOctreeNode views,
+        so an ArrayOctree can be used anywhere an Octree is expected.
+
+        Args:
+            root_center (Vector): Center of the root cell.
+            root_size (float): Size (side length) of the root cell.
+            max_depth (int, optional): Maximum subdivision depth. Defaults to 13.
+            node_class (_type_, optional): Ignored, kept for compatibility with
+                Octree. Nodes are always ArrayOctreeNode views.
+            initial_capacity (int, optional): Number of nodes to allocate room
+                for before the arrays need to grow. Defaults to 1024.
+        """
+        self.max_depth = max_depth
+        self.edge_visibility = EdgeVisibilityCache()
+        self._invalidate_cell_cache()
+
+        self.node_count = 0
+        self.centers = np.zeros((initial_capacity, 3), dtype=np.float64)
+        self.sizes = np.zeros(initial_capacity, dtype=np.float64)
+        self.depths = np.zeros(initial_capacity, dtype=np.uint8)
+        self.parents = np.full(initial_capacity, -1, dtype=np.int32)
+        self.first_child = np.full(initial_capacity, -1, dtype=np.int32)
+        self.occupied = np.full(initial_capacity, OCCUPANCY_UNKNOWN, dtype=np.int8)
+        self.vectors = np.zeros((initial_capacity, 3), dtype=np.float32)
+        self.outgoing_graph_edges = np.zeros(initial_capacity, dtype=np.int32)
+
+        self._append_nodes(
+            centers=np.array([tuple(root_center)], dtype=np.float64),
+            sizes=np.array([root_size], dtype=np.float64),
+            depths=np.zeros(1, dtype=np.uint8),
+            parents=np.full(1, -1, dtype=np.int32),
+        )
+
+    @property
+    def root(self) -> ArrayOctreeNode:
+        return ArrayOctreeNode(self, 0)
+
+    def _reserve(self, capacity: int):
+        """Grow the arrays so they can hold at least `capacity` nodes."""
+        current_capacity = len(self.sizes)
+        if capacity <= current_capacity:
+            return
+        new_capacity = max(capacity, 2 * current_capacity)
+
+        fill_values = {
+            "parents": -1,
+            "first_child": -1,
+            "occupied": OCCUPANCY_UNKNOWN,
+        }
+        for name in ARRAY_NAMES:
+            array = getattr(self, name)
+            grown = np.full(
+                (new_capacity,) + array.shape[1:], fill_values.get(name, 0), array.dtype
+            )
+            grown[: self.node_count] = array[: self.node_count]
+            setattr(self, name, grown)
+
+    def _append_nodes(self, centers, sizes, depths, parents):
+        start = self.node_count
+        end = start + len(sizes)
+        self._reserve(end)
+
+        self.centers[start:end] = centers
+        self.sizes[start:end] = sizes
+        self.depths[start:end] = depths
+        self.parents[start:end] = parents
+        self.node_count = end
+
+        return start
+
+    def subdivide(self, index: int):
+        """Subdivide a single node into eight child nodes.
+
+        Args:
+            index (int): Index of the node to subdivide.
+
+        Raises:
+            ValueError: If the node already has children.
+        """
+        if self.first_child[index] >= 0:
+            raise ValueError("Cannot subdivide a node which already has children.")
+        self.subdivide_many(np.array([index]))
+
+    def subdivide_many(self, indices):
+        """Subdivide several leaf nodes at once.
+
+        Args:
+            indices (np.ndarray): Indices of the nodes to subdivide. They must
+                all be leaves.
+
+        Raises:
+            ValueError: If one of the nodes already has children.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return
+        if np.any(self.first_child[indices] >= 0):
+            raise ValueError("Cannot subdivide a node which already has children.")
+
+        parent_sizes = self.sizes[indices]
+        child_centers = (
+            self.centers[indices][:, None, :]
+            + CHILD_OFFSETS[None, :, :] * (parent_sizes[:, None, None] / 4)
+        ).reshape(-1, 3)
+
+        start = self._append_nodes(
+            centers=child_centers,
+            sizes=np.repeat(parent_sizes / 2, 8),
+            depths=np.repeat(self.depths[indices] + 1, 8),
+            parents=np.repeat(indices, 8),
+        )
+        self.first_child[indices] = start + 8 * np.arange(len(indices))
+        self._invalidate_cell_cache()
+
+    def subdivide_leaves(self, node_class=None):
+        self.subdivide_many(self.leaf_indices())
+
+    def _storage_order(self):
+        return [ArrayOctreeNode(self, i) for i in range(self.node_count)]
+
+    def storage_ids(self):
+        return range(self.node_count)
+
+    def to_arrays(self) -> dict:
+        return {name: getattr(self, name)[: self.node_count] for name in ARRAY_NAMES}
+
+    def _load_arrays(self, arrays: dict):
+        # Keep the (possibly memory-mapped) arrays as they are, they are only
+        # copied if the tree needs to grow
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.node_count = len(arrays["sizes"])
+        self._invalidate_cell_cache()
+
+    def _invalidate_cell_cache(self):
+        self._leaf_indices = None
+        self._all_cells = None
+        self._leaf_cells = None
+        self._leaf_index = None
+
+    def leaf_indices(self) -> np.ndarray:
+        """Returns the indices of all leaf nodes."""
+        if self._leaf_indices is None:
+            self._leaf_indices = np.flatnonzero(self.first_child[: self.node_count] < 0)
+        return self._leaf_indices
+
+    def get_all_cells(self, leaf_nodes_only=False):
+        if leaf_nodes_only:
+            if self._leaf_cells is None:
+                self._leaf_cells = [
+                    ArrayOctreeNode(self, i) for i in self.leaf_indices().tolist()
+                ]
+            return list(self._leaf_cells)
+
+        if self._all_cells is None:
+            self._all_cells = [ArrayOctreeNode(self, i) for i in range(self.node_count)]
+        return list(self._all_cells)
+
+    def get_cell_centers(self, leaf_nodes_only=False) -> np.ndarray:
+        if leaf_nodes_only:
+            return self.centers[self.leaf_indices()]
+        return self.centers[: self.node_count]
+
+    def get_cell_by_name(self, id: int):
+        if 0 <= id < self.node_count:
+            return ArrayOctreeNode(self, int(id))
+        return None
+
+    def locate_cell(self, pos: tuple):
+        x, y, z = pos
+        centers, first_child = self.centers, self.first_child
+
+        cx, cy, cz = centers[0]
+        half_size = self.sizes[0] / 2
+        if abs(x - cx) > half_size or abs(y - cy) > half_size or abs(z - cz) > half_size:
+            return None
+
+        node = 0
+        while first_child[node] >= 0:
+            cx, cy, cz = centers[node]
+            node = first_child[node] + 4 * (x >= cx) + 2 * (y >= cy) + (z >= cz)
+        return ArrayOctreeNode(self, int(node))
+
+    def locate_indices(self, positions) -> np.ndarray:
+        """Vectorized version of locate_cell, descending the tree for many
+        positions at once.
+
+        Args:
+            positions (np.ndarray): Positions to locate, of shape (N, 3).
+
+        Returns:
+            Array of N indices of the leaf containing each position, -1 for
+            positions outside of the root cell.
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        nodes = np.zeros(len(positions), dtype=np.int64)
+
+        inside = np.all(
+            np.abs(positions - self.centers[0]) <= self.sizes[0] / 2, axis=1
+        )
+        active = np.flatnonzero(inside)
+        while len(active) > 0:
+            first_child = self.first_child[nodes[active]]
+            has_children = first_child >= 0
+            active, first_child = active[has_children], first_child[has_children]
+            above_center = positions[active] >= self.centers[nodes[active]]
+            nodes[active] = first_child + above_center @ np.array([4, 2, 1])
+
+        nodes[~inside] = -1
+        return nodes
+
+    def get_closest_cell_to_position(self, pos: tuple, leaf_nodes_only=True):
+        if leaf_nodes_only:
+            cell = self.locate_cell(pos)
+            if cell is not None:
+                return cell
+            indices, _ = self.get_leaf_index().query(pos, k=1)
+            return ArrayOctreeNode(self, int(self.leaf_indices()[indices[0, 0]]))
+        distances = np.sum((self.centers[: self.node_count] - np.array(pos)) ** 2, axis=1)
+        return ArrayOctreeNode(self, int(np.argmin(distances)))
+
+    def _get_adjacent_pairs(self, leaves):
+        pairs = self.adjacent_index_pairs([cell.index for cell in leaves])
+        return [
+            (ArrayOctreeNode(self, int(a)), ArrayOctreeNode(self, int(b)))
+            for a, b in pairs
+        ]
+
+    def adjacent_index_pairs(self, leaf_indices) -> np.ndarray:
+        """Returns each pair of adjacent leaves once, as an array of shape
+        (N, 2) of node indices. Pairs are only searched from the given leaves,
+        so calling this on disjoint sets of leaves gives disjoint sets of pairs.
+
+        Args:
+            leaf_indices (list): Indices of the leaves to start from.
+        """
+        # Same probing as Octree.get_adjacent_cells, for all leaves at once
+        leaf_indices = np.asarray(leaf_indices, dtype=np.int64)
+        directions = np.array(NEIGHBOUR_DIRECTIONS, dtype=np.float64)
+        probes = (
+            self.centers[leaf_indices][:, None, :]
+            + directions[None, :, :] * self.sizes[leaf_indices][:, None, None]
+        )
+        found = self.locate_indices(probes.reshape(-1, 3))
+        sources = np.repeat(leaf_indices, len(directions))
+
+        keep = found >= 0
+        sources, found = sources[keep], found[keep]
+        keep = (self.sizes[found] > self.sizes[sources]) | (
+            (self.sizes[found] == self.sizes[sources]) & (found > sources)
+        )
+        # A large neighbour can be found in several directions
+        return np.unique(np.stack([sources[keep], found[keep]], axis=1), axis=0)
@@ -0,0 +1,151 @@
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import time
+from contextlib import contextmanager
+
+# Messages of the package go through this logger (and its children), and are
+# not shown unless the application configures logging, eg. with
+# logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("autodrone")
+
+# Counters and timers are only recorded once enabled, so they cost (almost)
+# nothing otherwise
+_enabled = False
+_counters = dict()
+_timers = dict()  # name -> [count, total seconds, max seconds]
+
+
+def enable(enabled=True):
+    """Starts (or stops) recording counters and timers."""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """Forgets the counters and timers recorded so far."""
+    _counters.clear()
+    _timers.clear()
+
+
+def count(name: str, n=1):
+    """Adds n to a counter, eg. count("rays_cast", len(origins)). In hot loops,
+    count locally and call this once at the end."""
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def record_time(name: str, seconds: float):
+    """Adds a measured duration to a timer."""
+    if _enabled:
+        timer = _timers.setdefault(name, [0, 0.0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds)
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_time(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name: str):
+    """Context manager adding the duration of its block to a timer :
+
+        with timed("to_graph"):
+            ...
+    """
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed_function(name: str):
+    """Decorator adding the duration of each call of the function to a timer."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def summary() -> dict:
+    """Counters and timers recorded so far, as a dict which can be dumped to
+    JSON. Timers give their count, total, mean and max duration in seconds."""
+    return {
+        "counters": dict(sorted(_counters.items())),
+        "timers": {
+            name: {
+                "count": n,
+                "total_seconds": total,
+                "mean_seconds": total / n,
+                "max_seconds": longest,
+            }
+            for name, (n, total, longest) in sorted(_timers.items())
+        },
+    }
+
+
+def format_summary() -> str:
+    """Human readable version of summary()."""
+    lines = [f"{name}: {value}" for name, value in sorted(_counters.items())]
+    lines += [
+        f"{name}: {n} x {total / n * 1000:.3f} ms = {total:.3f} s (max {longest * 1000:.3f} ms)"
+        for name, (n, total, longest) in sorted(_timers.items())
+    ]
+    return "\n".join(lines)
+
+
+@contextmanager
+def profile(path=None, sort="cumulative", limit=30):
+    """Profiles its block with cProfile.
+
+    Args:
+        path (str, optional): File where the statistics are dumped, to be read with pstats or a viewer such as snakeviz. If None, the top functions are logged instead. Defaults to None.
+        sort (str, optional): Order of the logged functions. Defaults to "cumulative".
+        limit (int, optional): Number of logged functions. Defaults to 30.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path is not None:
+            profiler.dump_stats(path)
+            logger.info("Profile written to %s", path)
+        else:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+            logger.info("Profile:\n%s", stream.getvalue())
@@ -1,10 +1,186 @@
+import logging
+
 import numpy as np
 from mathutils import Vector
-import bpy
 
-def euclidian_distance(a: tuple, b: tuple):
-    d = np.array(a) - np.array(b)
-    return np.sum(d**2)
+try:
+    import bpy
+except ImportError:
+    # Outside of Blender (eg. on a headless build node), only the helpers which
+    # do not touch the Blender scene can be used.
+    bpy = None
+
+logger = logging.getLogger(__name__)
+
+
+def as_points(points) -> np.ndarray:
+    """Converts a point or a sequence of points (Vectors, tuples or an array)
+    to a float array of shape (N, 3)."""
+    return np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+
+def distances_to_point(points, point) -> np.ndarray:
+    """Distance from each of the points to a single point.
+
+    Args:
+        points (np.ndarray): Points, of shape (N, 3).
+        point (tuple): The point.
+
+    Returns:
+        Array of shape (N,).
+    """
+    return np.linalg.norm(as_points(points) - as_points(point), axis=1)
+
+
+def pairwise_distances(a, b) -> np.ndarray:
+    """Distance between every point of a and every point of b.
+
+    Args:
+        a (np.ndarray): Points, of shape (N, 3).
+        b (np.ndarray): Points, of shape (M, 3).
+
+    Returns:
+        Array of shape (N, M).
+    """
+    a, b = as_points(a), as_points(b)
+    return np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+
+
+def k_nearest(points, queries, k: int, max_distance: float = None, batch_size=1024):
+    """Finds the k points closest to each query point, by brute force.
+
+    Args:
+        points (np.ndarray): Points to search, eg. cell centers, of shape (N, 3).
+        queries (np.ndarray): Query points, of shape (Q, 3).
+        k (int): Number of neighbours to return for each query.
+        max_distance (float, optional): Neighbours farther than this are not returned. Defaults to None.
+        batch_size (int, optional): Queries processed at once, to bound the memory used by the (batch_size, N) distance matrix. Defaults to 1024.
+
+    Returns:
+        Tuple (indices, distances) of arrays of shape (Q, k), sorted by
+        increasing distance. Missing neighbours (fewer than k points, or
+        beyond max_distance) have index -1 and distance inf.
+    """
+    points, queries = as_points(points), as_points(queries)
+    k_found = min(k, len(points))
+    indices = np.full((len(queries), k), -1, dtype=np.int64)
+    distances = np.full((len(queries), k), np.inf)
+
+    for first in range(0, len(queries), batch_size):
+        batch = slice(first, first + batch_size)
+        d = pairwise_distances(queries[batch], points)
+        nearest = np.argpartition(d, k_found - 1, axis=1)[:, :k_found]
+        nearest_d = np.take_along_axis(d, nearest, axis=1)
+        order = np.argsort(nearest_d, axis=1, kind="stable")
+        indices[batch, :k_found] = np.take_along_axis(nearest, order, axis=1)
+        distances[batch, :k_found] = np.take_along_axis(nearest_d, order, axis=1)
+
+    if max_distance is not None:
+        too_far = distances > max_distance
+        indices[too_far] = -1
+        distances[too_far] = np.inf
+    return indices, distances
+
+
+def euclidian_distance(a: tuple, b: tuple = (0, 0, 0)) -> float:
+    """Distance between a and b, or length of a if b is not given."""
+    return float(distances_to_point(a, b)[0])
+
+
+def vectors_to_euler(vectors) -> np.ndarray:
+    """Vectorized version of vector_to_euler, giving the same angles as
+    vector.to_track_quat("-Z", "Y").to_euler() for many vectors at once.
+
+    Args:
+        vectors (np.ndarray): Vectors, of shape (N, 3).
+
+    Returns:
+        Array of shape (N, 3) of XYZ Euler angles. Null vectors give null angles.
+    """
+    vectors = as_points(vectors)
+    length = np.linalg.norm(vectors, axis=1)
+    safe_length = np.where(length > 0, length, 1)
+
+    # Rotation taking -Z onto the vector (Blender's vec_to_quat), around the
+    # axis normal to both
+    t = -vectors
+    x, y, z = t.T
+    axis = np.stack([-y, x, np.zeros_like(x)], axis=1)
+    axis[np.abs(x) + np.abs(y) < 1e-4] = (1, 0, 0)
+    axis /= np.linalg.norm(axis, axis=1, keepdims=True)
+    half_angle = 0.5 * np.arccos(np.clip(z / safe_length, -1, 1))
+    q = np.concatenate(
+        [np.cos(half_angle)[:, None], axis * np.sin(half_angle)[:, None]], axis=1
+    )
+
+    # Then roll around the vector to bring the Y axis up
+    qw, qx, qy, qz = q.T
+    z_axis_x = 2 * (qx * qz + qw * qy)
+    z_axis_y = 2 * (qy * qz - qw * qx)
+    roll = -0.5 * np.arctan2(-z_axis_x, -z_axis_y)
+    sin_roll = np.sin(roll) / safe_length
+    q = _multiply_quaternions(
+        np.concatenate([np.cos(roll)[:, None], t * sin_roll[:, None]], axis=1), q
+    )
+    # Along Z, the roll is undefined : use the one Blender ends up with
+    vertical = np.hypot(z_axis_x, z_axis_y) < 1e-12
+    q[vertical & (z > 0)] = (1, 0, 0, 0)
+    q[vertical & (z < 0)] = (0, 0, 1, 0)
+    q[length == 0] = (1, 0, 0, 0)
+
+    return _quaternions_to_euler(q)
+
+
+def _multiply_quaternions(a, b) -> np.ndarray:
+    aw, ax, ay, az = a.T
+    bw, bx, by, bz = b.T
+    return np.stack(
+        [
+            aw * bw - ax * bx - ay * by - az * bz,
+            aw * bx + ax * bw + ay * bz - az * by,
+            aw * by + ay * bw + az * bx - ax * bz,
+            aw * bz + az * bw + ax * by - ay * bx,
+        ],
+        axis=1,
+    )
+
+
+def _quaternions_to_euler(q) -> np.ndarray:
+    # Same as Blender : of the two XYZ Euler solutions, keep the one with the
+    # smallest angles
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    qw, qx, qy, qz = q.T
+    # Columns of the rotation matrix
+    m00 = 1 - 2 * (qy**2 + qz**2)
+    m01 = 2 * (qx * qy + qw * qz)
+    m02 = 2 * (qx * qz - qw * qy)
+    m11 = 1 - 2 * (qx**2 + qz**2)
+    m12 = 2 * (qy * qz + qw * qx)
+    m21 = 2 * (qy * qz - qw * qx)
+    m22 = 1 - 2 * (qx**2 + qy**2)
+
+    cy = np.hypot(m00, m01)
+    regular = cy > 16 * np.finfo(np.float32).eps
+    euler1 = np.stack(
+        [
+            np.where(regular, np.arctan2(m12, m22), np.arctan2(-m21, m11)),
+            np.arctan2(-m02, cy),
+            np.where(regular, np.arctan2(m01, m00), 0),
+        ],
+        axis=1,
+    )
+    euler2 = np.stack(
+        [
+            np.arctan2(-m12, -m22),
+            np.arctan2(-m02, -cy),
+            np.arctan2(-m01, -m00),
+        ],
+        axis=1,
+    )
+    use_second = regular & (
+        np.abs(euler1).sum(axis=1) > np.abs(euler2).sum(axis=1)
+    )
+    return np.where(use_second[:, None], euler2, euler1)
 
 
 def vector_to_euler(vector: Vector):
@@ -21,6 +197,21 @@ def vector_to_euler(vector: Vector):
     return vector.to_track_quat("-Z").to_euler()
 
 
+def project_on_plane_many(vectors, normal) -> np.ndarray:
+    """Projects many vectors on the plane defined by the normal.
+
+    Args:
+        vectors (np.ndarray): Vectors to be projected, of shape (N, 3).
+        normal (Vector): Unit vector normal to the plane.
+
+    Returns:
+        Array of shape (N, 3).
+    """
+    vectors = as_points(vectors)
+    normal = as_points(normal)[0]
+    return vectors - np.outer(vectors @ normal, normal)
+
+
 def project_on_plane(vector : Vector, normal: Vector):
     """Project the vector on the plan defined by the normal.
 
@@ -28,10 +219,7 @@ def project_on_plane(vector : Vector, normal: Vector):
         vector (Vector): Vector to be projected.
         normal (Vector): Vector defining the normal of the plane on which we project.
     """
-    dot_product = np.dot(normal, vector)
-    sub_vector = Vector(dot_product * normal)
-    projected_vector = vector - sub_vector
-    return projected_vector
+    return Vector(project_on_plane_many(vector, normal)[0])
 
 
 def blender_create_cube(center: Vector, edge_size:float, name="Cube"):
@@ -100,7 +288,7 @@ def blender_raycast(origin, target, max_distance=None):
 
     depsgraph = bpy.context.evaluated_depsgraph_get()
 
-    print("Casting new ray...")
+    logger.debug("Casting new ray...")
 
     if max_distance is not None:
         distance = min(distance, max_distance)
@@ -112,3 +300,33 @@ def blender_raycast(origin, target, max_distance=None):
     if result:
         return location
     return None
+
+
+def blender_raycast_many(origins, targets):
+    """Casts one ray per (origin, target) segment in the current Blender scene.
+    Unlike calling blender_raycast in a loop, the evaluated depsgraph is only
+    fetched once for the whole batch.
+
+    Args:
+        origins (list of Vector): Start point of each segment.
+        targets (list of Vector): End point of each segment.
+
+    Returns:
+        List with, for each segment, the location of the first hit between
+        its origin and its target, or None if the segment is unobstructed.
+    """
+    scene = bpy.context.scene
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+
+    hits = []
+    for origin, target in zip(origins, targets):
+        origin = Vector(origin)
+        direction = Vector(target) - origin
+        distance = direction.length
+        direction.normalize()
+
+        result, location, normal, index, object, matrix = scene.ray_cast(
+            depsgraph=depsgraph, origin=origin, direction=direction, distance=distance
+        )
+        hits.append(location if result else None)
+    return hits
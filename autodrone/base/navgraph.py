@@ -0,0 +1,216 @@
+import heapq
+import math
+
+import numpy as np
+
+from autodrone.base import instrumentation
+
+
+class NavigationGraph:
+    def __init__(self, ids, positions, offsets, targets, weights):
+        """Undirected weighted graph stored in compressed sparse row (CSR)
+        arrays, with its own A* and Dijkstra searches.
+
+        Nodes are integer indices. The neighbours of node i are
+        targets[offsets[i]:offsets[i + 1]], reached with the corresponding
+        weights. Each undirected edge is stored in both directions.
+
+        Args:
+            ids (list): Id of the octree cell of each node.
+            positions (np.ndarray): Position of each node, of shape (N, 3), used by the A* heuristic.
+            offsets (np.ndarray): Start of the neighbours of each node in targets, of shape (N + 1,).
+            targets (np.ndarray): Neighbour of each directed edge.
+            weights (np.ndarray): Weight of each directed edge.
+        """
+        self.ids = list(ids)
+        self.index_of = {cell_id: i for i, cell_id in enumerate(self.ids)}
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    @classmethod
+    def from_edges(cls, ids, positions, sources, targets, weights):
+        """Builds the graph from a list of undirected edges, each given once.
+
+        Args:
+            ids (list): Id of the octree cell of each node.
+            positions (np.ndarray): Position of each node, of shape (N, 3).
+            sources (np.ndarray): First node of each edge.
+            targets (np.ndarray): Second node of each edge.
+            weights (np.ndarray): Weight of each edge.
+        """
+        graph = cls(
+            ids, positions, np.zeros(len(ids) + 1), np.zeros(0), np.zeros(0)
+        )
+        graph._set_edges(sources, targets, weights)
+        return graph
+
+    def _set_edges(self, sources, targets, weights):
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+
+        # Store both directions, sorted by source node
+        all_sources = np.concatenate([sources, targets])
+        all_targets = np.concatenate([targets, sources])
+        all_weights = np.concatenate([weights, weights])
+        order = np.argsort(all_sources, kind="stable")
+
+        self.offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_sources, minlength=len(self.ids)), out=self.offsets[1:])
+        self.targets = all_targets[order]
+        self.weights = all_weights[order]
+
+    def __str__(self) -> str:
+        return f"NavigationGraph with {self.number_of_nodes()} nodes and {self.number_of_edges()} edges"
+
+    def number_of_nodes(self) -> int:
+        return len(self.ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.targets) // 2
+
+    def degree(self, node: int) -> int:
+        return int(self.offsets[node + 1] - self.offsets[node])
+
+    def neighbours(self, node: int):
+        """Returns the arrays of neighbours of the node and of the edge weights."""
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return self.targets[start:end], self.weights[start:end]
+
+    def edges(self):
+        """Returns each undirected edge once, as arrays (sources, targets, weights)."""
+        sources = np.repeat(np.arange(len(self.ids)), np.diff(self.offsets))
+        once = sources < self.targets
+        return sources[once], self.targets[once], self.weights[once]
+
+    def replace_edges(self, nodes, sources, targets, weights):
+        """Removes every edge touching the given nodes, then adds new edges.
+        The graph is modified in place.
+
+        Args:
+            nodes (iterable): Nodes whose edges are removed.
+            sources (np.ndarray): First node of each new edge.
+            targets (np.ndarray): Second node of each new edge.
+            weights (np.ndarray): Weight of each new edge.
+        """
+        removed = np.zeros(len(self.ids), dtype=bool)
+        removed[list(nodes)] = True
+
+        kept_sources, kept_targets, kept_weights = self.edges()
+        keep = ~removed[kept_sources] & ~removed[kept_targets]
+        self._set_edges(
+            np.concatenate([kept_sources[keep], np.asarray(sources, dtype=np.int64)]),
+            np.concatenate([kept_targets[keep], np.asarray(targets, dtype=np.int64)]),
+            np.concatenate([kept_weights[keep], np.asarray(weights, dtype=np.float64)]),
+        )
+
+    def to_networkx(self):
+        """Converts the graph to networkx, with the cell ids as nodes, eg. for
+        debugging or drawing."""
+        # Imported here, as only debugging needs it
+        import networkx as nx
+
+        G = nx.Graph()
+        G.add_nodes_from(self.ids)
+        sources, targets, weights = self.edges()
+        G.add_weighted_edges_from(
+            (self.ids[u], self.ids[v], w)
+            for u, v, w in zip(sources.tolist(), targets.tolist(), weights.tolist())
+        )
+        return G
+
+    @instrumentation.timed_function("dijkstra")
+    def dijkstra(self, source: int):
+        """Single-source shortest paths from the source to every node.
+
+        Args:
+            source (int): Source node.
+
+        Returns:
+            Tuple (distances, predecessors) of arrays : the length of the
+            shortest path from the source to each node (inf if unreachable),
+            and the previous node on this path (-1 for the source and
+            unreachable nodes).
+        """
+        # Plain lists are much faster than NumPy arrays for item access
+        offsets = self.offsets.tolist()
+        targets = self.targets.tolist()
+        weights = self.weights.tolist()
+
+        distances = [math.inf] * len(offsets[:-1])
+        predecessors = [-1] * len(distances)
+        distances[source] = 0.0
+        queue = [(0.0, source)]
+        visited = 0
+        while len(queue) > 0:
+            distance, node = heapq.heappop(queue)
+            if distance > distances[node]:
+                continue  # Outdated entry
+            visited += 1
+            for i in range(offsets[node], offsets[node + 1]):
+                n = targets[i]
+                new_distance = distance + weights[i]
+                if new_distance < distances[n]:
+                    distances[n] = new_distance
+                    predecessors[n] = node
+                    heapq.heappush(queue, (new_distance, n))
+
+        instrumentation.count("searches")
+        instrumentation.count("cells_visited", visited)
+        return np.array(distances), np.array(predecessors, dtype=np.int64)
+
+    @instrumentation.timed_function("astar")
+    def astar(self, source: int, target: int) -> list:
+        """Shortest path between two nodes, guided by the Euclidean distance to
+        the target. This heuristic is exact as long as edge weights are
+        at least the distance between their nodes.
+
+        Args:
+            source (int): Start node.
+            target (int): End node.
+
+        Returns:
+            List of the nodes of the path, from source to target, or an empty
+            list if there is no path.
+        """
+        offsets = self.offsets
+        targets = self.targets
+        weights = self.weights
+        positions = self.positions
+        goal = positions[target]
+
+        distances = {source: 0.0}
+        predecessors = {source: -1}
+        closed = set()
+        queue = [(float(np.linalg.norm(positions[source] - goal)), 0.0, source)]
+        instrumentation.count("searches")
+        while len(queue) > 0:
+            _, distance, node = heapq.heappop(queue)
+            if node in closed:
+                continue
+            if node == target:
+                instrumentation.count("cells_visited", len(closed) + 1)
+                path = [node]
+                while predecessors[path[-1]] >= 0:
+                    path.append(predecessors[path[-1]])
+                return path[::-1]
+            closed.add(node)
+
+            start, end = offsets[node], offsets[node + 1]
+            neighbours = targets[start:end]
+            # Heuristic of the neighbours only, so that short searches do not
+            # pay for the whole graph
+            heuristic = np.sqrt(np.sum((positions[neighbours] - goal) ** 2, axis=1))
+            for n, w, h in zip(
+                neighbours.tolist(), weights[start:end].tolist(), heuristic.tolist()
+            ):
+                new_distance = distance + w
+                if new_distance < distances.get(n, math.inf):
+                    distances[n] = new_distance
+                    predecessors[n] = node
+                    heapq.heappush(queue, (new_distance + h, new_distance, n))
+
+        instrumentation.count("cells_visited", len(closed))
+        return []
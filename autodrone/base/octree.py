@@ -1,7 +1,21 @@
-import networkx as nx
-from autodrone.base.mathutils import euclidian_distance
+import math
+
+import numpy as np
+from autodrone.base import instrumentation
+from autodrone.base.mathutils import as_points, distances_to_point
 from mathutils import Vector
-from autodrone.base.mathutils import blender_raycast
+from autodrone.base.navgraph import NavigationGraph
+from autodrone.base.raycast import EdgeVisibilityCache
+from autodrone.base.spatial import KDTree
+
+# Directions towards the 26 cells touching a cell by a face, an edge or a corner
+NEIGHBOUR_DIRECTIONS = [
+    (dx, dy, dz)
+    for dx in (-1, 0, 1)
+    for dy in (-1, 0, 1)
+    for dz in (-1, 0, 1)
+    if (dx, dy, dz) != (0, 0, 0)
+]
 
 
 class OctreeNode:
@@ -24,6 +38,8 @@ class OctreeNode:
 
         self.outgoing_graph_edges = 0
 
+        self.tree = None  # Octree holding this node, set by the Octree
+
     def __str__(self) -> str:
         return f"Octree Node {self.id}, center {self.center}, size {self.size}, children {self.children}, outgoing_graph_edges {self.outgoing_graph_edges}"
 
@@ -31,14 +47,14 @@ class OctreeNode:
         """Subdivide the node into eight child nodes
 
         Args:
-            node_class (_type_, optional): _description_. Defaults to None.
+            node_class (_type_, optional): Class of the child nodes. Defaults to None, meaning the class of this node.
 
         Raises:
             ValueError: _description_
         """
 
         if node_class is None:
-            node_class = OctreeNode
+            node_class = type(self)
         if self.children is None:
             self.children = list()
 
@@ -64,6 +80,11 @@ class OctreeNode:
 
                         child_id += 1
 
+            for child in self.children:
+                child.tree = self.tree
+            if self.tree is not None:
+                self.tree._invalidate_cell_cache()
+
         else:
             raise ValueError("Cannot subdivide a node which already has children.")
 
@@ -79,107 +100,394 @@ class Octree:
             node_class (_type_, optional): _description_. Defaults to OctreeNode.
         """
         self.root = node_class(center=root_center, size=root_size, id="root")
+        self.root.tree = self
         self.max_depth = max_depth
 
-    def to_graph(self, dist_threshold:float, top_k_neighbors:int):
+        # Cell lists and index by id, built on demand and invalidated by
+        # OctreeNode.subdivide
+        self._invalidate_cell_cache()
+
+        # Raycasting results are kept across calls to to_graph
+        self.edge_visibility = EdgeVisibilityCache()
+
+    @instrumentation.timed_function("to_graph")
+    def to_graph(
+        self,
+        dist_threshold: float = None,
+        top_k_neighbors: int = None,
+        processes: int = None,
+    ):
         """
-        Turn this into a networkx graph,
-        NOTE this is done so I can use A Star which is integrated in networkx
+        Turn this into a navigation graph, on which paths are searched with
+        A star or Dijkstra.
+
+        By default, each leaf cell is linked to the leaf cells it touches by a
+        face, an edge or a corner, which is derived from the structure of the
+        octree. Alternatively, if dist_threshold is given, each cell is linked
+        to its top_k_neighbors closest cells within dist_threshold.
 
         Args:
-            dist_threshold (float): _description_
-            top_k_neighbors (int): _description_
+            dist_threshold (float, optional): If given, link cells by distance instead of adjacency. Defaults to None.
+            top_k_neighbors (int, optional): When linking cells by distance, maximum number of neighbours of each cell. Only used with dist_threshold. Defaults to None.
+            processes (int, optional): If greater than 1, the adjacent cells are found, and the edges raycast if a MeshRaycaster is used, by this many worker processes, each handling a part of the space. See GraphBuildPool. Defaults to None.
 
         Returns:
-            _type_: _description_
+            NavigationGraph: Graph whose nodes are the leaf cells, in the order of get_all_cells(leaf_nodes_only=True). Use its to_networkx method to get a networkx graph.
         """
         # remove cells with children (ie. take only leaf nodes)
         # then just take neighboring cells and add a link between them
+        leaves = self.get_all_cells(leaf_nodes_only=True)
+
+        pool = None
+        if processes is not None and processes > 1:
+            # Imported here, as the parallel module depends on this one
+            from autodrone.base.parallel import GraphBuildPool
+
+            pool = GraphBuildPool(self, processes)
+
+        try:
+            if dist_threshold is None:
+                if pool is not None:
+                    candidate_edges = pool.adjacent_pairs(leaves)
+                else:
+                    candidate_edges = self._get_adjacent_pairs(leaves)
+            else:
+                candidate_edges = self._get_close_pairs(
+                    leaves, dist_threshold, top_k_neighbors
+                )
+
+            # Disallow moving into an occupied cell, and disallow the movement
+            # if a ray trace shows we would cross something.
+            candidate_edges = [
+                (cell, n)
+                for cell, n in candidate_edges
+                if not getattr(cell, "is_occupied", None)
+                and not getattr(n, "is_occupied", None)
+            ]
+            edges_are_blocked = self.edge_visibility.are_blocked(
+                candidate_edges,
+                raycast_many=(
+                    pool.raycast_many
+                    if pool is not None and pool.raycaster is not None
+                    else None
+                ),
+            )
+        finally:
+            if pool is not None:
+                pool.close()
+
+        # Each undirected edge is kept once, with the edge weight which is the distance
+        index_of = {cell.id: i for i, cell in enumerate(leaves)}
+        edges = dict()
+        for (cell, n), is_blocked in zip(candidate_edges, edges_are_blocked):
+            i, j = index_of[cell.id], index_of[n.id]
+            if not is_blocked and i != j:
+                edges[min(i, j), max(i, j)] = self.edge_weight(cell, n)
+        instrumentation.count("graph_edges_added", len(edges))
+
+        G = NavigationGraph.from_edges(
+            ids=[cell.id for cell in leaves],
+            positions=[tuple(cell.center) for cell in leaves],
+            sources=[i for i, _ in edges],
+            targets=[j for _, j in edges],
+            weights=list(edges.values()),
+        )
+
+        # Record amount of outgoing edges
+        for i, cell in enumerate(leaves):
+            cell.outgoing_graph_edges = G.degree(i)
 
-        G = nx.Graph()
-        for cell in self.get_all_cells(leaf_nodes_only=True):
-            neighbours = self.get_neighbours_of_cell(cell, dist_threshold)
+        return G
 
-            # Keep only top k neighbors which are closest
-            neighbours_weighted = {
-                n: euclidian_distance(cell.center, n.center) for n in neighbours
-            }
-            neighbours_sorted = sorted(
-                neighbours_weighted.items(), key=lambda x: x[1], reverse=False
+    @staticmethod
+    def edge_weight(cell, n) -> float:
+        """Weight of the graph edge between two cells : the distance between
+        their centers, so the straight line distance is a valid A star
+        heuristic."""
+        return math.dist(cell.center, n.center)
+
+    def _get_adjacent_pairs(self, leaves):
+        """Returns each pair of adjacent leaf cells once, as (cell, neighbour)."""
+        pairs = []
+        for cell in leaves:
+            for n in self.get_adjacent_cells(cell):
+                # Cells of the same size find each other : keep only one of
+                # the two pairs. Smaller neighbours are not returned by
+                # get_adjacent_cells, they record the pair from their side.
+                if n.size > cell.size or n.id > cell.id:
+                    pairs.append((cell, n))
+        return pairs
+
+    def _get_close_pairs(self, leaves, dist_threshold, top_k_neighbors):
+        """Returns, for each leaf cell, the pairs (cell, neighbour) with its
+        top_k_neighbors closest cells within dist_threshold."""
+        centers = as_points([tuple(cell.center) for cell in leaves])
+        k = len(leaves) if top_k_neighbors is None else min(top_k_neighbors, len(leaves))
+
+        # Keep only top k neighbors which are closest. The closest cell is the
+        # cell itself, at a distance of 0.
+        indices, distances = KDTree(centers).query(
+            centers, k=k + 1, max_distance=dist_threshold
+        )
+        found = (indices >= 0) & (distances > 0)
+        if not found.any(axis=1).all():
+            raise ValueError(
+                "No neighbors were found. Your dist_threshold must be too low for the scene considered."
             )
 
-            neighbours_final = [i[0] for i in neighbours_sorted[:top_k_neighbors]]
-
-            # Record amount of outgoing edges
-            cell.outgoing_graph_edges = 0
+        pairs = []
+        for cell, neighbours, cell_found in zip(leaves, indices, found):
+            pairs += [(cell, leaves[n]) for n in neighbours[cell_found][:k].tolist()]
+        return pairs
 
-            for n in neighbours_final:
+    def subdivide_leaves(self, node_class=None):
+        """Subdivide every leaf node of the tree once.
 
-                # Disallow moving into an occupied cell, and disallow the movement
-                # if a ray trace shows we would cross something.
-                ray_is_blocked_at_this_position = blender_raycast(cell.center, n.center)
-                print(f"BLOCKING {ray_is_blocked_at_this_position}")
+        Args:
+            node_class (_type_, optional): Class of the new nodes, passed to
+                OctreeNode.subdivide. Defaults to None.
+        """
+        for cell in self.get_all_cells(leaf_nodes_only=False):
+            if cell.children is None:
+                cell.subdivide(node_class=node_class)
+
+    def _storage_order(self):
+        """Returns all cells in breadth-first order, which keeps the eight
+        children of each cell contiguous (this is the layout of an ArrayOctree)."""
+        cells = [self.root]
+        i = 0
+        while i < len(cells):
+            if cells[i].children is not None:
+                cells += cells[i].children
+            i += 1
+        return cells
+
+    def storage_ids(self) -> list:
+        """Returns the id of each cell, in the order of the arrays of to_arrays."""
+        return [cell.id for cell in self._storage_order()]
+
+    def to_arrays(self) -> dict:
+        """Flattens the octree into NumPy arrays, in the layout of an
+        ArrayOctree, eg. to save it to disk.
 
-                if ray_is_blocked_at_this_position is None:
-                    print("Adding....")
-                    G.add_edge(
-                        cell.id,
-                        n.id,
-                        weight=euclidian_distance(
-                            cell.center, n.center
-                        ),  # Plus the edge weight which is the distance
-                    )
+        Returns:
+            dict: Arrays "centers", "sizes", "depths", "parents", "first_child",
+            "occupied", "vectors" and "outgoing_graph_edges", by name.
+        """
+        cells = self._storage_order()
+        first_child = np.full(len(cells), -1, dtype=np.int32)
+        parents = np.full(len(cells), -1, dtype=np.int32)
+        depths = np.zeros(len(cells), dtype=np.uint8)
+        next_index = 1
+        for i, cell in enumerate(cells):
+            if cell.children is not None:
+                first_child[i] = next_index
+                parents[next_index : next_index + 8] = i
+                depths[next_index : next_index + 8] = depths[i] + 1
+                next_index += 8
+
+        occupied = [getattr(cell, "is_occupied", None) for cell in cells]
+        return {
+            "centers": np.array([tuple(cell.center) for cell in cells], np.float64),
+            "sizes": np.array([cell.size for cell in cells], np.float64),
+            "depths": depths,
+            "parents": parents,
+            "first_child": first_child,
+            "occupied": np.array(
+                [-1 if o is None else int(bool(o)) for o in occupied], np.int8
+            ),
+            "vectors": np.array(
+                [tuple(getattr(cell, "vector", (0, 0, 0))) for cell in cells],
+                np.float32,
+            ),
+            "outgoing_graph_edges": np.array(
+                [cell.outgoing_graph_edges for cell in cells], np.int32
+            ),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict, max_depth=13):
+        """Rebuilds an octree from the arrays produced by to_arrays.
 
-                    cell.outgoing_graph_edges += 1
-        return G
+        Args:
+            arrays (dict): Arrays produced by to_arrays, possibly memory-mapped.
+            max_depth (int, optional): Maximum subdivision depth. Defaults to 13.
+        """
+        tree = cls(
+            root_center=Vector(arrays["centers"][0]),
+            root_size=float(arrays["sizes"][0]),
+            max_depth=max_depth,
+        )
+        tree._load_arrays(arrays)
+        return tree
+
+    def _load_arrays(self, arrays: dict):
+        first_child = arrays["first_child"]
+        cells = [self.root]
+        i = 0
+        while i < len(cells):
+            if first_child[i] >= 0:
+                cells[i].subdivide(node_class=type(cells[i]))
+                cells += cells[i].children
+            i += 1
+
+        for cell, occupied, vector, outgoing_graph_edges in zip(
+            cells,
+            arrays["occupied"].tolist(),
+            arrays["vectors"].tolist(),
+            arrays["outgoing_graph_edges"].tolist(),
+        ):
+            cell.outgoing_graph_edges = outgoing_graph_edges
+            if hasattr(cell, "vector"):
+                cell.vector = Vector(vector)
+                cell.is_occupied = None if occupied < 0 else bool(occupied)
+
+    def _invalidate_cell_cache(self):
+        self._all_cells = None
+        self._leaf_cells = None
+        self._cells_by_id = None
+        self._cell_centers = dict()
+        self._leaf_index = None
 
     def get_all_cells(self, leaf_nodes_only=False):
-        all_nodes = []
-        all_nodes.append(self.root)  # Remember to add the root !
+        if self._all_cells is None:
+            all_nodes = []
+            all_nodes.append(self.root)  # Remember to add the root !
 
-        def return_children(n, all_nodes):
-            if n.children is not None:
-                for c in n.children:
-                    all_nodes.append(c)
-                    return_children(c, all_nodes)
+            def return_children(n, all_nodes):
+                if n.children is not None:
+                    for c in n.children:
+                        all_nodes.append(c)
+                        return_children(c, all_nodes)
 
-            all_nodes = list(
-                set(all_nodes)
-            )  # Ensure no duplicates (should never happen, but just in case)
+            return_children(self.root, all_nodes)
 
-        return_children(self.root, all_nodes)
+            self._all_cells = all_nodes
+            self._leaf_cells = [n for n in all_nodes if n.children is None]
+            self._cells_by_id = {n.id: n for n in all_nodes}
 
+        # Return copies, so the caller can modify them without altering the cache
         if leaf_nodes_only:
-            for n in all_nodes:
-                if n.children is not None:
-                    all_nodes.remove(n)
+            return list(self._leaf_cells)
+        return list(self._all_cells)
+
+    def get_cell_centers(self, leaf_nodes_only=False) -> np.ndarray:
+        """Returns the centers of the cells returned by get_all_cells, in the
+        same order, as an array of shape (N, 3)."""
+        if leaf_nodes_only not in self._cell_centers:
+            self._cell_centers[leaf_nodes_only] = as_points(
+                [tuple(cell.center) for cell in self.get_all_cells(leaf_nodes_only)]
+            )
+        return self._cell_centers[leaf_nodes_only]
+
+    def get_leaf_index(self) -> KDTree:
+        """Returns a spatial index over the centers of the leaf cells, in the
+        order of get_all_cells(leaf_nodes_only=True). It is built on demand,
+        and built again after the octree is subdivided."""
+        if self._leaf_index is None:
+            self._leaf_index = KDTree(self.get_cell_centers(leaf_nodes_only=True))
+        return self._leaf_index
+
+    def get_cells_near(self, positions, radius) -> list:
+        """Returns the leaf cells whose center is within radius of each of the
+        positions, closest first.
+
+        Args:
+            positions (np.ndarray): Positions, of shape (N, 3).
+            radius (float or np.ndarray): Search radius, for all positions or for each of them.
 
-        return all_nodes
+        Returns:
+            List of N lists of leaf cells.
+        """
+        leaves = self.get_all_cells(leaf_nodes_only=True)
+        return [
+            [leaves[i] for i in indices.tolist()]
+            for indices in self.get_leaf_index().query_radius(positions, radius)
+        ]
 
     def get_cell_by_name(self, id: str):
-        for cell in self.get_all_cells():
-            if cell.id == id:
-                return cell
-        return None
+        if self._cells_by_id is None:
+            self.get_all_cells()
+        return self._cells_by_id.get(id)
+
+    def locate_cell(self, pos: tuple):
+        """Returns the leaf cell containing the position, by descending the
+        tree octant by octant. This is O(depth).
+
+        Args:
+            pos (tuple): The position to locate.
+
+        Returns:
+            The leaf cell containing pos, or None if pos is outside the root cell.
+        """
+        x, y, z = pos
+        node = self.root
+        cx, cy, cz = node.center
+        half_size = node.size / 2
+        if abs(x - cx) > half_size or abs(y - cy) > half_size or abs(z - cz) > half_size:
+            return None
+
+        while node.children is not None:
+            cx, cy, cz = node.center
+            # Children are created in x, then y, then z order (see OctreeNode.subdivide)
+            octant = 4 * (x >= cx) + 2 * (y >= cy) + (z >= cz)
+            node = node.children[octant]
+        return node
 
     def get_closest_cell_to_position(self, pos: tuple, leaf_nodes_only=True):
-        min_dist = float("inf")
-        output = self.root
-        for cell in self.get_all_cells(leaf_nodes_only=leaf_nodes_only):
-            dist = euclidian_distance(pos, cell.center)
-            if dist < min_dist:
-                output = cell
-                min_dist = dist
-        return output
+        if leaf_nodes_only:
+            cell = self.locate_cell(pos)
+            if cell is not None:
+                return cell
+
+            # The position is outside of the root cell : fall back to the
+            # nearest leaf
+            indices, _ = self.get_leaf_index().query(pos, k=1)
+            return self.get_all_cells(leaf_nodes_only=True)[int(indices[0, 0])]
+
+        # Internal nodes are not indexed : search among all cells
+        distances = distances_to_point(self.get_cell_centers(), pos)
+        return self.get_all_cells()[int(np.argmin(distances))]
+
+    def get_adjacent_cells(self, cell):
+        """Returns the leaf cells touching the given leaf cell by a face, an
+        edge or a corner, and which are at least as large as it.
+
+        Each of the 26 directions is probed at the center of the neighbouring
+        cell of the same size. If the leaf found there is at least as large
+        as the cell, it contains that whole neighbouring position and touches
+        the cell. Otherwise this region is subdivided further, and its
+        smaller leaves will find the cell from their side.
+
+        Args:
+            cell: A leaf cell of this octree.
+
+        Returns:
+            List of adjacent leaf cells.
+        """
+        result = []
+        cx, cy, cz = cell.center
+        for dx, dy, dz in NEIGHBOUR_DIRECTIONS:
+            candidate = self.locate_cell(
+                (cx + dx * cell.size, cy + dy * cell.size, cz + dz * cell.size)
+            )
+            # A large neighbour can be found in several directions
+            if (
+                candidate is not None
+                and candidate.size >= cell.size
+                and candidate not in result
+            ):
+                result.append(candidate)
+        return result
 
     def get_neighbours_of_cell(self, cell, dist_threshold):
         # get top K cells which are closest to cell's center but are not the cell
         # return them
-        result = []
-        for candidate in self.get_all_cells(leaf_nodes_only=True):
-            dist = euclidian_distance(candidate.center, cell.center)
-            if dist != 0 and dist <= dist_threshold:
-                result.append(candidate)
+        result = [
+            candidate
+            for candidate in self.get_cells_near(cell.center, dist_threshold)[0]
+            if candidate.id != cell.id
+        ]
 
         if len(result) == 0:
             raise ValueError(
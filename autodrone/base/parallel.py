@@ -0,0 +1,148 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from mathutils import Vector
+
+from autodrone.base.array_octree import ArrayOctree
+from autodrone.base.raycast import MeshRaycaster
+
+# Copy of the octree and of the raycaster in each worker process, set once
+# when the worker starts
+_worker = dict()
+
+
+def _init_worker(arrays, max_depth, raycaster):
+    _worker["octree"] = ArrayOctree.from_arrays(arrays, max_depth=max_depth)
+    _worker["raycaster"] = raycaster
+
+
+def _adjacent_index_pairs(leaf_indices):
+    return _worker["octree"].adjacent_index_pairs(leaf_indices)
+
+
+def _intersect_segments(origins, targets):
+    return _worker["raycaster"].intersect_segments(origins, targets)
+
+
+def spatial_partitions(positions, root_center, root_size, count: int) -> list:
+    """Groups positions by the octant of the root cell containing them. If more
+    than 8 groups are wanted, octants are split again into smaller octants.
+
+    Args:
+        positions (np.ndarray): Positions, of shape (N, 3).
+        root_center (Vector): Center of the root cell.
+        root_size (float): Side length of the root cell.
+        count (int): Minimum number of octants to split the root cell into.
+
+    Returns:
+        List of arrays of indices into positions, one for each non-empty octant.
+    """
+    level = 1
+    while 8**level < count:
+        level += 1
+    resolution = 2**level
+
+    corner = np.asarray(root_center, dtype=np.float64) - root_size / 2
+    grid = np.floor((positions - corner) / root_size * resolution).astype(np.int64)
+    grid = np.clip(grid, 0, resolution - 1)
+    keys = (grid[:, 0] * resolution + grid[:, 1]) * resolution + grid[:, 2]
+
+    _, groups = np.unique(keys, return_inverse=True)
+    order = np.argsort(groups, kind="stable")
+    return np.split(order, np.cumsum(np.bincount(groups))[:-1])
+
+
+def _fork_context():
+    # Forked workers inherit the arrays instead of receiving them pickled.
+    # Elsewhere (Windows), the default start method is used.
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+class GraphBuildPool:
+    def __init__(self, octree, processes: int):
+        """Worker processes computing the edges of the navigation graph of an
+        octree in parallel, for Octree.to_graph.
+
+        The leaves are split into spatial partitions (the octants of the
+        root), and each worker finds the adjacent cells of a partition on its
+        own copy of the octree. If the octree checks its edges with a
+        MeshRaycaster, the rays are also cast by the workers. Rays cast in
+        Blender can only be cast by the Blender process itself.
+
+        Args:
+            octree (Octree): Octree whose graph is built. It must not be subdivided while the pool is open.
+            processes (int): Number of worker processes.
+        """
+        self.octree = octree
+        self.processes = processes
+        self._arrays = octree.to_arrays()
+        self._cells = octree._storage_order()
+        self._index_of = {cell_id: i for i, cell_id in enumerate(octree.storage_ids())}
+
+        raycaster = getattr(octree.edge_visibility.raycast_many, "__self__", None)
+        if not isinstance(raycaster, MeshRaycaster):
+            raycaster = None
+        self.raycaster = raycaster
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=_fork_context(),
+            initializer=_init_worker,
+            initargs=(self._arrays, octree.max_depth, raycaster),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+    def adjacent_pairs(self, leaves) -> list:
+        """Same as Octree._get_adjacent_pairs, computed by the workers."""
+        leaf_indices = np.array(
+            [self._index_of[cell.id] for cell in leaves], dtype=np.int64
+        )
+        partitions = spatial_partitions(
+            self._arrays["centers"][leaf_indices],
+            self.octree.root.center,
+            self.octree.root.size,
+            self.processes,
+        )
+
+        pairs = self._executor.map(
+            _adjacent_index_pairs, [leaf_indices[p] for p in partitions]
+        )
+        return [
+            (self._cells[a], self._cells[b])
+            for partition_pairs in pairs
+            for a, b in partition_pairs.tolist()
+        ]
+
+    def raycast_many(self, origins, targets):
+        """Same as MeshRaycaster.raycast_many, computed by the workers. Only
+        available if the octree checks its edges with a MeshRaycaster."""
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+
+        chunks = np.array_split(
+            np.arange(len(origins)), min(4 * self.processes, max(1, len(origins) // 1024))
+        )
+        t = np.concatenate(
+            list(
+                self._executor.map(
+                    _intersect_segments,
+                    [origins[c] for c in chunks],
+                    [targets[c] for c in chunks],
+                )
+            )
+        )
+        return [
+            Vector(o + t_hit * (target - o)) if np.isfinite(t_hit) else None
+            for o, target, t_hit in zip(origins, targets, t)
+        ]
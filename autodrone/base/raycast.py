@@ -0,0 +1,526 @@
+import numpy as np
+from mathutils import Vector
+
+from autodrone.base import instrumentation
+from autodrone.base.mathutils import blender_raycast_many
+
+
+class EdgeVisibilityCache:
+    def __init__(self, raycast_many=blender_raycast_many):
+        """Remembers which edges between two cells are blocked by the scene, so
+        each edge is only raycast once.
+
+        Edges are undirected and keyed by the ids of their two cells : the
+        edges A->B and B->A share one entry and one ray. When part of the scene
+        changes, only the edges touching the affected cells need to be
+        invalidated, and the next query only casts rays for those.
+
+        Args:
+            raycast_many (callable, optional): Function taking a list of
+                origins and a list of targets, and returning for each segment
+                a hit location or None if it is unobstructed. Defaults to
+                blender_raycast_many.
+        """
+        self.raycast_many = raycast_many
+        self._blocked = dict()
+
+    def __len__(self) -> int:
+        return len(self._blocked)
+
+    @staticmethod
+    def key(id_a, id_b) -> tuple:
+        """Key of the undirected edge between the cells id_a and id_b."""
+        return (id_a, id_b) if id_a <= id_b else (id_b, id_a)
+
+    @instrumentation.timed_function("raycast_edges")
+    def are_blocked(self, edges, raycast_many=None) -> list:
+        """Checks whether each edge is blocked by the scene, casting one ray for
+        each undirected edge not seen before, in a single batch.
+
+        Args:
+            edges (list): List of (cell, neighbour) pairs.
+            raycast_many (callable, optional): Casts the missing rays instead of self.raycast_many, eg. in parallel. It must see the same scene. Defaults to None.
+
+        Returns:
+            List of booleans, True if the corresponding edge is blocked.
+        """
+        missing = dict()
+        for cell, n in edges:
+            key = self.key(cell.id, n.id)
+            if key not in self._blocked and key not in missing:
+                missing[key] = (cell.center, n.center)
+
+        instrumentation.count("edges_checked", len(edges))
+        if len(missing) > 0:
+            instrumentation.count("rays_cast", len(missing))
+            segments = list(missing.values())
+            hits = (raycast_many or self.raycast_many)(
+                [origin for origin, _ in segments],
+                [target for _, target in segments],
+            )
+            for key, hit in zip(missing, hits):
+                self._blocked[key] = hit is not None
+
+        return [self._blocked[self.key(cell.id, n.id)] for cell, n in edges]
+
+    def invalidate(self, cell_ids):
+        """Forgets every edge touching one of the given cells, so they are
+        raycast again at the next query.
+
+        Args:
+            cell_ids (iterable): Ids of the cells whose surroundings changed.
+        """
+        cell_ids = set(cell_ids)
+        self._blocked = {
+            key: blocked
+            for key, blocked in self._blocked.items()
+            if key[0] not in cell_ids and key[1] not in cell_ids
+        }
+
+    def clear(self):
+        self._blocked.clear()
+
+
+class MeshRaycaster:
+    def __init__(self, triangles, leaf_size=8, batch_size=65536):
+        """Raycaster working on the triangles of the scene mesh with NumPy only,
+        so it does not need a running Blender.
+
+        The triangles are organized once into a bounding volume hierarchy
+        (BVH), which is then traversed for many segments at once.
+        Its raycast_many method can replace blender_raycast_many, eg. in an
+        EdgeVisibilityCache.
+
+        Args:
+            triangles (np.ndarray): Array of shape (T, 3, 3) giving the three vertices of each triangle.
+            leaf_size (int, optional): Maximum number of triangles in a leaf of the BVH. Defaults to 8.
+            batch_size (int, optional): Number of segments traversing the BVH together, which bounds memory usage. Defaults to 65536.
+        """
+        self.triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)
+        self.leaf_size = leaf_size
+        self.batch_size = batch_size
+        self._build_bvh()
+
+    # ------------------------------ Loading --------------------------------- #
+
+    @classmethod
+    def from_obj(cls, path, **kwargs):
+        """Loads the triangles of a Wavefront OBJ file. Polygons are split into
+        triangles.
+
+        Args:
+            path (str): Path to the .obj file.
+        """
+        vertices = []
+        faces = []
+        with open(path) as file:
+            for line in file:
+                values = line.split()
+                if len(values) == 0:
+                    continue
+                if values[0] == "v":
+                    vertices.append([float(v) for v in values[1:4]])
+                elif values[0] == "f":
+                    # Face elements are "v", "v/vt", "v//vn" or "v/vt/vn", 1-indexed
+                    # and counted from the end when negative
+                    indices = [int(v.split("/")[0]) for v in values[1:]]
+                    indices = [
+                        i - 1 if i > 0 else len(vertices) + i for i in indices
+                    ]
+                    faces.append(indices)
+
+        return cls(cls._triangulate(np.array(vertices), faces), **kwargs)
+
+    @classmethod
+    def from_ply(cls, path, **kwargs):
+        """Loads the triangles of a PLY file, in ascii or binary_little_endian
+        format. Polygons are split into triangles.
+
+        Args:
+            path (str): Path to the .ply file.
+        """
+        # fmt: off
+        ply_types = {
+            "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+            "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+            "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+            "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+        }
+        # fmt: on
+
+        with open(path, "rb") as file:
+            # Parse the header
+            elements = []
+            file_format = None
+            while True:
+                line = file.readline().decode("ascii").strip()
+                values = line.split()
+                if len(values) == 0:
+                    continue
+                if values[0] == "format":
+                    file_format = values[1]
+                elif values[0] == "element":
+                    elements.append((values[1], int(values[2]), []))
+                elif values[0] == "property":
+                    elements[-1][2].append(values[1:])
+                elif values[0] == "end_header":
+                    break
+
+            if file_format not in ("ascii", "binary_little_endian"):
+                raise ValueError(f"Unsupported PLY format {file_format}")
+            is_ascii = file_format == "ascii"
+            data = file.read()
+
+        offset = 0
+        lines = data.decode("ascii").split("\n") if is_ascii else None
+        vertices, faces = None, []
+        for name, count, properties in elements:
+            if name == "vertex":
+                dtype = np.dtype(
+                    [(p[-1], "<" + ply_types[p[0]]) for p in properties]
+                )
+                if is_ascii:
+                    rows = [lines[offset + i].split() for i in range(count)]
+                    table = np.array(rows, dtype=np.float64)
+                    columns = [p[-1] for p in properties]
+                    vertices = table[:, [columns.index(c) for c in "xyz"]]
+                    offset += count
+                else:
+                    table = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+                    vertices = np.stack([table[c] for c in "xyz"], axis=1)
+                    offset += count * dtype.itemsize
+
+            elif name == "face":
+                # Only the list of vertex indices is expected for faces
+                _, count_type, index_type, _ = properties[0]
+                count_dtype = np.dtype("<" + ply_types[count_type])
+                index_dtype = np.dtype("<" + ply_types[index_type])
+                for _ in range(count):
+                    if is_ascii:
+                        values = lines[offset].split()
+                        faces.append([int(v) for v in values[1 : 1 + int(values[0])]])
+                        offset += 1
+                    else:
+                        n = int(np.frombuffer(data, count_dtype, 1, offset)[0])
+                        offset += count_dtype.itemsize
+                        faces.append(np.frombuffer(data, index_dtype, n, offset))
+                        offset += n * index_dtype.itemsize
+            else:
+                raise ValueError(f"Unsupported PLY element {name}")
+
+        return cls(cls._triangulate(np.asarray(vertices), faces), **kwargs)
+
+    @classmethod
+    def from_blender_scene(cls, exclude=(), **kwargs):
+        """Loads the triangles of every mesh of the current Blender scene, with
+        their modifiers and transforms applied.
+
+        Args:
+            exclude (iterable, optional): Names of objects to ignore, eg. "Navigator". Defaults to ().
+        """
+        import bpy
+
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        triangles = []
+        for obj in bpy.context.scene.objects:
+            if obj.type != "MESH" or obj.name in exclude:
+                continue
+            evaluated = obj.evaluated_get(depsgraph)
+            mesh = evaluated.to_mesh()
+            mesh.calc_loop_triangles()
+
+            vertices = np.empty(len(mesh.vertices) * 3)
+            mesh.vertices.foreach_get("co", vertices)
+            vertices = vertices.reshape(-1, 3)
+            matrix = np.array(evaluated.matrix_world)
+            vertices = vertices @ matrix[:3, :3].T + matrix[:3, 3]
+
+            indices = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int64)
+            mesh.loop_triangles.foreach_get("vertices", indices)
+            triangles.append(vertices[indices.reshape(-1, 3)])
+            evaluated.to_mesh_clear()
+
+        return cls(np.concatenate(triangles, axis=0), **kwargs)
+
+    def write_obj(self, path):
+        """Writes the triangles to a Wavefront OBJ file, eg. to export the scene
+        once from Blender and build graphs without it later.
+
+        Args:
+            path (str): Path of the .obj file to write.
+        """
+        with open(path, "w") as file:
+            for v in self.triangles.reshape(-1, 3):
+                file.write(f"v {v[0]:.9g} {v[1]:.9g} {v[2]:.9g}\n")
+            for i in range(len(self.triangles)):
+                file.write(f"f {3 * i + 1} {3 * i + 2} {3 * i + 3}\n")
+
+    @staticmethod
+    def _triangulate(vertices, faces):
+        """Splits polygons into a fan of triangles."""
+        triangles = [
+            (face[0], face[i], face[i + 1])
+            for face in faces
+            for i in range(1, len(face) - 1)
+        ]
+        return vertices[np.array(triangles, dtype=np.int64).reshape(-1, 3)]
+
+    # -------------------------------- BVH ----------------------------------- #
+
+    def _build_bvh(self):
+        """Builds the BVH by recursively splitting the triangles at the median
+        of their centroids, along the axis where the centroids spread the most.
+
+        The BVH is stored as flat arrays : node bounds, the index of both
+        children (-1 for leaves), and for leaves the range of triangles they
+        hold in self.triangles, which is reordered accordingly.
+        """
+        triangle_min = self.triangles.min(axis=1)
+        triangle_max = self.triangles.max(axis=1)
+        centroids = self.triangles.mean(axis=1)
+        order = np.arange(len(self.triangles))
+
+        bounds_min, bounds_max, left, right, start, count = [], [], [], [], [], []
+
+        def new_node(first, last):
+            tris = order[first:last]
+            bounds_min.append(triangle_min[tris].min(axis=0))
+            bounds_max.append(triangle_max[tris].max(axis=0))
+            left.append(-1)
+            right.append(-1)
+            start.append(first)
+            count.append(last - first)
+            return len(left) - 1
+
+        if len(order) == 0:
+            raise ValueError("Cannot build a raycaster without triangles.")
+
+        stack = [(new_node(0, len(order)), 0, len(order))]
+        while len(stack) > 0:
+            node, first, last = stack.pop()
+            if last - first <= self.leaf_size:
+                continue
+
+            tris = order[first:last]
+            spread = centroids[tris].max(axis=0) - centroids[tris].min(axis=0)
+            axis = np.argmax(spread)
+            middle = (last - first) // 2
+            split = np.argpartition(centroids[tris, axis], middle)
+            order[first:last] = tris[split]
+
+            left[node] = new_node(first, first + middle)
+            right[node] = new_node(first + middle, last)
+            count[node] = 0
+            stack.append((left[node], first, first + middle))
+            stack.append((right[node], first + middle, last))
+
+        self.triangles = self.triangles[order]
+        self.bvh_min = np.array(bounds_min)
+        self.bvh_max = np.array(bounds_max)
+        self.bvh_left = np.array(left, dtype=np.int64)
+        self.bvh_right = np.array(right, dtype=np.int64)
+        self.bvh_start = np.array(start, dtype=np.int64)
+        self.bvh_count = np.array(count, dtype=np.int64)
+
+    # ------------------------------- Queries -------------------------------- #
+
+    def intersect_segments(self, origins, targets) -> np.ndarray:
+        """Finds the first intersection of each segment with the mesh.
+
+        Args:
+            origins (np.ndarray): Start points of the segments, of shape (N, 3).
+            targets (np.ndarray): End points of the segments, of shape (N, 3).
+
+        Returns:
+            Array of N floats, the position of the first hit along each segment
+            between 0 (origin) and 1 (target), or inf if the segment does not
+            hit the mesh.
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+
+        result = np.full(len(origins), np.inf)
+        for first in range(0, len(origins), self.batch_size):
+            last = first + self.batch_size
+            result[first:last] = self._intersect_batch(
+                origins[first:last], targets[first:last]
+            )
+        return result
+
+    def segments_are_blocked(self, origins, targets) -> np.ndarray:
+        """Returns a boolean array, True for the segments which hit the mesh."""
+        return np.isfinite(self.intersect_segments(origins, targets))
+
+    def raycast_many(self, origins, targets):
+        """Same interface as blender_raycast_many : returns, for each segment,
+        the location of its first hit, or None if it is unobstructed."""
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+        t = self.intersect_segments(origins, targets)
+        return [
+            Vector(o + t_hit * (target - o)) if np.isfinite(t_hit) else None
+            for o, target, t_hit in zip(origins, targets, t)
+        ]
+
+    def boxes_intersect(self, centers, half_sizes) -> np.ndarray:
+        """Checks which axis-aligned boxes (eg. octree cells) intersect a
+        triangle of the mesh. A box completely inside a closed mesh does not
+        intersect its surface.
+
+        Args:
+            centers (np.ndarray): Centers of the boxes, of shape (N, 3).
+            half_sizes (np.ndarray): Half side length of the boxes, of shape (N,). Add a margin to it to also find boxes close to the mesh.
+
+        Returns:
+            Boolean array of shape (N,), True for the boxes touching the mesh.
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+        half_sizes = np.broadcast_to(
+            np.asarray(half_sizes, dtype=np.float64).reshape(-1, 1), centers.shape
+        )
+
+        result = np.zeros(len(centers), dtype=bool)
+        for first in range(0, len(centers), self.batch_size):
+            last = first + self.batch_size
+            result[first:last] = self._boxes_intersect_batch(
+                centers[first:last], half_sizes[first:last]
+            )
+        return result
+
+    def _boxes_intersect_batch(self, centers, half_sizes):
+        result = np.zeros(len(centers), dtype=bool)
+
+        # Pairs of (box, BVH node) left to test, starting from the root
+        boxes = np.arange(len(centers))
+        nodes = np.zeros(len(centers), dtype=np.int64)
+        while len(boxes) > 0:
+            overlap = np.all(
+                (self.bvh_min[nodes] <= centers[boxes] + half_sizes[boxes])
+                & (self.bvh_max[nodes] >= centers[boxes] - half_sizes[boxes]),
+                axis=1,
+            )
+            # Boxes already known to intersect need no further test
+            keep = overlap & ~result[boxes]
+            boxes, nodes = boxes[keep], nodes[keep]
+
+            is_leaf = self.bvh_left[nodes] < 0
+            leaf_boxes, leaf_nodes = boxes[is_leaf], nodes[is_leaf]
+            if len(leaf_boxes) > 0:
+                counts = self.bvh_count[leaf_nodes]
+                pair_boxes = np.repeat(leaf_boxes, counts)
+                offsets = np.arange(len(pair_boxes)) - np.repeat(
+                    np.cumsum(counts) - counts, counts
+                )
+                triangles = self.triangles[
+                    np.repeat(self.bvh_start[leaf_nodes], counts) + offsets
+                ]
+                hit = self._triangles_intersect_boxes(
+                    triangles, centers[pair_boxes], half_sizes[pair_boxes]
+                )
+                result[pair_boxes[hit]] = True
+
+            boxes, nodes = boxes[~is_leaf], nodes[~is_leaf]
+            boxes = np.concatenate([boxes, boxes])
+            nodes = np.concatenate([self.bvh_left[nodes], self.bvh_right[nodes]])
+
+        return result
+
+    @staticmethod
+    def _triangles_intersect_boxes(triangles, centers, half_sizes):
+        """Separating axis test between each triangle and its box : they do not
+        intersect if their projections are disjoint on one of the box normals,
+        the triangle normal, or the cross products of both."""
+        vertices = triangles - centers[:, None, :]
+        separated = np.any(
+            (vertices.min(axis=1) > half_sizes) | (vertices.max(axis=1) < -half_sizes),
+            axis=1,
+        )
+
+        edges = np.roll(vertices, -1, axis=1) - vertices
+        normals = np.cross(edges[:, 0], edges[:, 1])
+        distance = np.abs(np.einsum("ij,ij->i", normals, vertices[:, 0]))
+        separated |= distance > np.einsum("ij,ij->i", np.abs(normals), half_sizes)
+
+        for axis in np.eye(3):
+            # Axes orthogonal to both this box normal and each triangle edge
+            axes = np.cross(axis, edges)
+            projections = np.einsum("mjc,mkc->mjk", axes, vertices)
+            radius = np.einsum("mjc,mc->mj", np.abs(axes), half_sizes)
+            separated |= np.any(
+                (projections.min(axis=2) > radius)
+                | (projections.max(axis=2) < -radius),
+                axis=1,
+            )
+
+        return ~separated
+
+    def _intersect_batch(self, origins, targets):
+        directions = targets - origins
+        # Avoid divisions by zero for axis-aligned segments : a huge inverse
+        # keeps the slab test correct.
+        safe_directions = np.where(directions == 0, 1e-300, directions)
+        inverse_directions = 1 / safe_directions
+
+        t_best = np.full(len(origins), np.inf)
+
+        # Pairs of (segment, BVH node) left to test, starting from the root
+        rays = np.arange(len(origins))
+        nodes = np.zeros(len(origins), dtype=np.int64)
+        while len(rays) > 0:
+            # Slab test against the bounding box of each node, keeping only
+            # the boxes crossed before the end of the segment and the best hit
+            o, inv = origins[rays], inverse_directions[rays]
+            t1 = (self.bvh_min[nodes] - o) * inv
+            t2 = (self.bvh_max[nodes] - o) * inv
+            t_enter = np.maximum(np.minimum(t1, t2).max(axis=1), 0)
+            t_exit = np.minimum(np.maximum(t1, t2).min(axis=1), 1)
+            crossed = (t_enter <= t_exit) & (t_enter <= t_best[rays])
+            rays, nodes = rays[crossed], nodes[crossed]
+
+            is_leaf = self.bvh_left[nodes] < 0
+            self._intersect_leaves(
+                origins, directions, rays[is_leaf], nodes[is_leaf], t_best
+            )
+
+            rays, nodes = rays[~is_leaf], nodes[~is_leaf]
+            rays = np.concatenate([rays, rays])
+            nodes = np.concatenate([self.bvh_left[nodes], self.bvh_right[nodes]])
+
+        return t_best
+
+    def _intersect_leaves(self, origins, directions, rays, nodes, t_best):
+        """Moller-Trumbore intersection of each segment with every triangle of
+        its leaf, updating t_best in place."""
+        if len(rays) == 0:
+            return
+        counts = self.bvh_count[nodes]
+        rays = np.repeat(rays, counts)
+        # Index of each triangle within its leaf, then in self.triangles
+        offsets = np.arange(len(rays)) - np.repeat(np.cumsum(counts) - counts, counts)
+        triangles = self.triangles[np.repeat(self.bvh_start[nodes], counts) + offsets]
+
+        o, d = origins[rays], directions[rays]
+        v0 = triangles[:, 0]
+        edge1 = triangles[:, 1] - v0
+        edge2 = triangles[:, 2] - v0
+
+        p = np.cross(d, edge2)
+        determinant = np.einsum("ij,ij->i", edge1, p)
+        parallel = np.abs(determinant) < 1e-12
+        inverse_determinant = 1 / np.where(parallel, 1, determinant)
+
+        s = o - v0
+        u = np.einsum("ij,ij->i", s, p) * inverse_determinant
+        q = np.cross(s, edge1)
+        v = np.einsum("ij,ij->i", d, q) * inverse_determinant
+        t = np.einsum("ij,ij->i", edge2, q) * inverse_determinant
+
+        hit = (
+            ~parallel
+            & (u >= 0)
+            & (v >= 0)
+            & (u + v <= 1)
+            & (t >= 0)
+            & (t <= 1)
+        )
+        np.minimum.at(t_best, rays[hit], t[hit])
@@ -0,0 +1,227 @@
+import numpy as np
+
+from autodrone.base.mathutils import as_points
+
+
+class KDTree:
+    def __init__(self, points, leaf_size=16, batch_size=65536):
+        """Spatial index over a set of points (eg. the centers of the leaf
+        cells of an octree), answering nearest neighbour and radius queries
+        for many query points at once, with NumPy only.
+
+        The points are organized once into a k-d tree, stored as flat arrays
+        like the BVH of MeshRaycaster. Queries traverse it for all query
+        points together, so the cost of a query is logarithmic in the number
+        of points instead of linear. The tree does not support updates :
+        build a new one when the points change.
+
+        Args:
+            points (np.ndarray): Points to index, of shape (N, 3).
+            leaf_size (int, optional): Maximum number of points in a leaf of the tree. Defaults to 16.
+            batch_size (int, optional): Number of query points traversing the tree together, which bounds memory usage. Defaults to 65536.
+        """
+        self.points = as_points(points)
+        self.leaf_size = leaf_size
+        self.batch_size = batch_size
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _build(self):
+        """Builds the tree by recursively splitting the points at their median,
+        along the axis where they spread the most.
+
+        Nodes are stored as flat arrays : bounding box, index of both children
+        (-1 for leaves), and the range of points they hold in self.order,
+        which lists the indices of the points, grouped by leaf.
+        """
+        order = np.arange(len(self.points))
+        bounds_min, bounds_max, left, right, start, count = [], [], [], [], [], []
+
+        def new_node(first, last):
+            node_points = self.points[order[first:last]]
+            if len(node_points) > 0:
+                bounds_min.append(node_points.min(axis=0))
+                bounds_max.append(node_points.max(axis=0))
+            else:
+                # Only for an empty tree : a box which is never reached
+                bounds_min.append(np.full(3, np.inf))
+                bounds_max.append(np.full(3, -np.inf))
+            left.append(-1)
+            right.append(-1)
+            start.append(first)
+            count.append(last - first)
+            return len(left) - 1
+
+        stack = [(new_node(0, len(order)), 0, len(order))]
+        while len(stack) > 0:
+            node, first, last = stack.pop()
+            if last - first <= self.leaf_size:
+                continue
+
+            indices = order[first:last]
+            spread = bounds_max[node] - bounds_min[node]
+            axis = np.argmax(spread)
+            middle = (last - first) // 2
+            split = np.argpartition(self.points[indices, axis], middle)
+            order[first:last] = indices[split]
+
+            left[node] = new_node(first, first + middle)
+            right[node] = new_node(first + middle, last)
+            stack.append((left[node], first, first + middle))
+            stack.append((right[node], first + middle, last))
+
+        # Unlike the BVH, internal nodes keep their range of points, which is
+        # used to bound the distance of the k nearest neighbours
+        self.order = order
+        self.node_min = np.array(bounds_min)
+        self.node_max = np.array(bounds_max)
+        self.node_left = np.array(left, dtype=np.int64)
+        self.node_right = np.array(right, dtype=np.int64)
+        self.node_start = np.array(start, dtype=np.int64)
+        self.node_count = np.array(count, dtype=np.int64)
+
+    # ------------------------------- Queries -------------------------------- #
+
+    def query(self, queries, k: int, max_distance: float = None):
+        """Finds the k points closest to each query point. Same results as
+        mathutils.k_nearest, up to the order of points at equal distances.
+
+        Args:
+            queries (np.ndarray): Query points, of shape (Q, 3).
+            k (int): Number of neighbours to return for each query.
+            max_distance (float, optional): Neighbours farther than this are not returned. Defaults to None.
+
+        Returns:
+            Tuple (indices, distances) of arrays of shape (Q, k), sorted by
+            increasing distance. Missing neighbours (fewer than k points, or
+            beyond max_distance) have index -1 and distance inf.
+        """
+        queries = as_points(queries)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf)
+        k_found = min(k, len(self.points))
+        if k_found == 0 or len(queries) == 0:
+            return indices, distances
+
+        for first in range(0, len(queries), self.batch_size):
+            batch = queries[first : first + self.batch_size]
+
+            # The k nearest neighbours are at most as far as the k-th closest
+            # point of any node holding at least k points : find a small one
+            # around each query, then search within that radius.
+            radii = self._kth_distance_bound(batch, k_found)
+            if max_distance is not None:
+                radii = np.minimum(radii, max_distance)
+            pair_queries, pair_points, pair_distances = self._radius_pairs(batch, radii)
+
+            # Keep the k closest points of each query
+            order = np.lexsort((pair_distances, pair_queries))
+            pair_queries = pair_queries[order]
+            rank = np.arange(len(pair_queries)) - np.searchsorted(
+                pair_queries, pair_queries
+            )
+            keep = rank < k_found
+            rows, columns = first + pair_queries[keep], rank[keep]
+            indices[rows, columns] = pair_points[order][keep]
+            distances[rows, columns] = pair_distances[order][keep]
+        return indices, distances
+
+    def query_radius(self, queries, radius) -> list:
+        """Finds the points within a distance of each query point.
+
+        Args:
+            queries (np.ndarray): Query points, of shape (Q, 3).
+            radius (float or np.ndarray): Search radius, for all queries or for each of them.
+
+        Returns:
+            List of Q arrays of point indices, sorted by increasing distance.
+        """
+        queries = as_points(queries)
+        radii = np.broadcast_to(np.asarray(radius, dtype=np.float64), len(queries))
+
+        result = []
+        for first in range(0, len(queries), self.batch_size):
+            batch = slice(first, first + self.batch_size)
+            pair_queries, pair_points, pair_distances = self._radius_pairs(
+                queries[batch], radii[batch]
+            )
+            order = np.lexsort((pair_distances, pair_queries))
+            bounds = np.searchsorted(
+                pair_queries[order], np.arange(len(queries[batch]) + 1)
+            )
+            result += np.split(pair_points[order], bounds[1:-1])
+        return result
+
+    def _radius_pairs(self, queries, radii):
+        """Returns the arrays (query, point, distance) of every point within
+        the radius of its query."""
+        found_queries, found_points, found_distances = [], [], []
+
+        # Pairs of (query, node) left to visit, starting from the root
+        pairs = np.arange(len(queries))
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        while len(pairs) > 0:
+            # Skip the nodes whose bounding box is out of reach
+            q = queries[pairs]
+            gap = np.maximum(self.node_min[nodes] - q, 0) + np.maximum(
+                q - self.node_max[nodes], 0
+            )
+            # (with some slack for rounding errors, as this only prunes nodes)
+            reached = np.linalg.norm(gap, axis=1) <= radii[pairs] * (1 + 1e-9)
+            pairs, nodes = pairs[reached], nodes[reached]
+
+            is_leaf = self.node_left[nodes] < 0
+            leaf_pairs, points = self._points_of_nodes(pairs[is_leaf], nodes[is_leaf])
+            d = np.linalg.norm(self.points[points] - queries[leaf_pairs], axis=1)
+            inside = d <= radii[leaf_pairs]
+            found_queries.append(leaf_pairs[inside])
+            found_points.append(points[inside])
+            found_distances.append(d[inside])
+
+            pairs, nodes = pairs[~is_leaf], nodes[~is_leaf]
+            pairs = np.concatenate([pairs, pairs])
+            nodes = np.concatenate([self.node_left[nodes], self.node_right[nodes]])
+
+        return (
+            np.concatenate(found_queries),
+            np.concatenate(found_points),
+            np.concatenate(found_distances),
+        )
+
+    def _kth_distance_bound(self, queries, k: int) -> np.ndarray:
+        """For each query, the distance to its k-th closest point within the
+        smallest node on its side of the splits holding at least k points."""
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        active = np.arange(len(queries))
+        while len(active) > 0:
+            left, right = self.node_left[nodes[active]], self.node_right[nodes[active]]
+            is_internal = left >= 0
+            active, left, right = active[is_internal], left[is_internal], right[is_internal]
+
+            # Go down towards the closest child, as long as it is large enough
+            q = queries[active]
+            to_left = np.linalg.norm(
+                np.clip(q, self.node_min[left], self.node_max[left]) - q, axis=1
+            ) <= np.linalg.norm(
+                np.clip(q, self.node_min[right], self.node_max[right]) - q, axis=1
+            )
+            child = np.where(to_left, left, right)
+            large_enough = self.node_count[child] >= k
+            nodes[active[large_enough]] = child[large_enough]
+            active = active[large_enough]
+
+        pair_queries, points = self._points_of_nodes(np.arange(len(queries)), nodes)
+        d = np.linalg.norm(self.points[points] - queries[pair_queries], axis=1)
+        order = np.lexsort((d, pair_queries))
+        group_start = np.searchsorted(pair_queries[order], np.arange(len(queries)))
+        return d[order][group_start + k - 1]
+
+    def _points_of_nodes(self, pairs, nodes):
+        """Expands (query, node) pairs into (query, point) pairs, for all the
+        points held by each node. Returns the arrays (queries, points)."""
+        counts = self.node_count[nodes]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        points = self.order[np.repeat(self.node_start[nodes], counts) + offsets]
+        return np.repeat(pairs, counts), points
@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+
+# Every file starts with this magic string, then the length of the JSON header
+MAGIC = b"ADRARR01"
+ALIGNMENT = 64
+
+
+def save_arrays(path, arrays: dict, metadata: dict = None):
+    """Saves named NumPy arrays into a single binary file which can be
+    memory-mapped by load_arrays.
+
+    The file holds a JSON header describing each array (dtype, shape and
+    offset) and any metadata, followed by the raw array data. Each array is
+    aligned on 64 bytes.
+
+    The file is written next to the path then renamed, so that arrays still
+    memory-mapped from a previous version of the file (eg. a flowfield loaded
+    from the cache and saved again) keep their data.
+
+    Args:
+        path (str): Path of the file to write.
+        arrays (dict): Arrays to save, by name.
+        metadata (dict, optional): JSON-serializable data saved along the arrays. Defaults to None.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # The offsets depend on the header length, which depends on the offsets :
+    # reserve room for the header first, assuming offsets of at most 20 digits.
+    descriptions = {
+        name: {"dtype": array.dtype.str, "shape": list(array.shape), "offset": 0}
+        for name, array in arrays.items()
+    }
+    header = {"metadata": metadata or {}, "arrays": descriptions}
+    header_length = len(json.dumps(header).encode()) + 20 * len(arrays)
+    offset = _align(len(MAGIC) + 8 + header_length)
+
+    for name, array in arrays.items():
+        descriptions[name]["offset"] = offset
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode().ljust(header_length)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(np.uint64(header_length).tobytes())
+        file.write(header_bytes)
+        for name, array in arrays.items():
+            file.seek(descriptions[name]["offset"])
+            file.write(array.tobytes())
+    os.replace(temporary_path, path)
+
+
+def load_arrays(path, mmap=True):
+    """Loads a file written by save_arrays.
+
+    Args:
+        path (str): Path of the file.
+        mmap (bool, optional): If True, arrays are memory-mapped rather than read, so only the parts which are used are loaded from disk. They are copy-on-write : they can be modified in memory, but the file is never written to. Defaults to True.
+
+    Raises:
+        ValueError: If the file was not written by save_arrays.
+
+    Returns:
+        Tuple (arrays, metadata).
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an array file written by save_arrays")
+        header_length = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+        header = json.loads(file.read(header_length).decode())
+
+        arrays = dict()
+        for name, description in header["arrays"].items():
+            dtype = np.dtype(description["dtype"])
+            shape = tuple(description["shape"])
+            if mmap and np.prod(shape) > 0:
+                arrays[name] = np.memmap(
+                    path, dtype=dtype, mode="c", offset=description["offset"], shape=shape
+                )
+            else:
+                file.seek(description["offset"])
+                count = int(np.prod(shape))
+                arrays[name] = np.fromfile(file, dtype=dtype, count=count).reshape(shape)
+
+    return arrays, header["metadata"]
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mathutils import Vector
+
+from autodrone.base import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class ControlLoopStats:
+    def __init__(self):
+        """Timing statistics of a ControlLoop."""
+        self.ticks = 0
+        self.overruns = 0  # Ticks which started after the deadline of the next one
+        self.max_lateness = 0.0  # Longest delay of a tick after its deadline, in seconds
+        self.total_step_time = 0.0  # Time spent in the policy, in seconds
+        self.dispatched = 0  # Commands sent to the drone
+        self.superseded = 0  # Commands replaced by a newer one before being sent
+
+    def __str__(self) -> str:
+        mean_step_time = self.total_step_time / max(self.ticks, 1)
+        return (
+            f"{self.ticks} ticks, {self.overruns} overruns (max lateness "
+            f"{self.max_lateness * 1000:.1f} ms), mean step {mean_step_time * 1000:.1f} ms, "
+            f"{self.dispatched} commands sent, {self.superseded} superseded"
+        )
+
+
+class ControlLoop:
+    def __init__(
+        self,
+        piloter,
+        policy,
+        rate=10.0,
+        speed=100,
+        timeout=None,
+        clock=time.monotonic,
+        sleep=asyncio.sleep,
+        threaded=True,
+    ):
+        """Fixed-rate control loop around a DronePiloter.
+
+        At each tick, the estimated position of the piloter is advanced by
+        the velocity of the last command (dead reckoning), then the policy
+        gives the velocity to follow from there. Commands are sent to the
+        drone from a worker thread, so a slow Tello call (eg. a rotation)
+        never blocks the loop : while a command is being sent, only the most
+        recent of the next ones is kept and sent after it.
+
+        Each tick has a deadline, one period after the previous one. Ticks
+        which start more than a period late count as overruns : they are
+        reported, and the following ticks are rescheduled from the late one
+        rather than run in a burst to catch up.
+
+        Args:
+            piloter (DronePiloter): The piloter whose drone is controlled.
+            policy (callable): Takes the estimated position (Vector) and returns the desired velocity (Vector), or None to stop the loop.
+            rate (float, optional): Ticks per second. Defaults to 10.0.
+            speed (int, optional): Speed given to DronePiloter.send_instructions, in cm/s. Defaults to 100.
+            timeout (float, optional): Duration after which the loop stops, in seconds of the clock. Defaults to None.
+            clock (callable, optional): Returns the current time in seconds. Defaults to time.monotonic.
+            sleep (callable, optional): Coroutine function waiting for a duration in seconds of the clock. Defaults to asyncio.sleep.
+            threaded (bool, optional): If False, commands are sent from the loop itself, which is only suitable for drones answering instantly (eg. a SimulatedTello) but makes runs reproducible. Defaults to True.
+        """
+        self.piloter = piloter
+        self.policy = policy
+        self.period = 1 / rate
+        self.speed = speed
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.threaded = threaded
+
+        self.stats = ControlLoopStats()
+        self.timed_out = False
+        # Expected displacement of the drone in cm/s, from the last command
+        self.velocity = (0.0, 0.0, 0.0)
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._in_flight = None
+        self._queued = None
+        self._error = None  # Raised by the drone while sending a command
+
+    def _dispatch(self, velocity: Vector):
+        """Sends the command from the worker thread, or keeps it for when the
+        previous one is sent."""
+        if self._in_flight is not None:
+            if self._queued is not None:
+                self.stats.superseded += 1
+            self._queued = velocity
+            return
+
+        loop = asyncio.get_running_loop()
+        if self.threaded:
+            self._in_flight = loop.run_in_executor(
+                self._executor, self.piloter.send_instructions, velocity, self.speed
+            )
+        else:
+            self._in_flight = loop.create_future()
+            try:
+                self._in_flight.set_result(
+                    self.piloter.send_instructions(velocity, self.speed)
+                )
+            except Exception as e:
+                self._in_flight.set_exception(e)
+        self._in_flight.add_done_callback(self._on_sent)
+        self.stats.dispatched += 1
+
+    def _on_sent(self, future):
+        self._in_flight = None
+        if future.exception() is not None:
+            # Raised in the loop, at the next tick
+            self._error = future.exception()
+            return
+
+        dx, dy, dz, rotation = future.result()
+        self.velocity = (dx, dy, dz)
+        self.piloter.update_position(dx=0, dy=0, dz=0, rotation=rotation)
+
+        if self._queued is not None:
+            velocity, self._queued = self._queued, None
+            self._dispatch(velocity)
+
+    async def _wait_for_commands(self):
+        # The callback of each command may send the queued one
+        while self._in_flight is not None:
+            await asyncio.wait([self._in_flight])
+            await asyncio.sleep(0)
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    async def run(self):
+        """Runs the loop until the policy returns None or the timeout expires,
+        then stops the drone (without landing it).
+
+        Returns:
+            The statistics of the loop.
+        """
+        start_time = last_tick = deadline = self.clock()
+        try:
+            while True:
+                self._raise_error()
+                tick_time = self.clock()
+                lateness = tick_time - deadline
+                self.stats.max_lateness = max(self.stats.max_lateness, lateness)
+                if lateness > self.period:
+                    self.stats.overruns += 1
+                    logger.warning(
+                        "Control loop overrun : tick %d started %.0f ms late",
+                        self.stats.ticks,
+                        lateness * 1000,
+                    )
+                    deadline = tick_time
+
+                # The velocity is in cm/s
+                elapsed = tick_time - last_tick
+                self.piloter.update_position(
+                    dx=self.velocity[0] / 100 * elapsed,
+                    dy=self.velocity[1] / 100 * elapsed,
+                    dz=self.velocity[2] / 100 * elapsed,
+                    rotation=0,
+                )
+                last_tick = tick_time
+
+                if self.timeout is not None and tick_time > start_time + self.timeout:
+                    self.timed_out = True
+                    break
+
+                velocity = self.policy(self.piloter.position)
+                step_time = self.clock() - tick_time
+                self.stats.total_step_time += step_time
+                self.stats.ticks += 1
+                instrumentation.record_time("control_tick", step_time)
+                instrumentation.record_time("control_tick_lateness", max(lateness, 0.0))
+                if velocity is None:
+                    break
+                self._dispatch(velocity)
+
+                deadline += self.period
+                await self.sleep(max(0.0, deadline - self.clock()))
+
+            # Stop the drone once the last commands were sent
+            self._queued = None
+            await self._wait_for_commands()
+            self._dispatch(Vector((0, 0, 0)))
+            await self._wait_for_commands()
+        finally:
+            self._executor.shutdown(wait=False)
+
+        return self.stats
+
+
+def flowfield_policy(flowfield, destination_cell, pathfinder):
+    """Policy for a ControlLoop following the vectors of a populated FlowField
+    until the drone is in the destination cell.
+
+    Args:
+        flowfield (FlowField): Flowfield populated towards the destination.
+        destination_cell (OctreeNode): Cell of the destination.
+        pathfinder (Pathfinder): Pathfinder giving the local avoidance behavior.
+    """
+
+    def policy(position):
+        # The main pathfiding relies on the scene cartography obtained by photogrammetry.
+        # We use it to get a velocity vector towards next waypoint. Then, we combine
+        # it with a local avoidance which corrects this vector to ensure we don't
+        # bump into anything.
+        # I don't think we need to update the scene representation by adding
+        # obstacles unless they are massive, new, and immobile.
+
+        # If we have arrived at our destination, stop
+        current_closest_cell = flowfield.get_closest_cell_to_position(position)
+        if current_closest_cell.id == destination_cell.id:
+            logger.info("Destination reached.")
+            return None
+
+        # My pathing_vector is the vector of the flowfield at my position,
+        # interpolated between the cells around me so it does not jump when I
+        # cross from a cell to the next.
+        pathing_vector = Vector(flowfield.sample([position])[0])
+
+        # Apply local avoidance behavior to edit the pathing_vector
+        return pathfinder.local_avoidance_behavior(
+            desired_path_vector=pathing_vector,
+            scene_octree=flowfield,
+            position=position,
+            destination_cell=destination_cell,
+        )
+
+    return policy
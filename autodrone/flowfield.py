@@ -1,13 +1,32 @@
+import logging
 import math
+from collections import OrderedDict
 
+import numpy as np
+
+from autodrone.base import instrumentation
 from autodrone.base.octree import Octree, OctreeNode
-from autodrone.pathfind import Pathfinder
-from autodrone.base.mathutils import blender_create_cube, vector_to_euler
+from autodrone.base.array_octree import (
+    ArrayOctree,
+    CHILD_OFFSETS,
+    OCCUPANCY_OCCUPIED,
+)
+from autodrone.base.navgraph import NavigationGraph
+from autodrone.base.storage import save_arrays, load_arrays
+from autodrone.pathfind import Pathfinder, IncrementalDistanceField
+from autodrone.base.mathutils import as_points, blender_create_cube, vectors_to_euler
 
 # Blender modules
-import bpy
 from mathutils import Vector
 
+try:
+    import bpy
+except ImportError:
+    # The flowfield can be built without Blender, but not visualised
+    bpy = None
+
+logger = logging.getLogger(__name__)
+
 # --------------------- Flowfield, a special octree
 
 
@@ -39,49 +58,229 @@ class OctreeVectorNode(OctreeNode):
 
 
 
+class VectorLayerCache:
+    def __init__(self, max_bytes=256 * 2**20):
+        """Keeps the vectors of a flowfield for several destinations, so going
+        back to a previous destination does not need a new search.
+
+        Each layer is an array with the vector of every cell, in storage order
+        (see Octree.to_arrays). When the layers take more than max_bytes, the
+        least recently used ones are evicted.
+
+        Args:
+            max_bytes (int, optional): Memory budget of the cached layers. The most recent layer is always kept, even if it exceeds it. Defaults to 256 MiB.
+        """
+        self.max_bytes = max_bytes
+        self._layers = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._layers)
+
+    def __contains__(self, destination_cell_id) -> bool:
+        return destination_cell_id in self._layers
+
+    @property
+    def nbytes(self) -> int:
+        return sum(layer.nbytes for layer in self._layers.values())
+
+    def get(self, destination_cell_id):
+        """Returns the layer of this destination, or None if it is not cached."""
+        layer = self._layers.get(destination_cell_id)
+        if layer is not None:
+            self._layers.move_to_end(destination_cell_id)
+        return layer
+
+    def put(self, destination_cell_id, layer: np.ndarray):
+        self._layers[destination_cell_id] = layer
+        self._layers.move_to_end(destination_cell_id)
+        while len(self._layers) > 1 and self.nbytes > self.max_bytes:
+            self._layers.popitem(last=False)
+
+    def clear(self):
+        self._layers.clear()
+
+
 class FlowField(Octree):
-    def __init__(self, root_center, root_size, max_depth=13):
+    def __init__(
+        self, root_center, root_size, max_depth=13, vector_cache_bytes=256 * 2**20
+    ):
         super().__init__(root_center, root_size, max_depth, node_class=OctreeVectorNode)
 
+        self.graph = None  # Graph of the octree, built at the first populate_self
+        self.destination_cell_id = None  # Destination of the current vectors
+        self.distance_field = None  # Distances to the destination, see update_cells
+
+        # Vectors of the previous destinations
+        self.vector_layers = VectorLayerCache(max_bytes=vector_cache_bytes)
+
+    def get_vector_layer(self) -> np.ndarray:
+        """Returns the current vector of every cell, in storage order."""
+        return np.array(
+            [tuple(cell.vector) for cell in self._storage_order()], dtype=np.float32
+        )
+
+    def set_vector_layer(self, layer: np.ndarray):
+        """Sets the vector of every cell from a layer returned by get_vector_layer."""
+        for cell, vector in zip(self._storage_order(), layer.tolist()):
+            cell.vector = Vector(vector)
+        self._sampling = None
+
+    def _invalidate_cell_cache(self):
+        super()._invalidate_cell_cache()
+        self._sampling = None
+
+    def _get_sampling_arrays(self):
+        """Returns the octree to locate positions in with locate_indices, and
+        the arrays of the vectors and of the occupancy of its nodes. Here, an
+        ArrayOctree copy of the structure, kept until the cells or their
+        vectors change."""
+        if self._sampling is None:
+            arrays = self.to_arrays()
+            tree = ArrayOctree.from_arrays(arrays, max_depth=self.max_depth)
+            self._sampling = (tree, arrays["vectors"], arrays["occupied"])
+        return self._sampling
+
+    @instrumentation.timed_function("sample_flowfield")
+    def sample(self, positions) -> np.ndarray:
+        """Returns the flow vector at any positions, interpolated between the
+        vectors of the surrounding leaf cells, so it varies smoothly from a
+        cell to the next instead of jumping at their borders.
+
+        Each position is interpolated trilinearly between the 8 centers of
+        the cells of the size of the leaf containing it which surround it.
+        Each of these centers takes the vector of the leaf containing it,
+        whatever its size. Occupied cells, and centers outside of the octree,
+        are left out of the interpolation. Positions outside of the octree get
+        the vector of the closest leaf.
+
+        Args:
+            positions (np.ndarray): Positions, of shape (N, 3).
+
+        Returns:
+            Array of shape (N, 3) with the vector at each position.
+        """
+        tree, vectors, occupied = self._get_sampling_arrays()
+        positions = as_points(positions)
+
+        leaves = tree.locate_indices(positions)
+        outside = leaves < 0
+        if outside.any():
+            nearest, _ = tree.get_leaf_index().query(positions[outside], k=1)
+            leaves[outside] = tree.leaf_indices()[nearest[:, 0]]
+
+        # The 8 surrounding centers, and the position between them
+        sizes = tree.sizes[leaves][:, None]
+        lower = tree.centers[leaves] - sizes * (positions < tree.centers[leaves])
+        t = np.clip((positions - lower) / sizes, 0, 1)
+        offsets = (CHILD_OFFSETS + 1) / 2
+        corners = tree.locate_indices(
+            (lower[:, None, :] + offsets[None, :, :] * sizes[:, :, None]).reshape(-1, 3)
+        ).reshape(-1, 8)
+        weights = np.prod(
+            np.where(offsets[None, :, :] == 1, t[:, None, :], 1 - t[:, None, :]),
+            axis=2,
+        )
+
+        weights[(corners < 0) | (occupied[corners] == OCCUPANCY_OCCUPIED)] = 0
+        total = weights.sum(axis=1)
+        result = np.einsum("nc,ncd->nd", weights, vectors[corners].astype(np.float64))
+        interpolated = (total > 0) & ~outside
+        result[interpolated] /= total[interpolated, None]
+        result[~interpolated] = vectors[leaves[~interpolated]]
+        return result
+
+    @instrumentation.timed_function("populate_self")
     def populate_self(
         self,
         endpos,
         pathfinder: Pathfinder,
-        dist_threshold_graph_conversion=1000,
-        top_k_neighbors_graph_conversion=8,
+        dist_threshold_graph_conversion=None,
+        top_k_neighbors_graph_conversion=None,
+        rebuild_graph=False,
+        graph_processes=None,
     ):
+        # The vectors towards this destination may have been computed before
+        end_cell = self.get_closest_cell_to_position(endpos)
+        layer = self.vector_layers.get(end_cell.id)
+        if layer is not None and not rebuild_graph:
+            self.set_vector_layer(layer)
+            self.destination_cell_id = end_cell.id
+            self.distance_field = None
+            return
 
         # Turn the octree into a graph once and for all
-        print("Graphing...")
-        scene_graph = self.to_graph(
-            dist_threshold=dist_threshold_graph_conversion,
-            top_k_neighbors=top_k_neighbors_graph_conversion,
-        )
-        print("Done.")
+        if self.graph is None or rebuild_graph:
+            # Previous vectors were computed on another graph
+            self.vector_layers.clear()
+            logger.info("Building the navigation graph...")
+            self.graph = self.to_graph(
+                dist_threshold=dist_threshold_graph_conversion,
+                top_k_neighbors=top_k_neighbors_graph_conversion,
+                processes=graph_processes,
+            )
+        scene_graph = self.graph
 
-        print(scene_graph)
+        logger.info("%s", scene_graph)
 
         # import networkx as nx
 
-        # A = nx.nx_agraph.to_agraph(scene_graph)  # convert to a graphviz graph
+        # A = nx.nx_agraph.to_agraph(scene_graph.to_networkx())  # convert to a graphviz graph
         # A.write("k5.dot")  # write to dot file
         # A.draw("k5.png", prog="neato")
         # assert False
 
-        for cell in self.get_all_cells():
-            print("NEW CELL")
-            path = pathfinder.pathfind(
-                scene_octree=self,
-                scene_graph=scene_graph,
-                startpos=cell.center,
-                endpos=endpos,
-            )
+        # The destination is the same for every cell, so a single search from
+        # the destination gives the next hop of every cell at once.
+        end_cell, next_hops, distances = pathfinder.shortest_path_tree(
+            scene_octree=self,
+            scene_graph=scene_graph,
+            endpos=endpos,
+        )
+
+        self._set_vectors(
+            self.get_all_cells(), self._next_hop_of_cells(next_hops.tolist().__getitem__)
+        )
+
+        self.destination_cell_id = end_cell.id
+        self.vector_layers.put(end_cell.id, self.get_vector_layer())
+
+        # Kept to repair the vectors if the scene changes
+        self.distance_field = IncrementalDistanceField(
+            scene_graph, scene_graph.index_of[end_cell.id], distances
+        )
+
+    def _next_hop_of_cells(self, next_hop):
+        """Turns a function giving the next node of a graph node (or -1) into
+        one giving the next cell id of a leaf cell id (or None), for _set_vectors."""
+        ids, index_of = self.graph.ids, self.graph.index_of
+
+        def next_hop_of_cell(cell_id):
+            next_node = next_hop(index_of[cell_id])
+            return ids[next_node] if next_node >= 0 else None
 
-            print("PATH", path)
+        return next_hop_of_cell
 
-            # The vector is the first vector of the path to to the destination
-            if len(path) > 1:
-                next_cell = self.get_cell_by_name(path[1])
+    def _set_vectors(self, cells, next_hop):
+        """Sets the vector of the given cells towards the next cell of their
+        path to the destination.
+
+        Args:
+            cells (list): Cells to update.
+            next_hop (callable): Gives the id of the next cell on the path from a leaf cell id, or None.
+        """
+        for cell in cells:
+            # Paths start from the leaf cell closest to the cell's center
+            if cell.children is None:
+                start_cell = cell
+            else:
+                start_cell = self.get_closest_cell_to_position(cell.center)
+
+            # The vector is the first vector of the path to to the destination.
+            # Cells which are not connected to the destination (an "island")
+            # have no next hop.
+            next_cell_id = next_hop(start_cell.id)
+            if next_cell_id is not None:
+                next_cell = self.get_cell_by_name(next_cell_id)
                 dx = next_cell.center.x - cell.center.x
                 dy = next_cell.center.y - cell.center.y
                 dz = next_cell.center.z - cell.center.z
@@ -89,10 +288,173 @@ class FlowField(Octree):
                 dx, dy, dz = 0, 0, 0
 
             cell.vector = Vector((dx, dy, dz))
-            print(cell.vector)
+        self._sampling = None
+
+    @instrumentation.timed_function("update_cells")
+    def update_cells(self, changed_cells):
+        """Repairs the graph and the vectors after the occupancy of some leaf
+        cells, or the obstacles around them, changed (eg. someone left a box in
+        a corridor), instead of rebuilding everything.
+
+        Only the edges touching these cells are raycast again, and only the
+        distances affected by the change are recomputed, by an
+        IncrementalDistanceField. The graph is assumed to link adjacent cells,
+        which is the default of to_graph.
+
+        Args:
+            changed_cells (list): Leaf cells whose surroundings changed. Update their is_occupied flag before calling this, if needed.
+
+        Raises:
+            ValueError: If the flowfield was never populated.
+        """
+        if self.destination_cell_id is None:
+            raise ValueError("The flowfield must be populated before being updated.")
+
+        graph = self.graph
+        destination = graph.index_of[self.destination_cell_id]
+        if (
+            self.distance_field is None
+            or self.distance_field.destination != destination
+        ):
+            # Eg. the vectors came from the cache : compute the current distances once
+            distances, _ = graph.dijkstra(destination)
+            self.distance_field = IncrementalDistanceField(graph, destination, distances)
+
+        changed_ids = set(cell.id for cell in changed_cells)
+        self.edge_visibility.invalidate(changed_ids)
+        changed_nodes = [graph.index_of[cell_id] for cell_id in changed_ids]
+
+        # The previous edges of the changed cells will be removed...
+        endpoints = set(changed_nodes)
+        for node in changed_nodes:
+            endpoints.update(graph.neighbours(node)[0].tolist())
+
+        # ...and they are linked again to their adjacent cells
+        leaves = self.get_all_cells(leaf_nodes_only=True)
+        candidate_edges = [
+            (cell, n)
+            for cell, n in self._get_adjacent_pairs(leaves)
+            if (cell.id in changed_ids or n.id in changed_ids)
+            and not cell.is_occupied
+            and not n.is_occupied
+        ]
+        edges_are_blocked = self.edge_visibility.are_blocked(candidate_edges)
+        new_edges = [
+            (graph.index_of[cell.id], graph.index_of[n.id], self.edge_weight(cell, n))
+            for (cell, n), is_blocked in zip(candidate_edges, edges_are_blocked)
+            if not is_blocked
+        ]
+        for cell, n in candidate_edges:
+            endpoints.update((graph.index_of[cell.id], graph.index_of[n.id]))
+        graph.replace_edges(
+            changed_nodes,
+            sources=[u for u, _, _ in new_edges],
+            targets=[v for _, v, _ in new_edges],
+            weights=[w for _, _, w in new_edges],
+        )
+
+        for node in endpoints:
+            self.get_cell_by_name(graph.ids[node]).outgoing_graph_edges = graph.degree(
+                node
+            )
+
+        # The next hop of a cell changes if its edges or the distance of one of
+        # its neighbours changed
+        changed_distances = self.distance_field.update_nodes(endpoints)
+        affected_nodes = endpoints | changed_distances
+        for node in changed_distances:
+            affected_nodes.update(graph.neighbours(node)[0].tolist())
+        affected_ids = set(graph.ids[node] for node in affected_nodes)
+
+        cells_to_update = [
+            cell
+            for cell in self.get_all_cells()
+            if (cell.id if cell.children is None else self.locate_cell(cell.center).id)
+            in affected_ids
+        ]
+        self._set_vectors(
+            cells_to_update, self._next_hop_of_cells(self.distance_field.next_hop)
+        )
+        logger.info("Updated the vectors of %d cells", len(cells_to_update))
+
+        # The vectors towards other destinations are outdated
+        self.vector_layers.clear()
+        self.vector_layers.put(self.destination_cell_id, self.get_vector_layer())
+
+    def precompute_destinations(self, positions, pathfinder: Pathfinder, **kwargs):
+        """Populates the flowfield for each of the given destinations, so their
+        vectors are cached and later calls to populate_self with them are
+        instant (within the memory budget of the cache).
+
+        Args:
+            positions (iterable): Destination positions, eg. the values of utils.parse_position_index.
+            pathfinder (Pathfinder): Pathfinder given to populate_self.
+            **kwargs: Other arguments of populate_self.
+        """
+        for position in positions:
+            self.populate_self(endpos=position, pathfinder=pathfinder, **kwargs)
+
+    def save(self, path, metadata: dict = None):
+        """Saves the octree, its graph and its vectors into a single file,
+        which can be memory-mapped when loading it back with FlowField.load.
+
+        Args:
+            path (str): Path of the file to write.
+            metadata (dict, optional): Additional JSON-serializable data to save. Defaults to None.
+        """
+        arrays = self.to_arrays()
+        index_of = {cell_id: i for i, cell_id in enumerate(self.storage_ids())}
+
+        if self.graph is not None:
+            arrays["graph_nodes"] = np.array(
+                [index_of[n] for n in self.graph.ids], dtype=np.int64
+            )
+            arrays["graph_offsets"] = self.graph.offsets
+            arrays["graph_targets"] = self.graph.targets
+            arrays["graph_weights"] = self.graph.weights
+
+        metadata = dict(
+            metadata or {},
+            backend="array" if isinstance(self, ArrayOctree) else "object",
+            max_depth=self.max_depth,
+            destination=index_of.get(self.destination_cell_id, -1),
+        )
+        save_arrays(path, arrays, metadata)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """Loads a flowfield saved with FlowField.save.
+
+        Args:
+            path (str): Path of the file.
+            mmap (bool, optional): Memory-map the arrays instead of reading them. Defaults to True.
+
+        Returns:
+            A FlowField or an ArrayFlowField, depending on the saved one.
+        """
+        arrays, metadata = load_arrays(path, mmap=mmap)
+        flowfield_class = ArrayFlowField if metadata["backend"] == "array" else FlowField
+        flowfield = flowfield_class.from_arrays(arrays, max_depth=metadata["max_depth"])
+        ids = flowfield.storage_ids()
+
+        if "graph_nodes" in arrays:
+            graph_nodes = arrays["graph_nodes"]
+            flowfield.graph = NavigationGraph(
+                ids=[ids[i] for i in graph_nodes.tolist()],
+                positions=arrays["centers"][graph_nodes],
+                offsets=arrays["graph_offsets"],
+                targets=arrays["graph_targets"],
+                weights=arrays["graph_weights"],
+            )
+        if metadata["destination"] >= 0:
+            flowfield.destination_cell_id = ids[metadata["destination"]]
+
+        return flowfield
 
     def produce_visualisation(self, visibility_scale_factor=0.5):
-        for cell in self.get_all_cells(leaf_nodes_only=True):
+        cells = self.get_all_cells(leaf_nodes_only=True)
+        rotations = vectors_to_euler([tuple(cell.vector) for cell in cells])
+        for cell, rotation in zip(cells, rotations.tolist()):
             empty = bpy.data.objects.new(name="new empty", object_data=None)
             bpy.context.collection.objects.link(empty)
             empty.empty_display_type = "SINGLE_ARROW"
@@ -103,9 +465,23 @@ class FlowField(Octree):
                 -1 * visibility_scale_factor,
                 -1 * visibility_scale_factor,
             )  # (1, 1, vector_norm(cell.vector))
-            empty.rotation_euler = vector_to_euler(cell.vector)
-            print(empty.rotation_euler)
+            empty.rotation_euler = rotation
 
         # NOTE : This code does not delete the visual representations yet
 
 
+class ArrayFlowField(FlowField, ArrayOctree):
+    """A FlowField whose cells are stored in the contiguous arrays of an
+    ArrayOctree rather than as OctreeVectorNode objects. Cells are accessed
+    through ArrayOctreeNode views, which expose the same vector and
+    is_occupied attributes.
+    """
+
+    def get_vector_layer(self) -> np.ndarray:
+        return self.vectors[: self.node_count].copy()
+
+    def set_vector_layer(self, layer: np.ndarray):
+        self.vectors[: self.node_count] = layer
+
+    def _get_sampling_arrays(self):
+        return self, self.vectors, self.occupied
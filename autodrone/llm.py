@@ -1,40 +1,27 @@
-import nest_asyncio
-
+import hashlib
+import json
+import logging
 import os
-import torch
-from transformers import (
-    AutoTokenizer,
-    AutoModelForCausalLM,
-    BitsAndBytesConfig,
-    pipeline,
-)
-
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.document_transformers import Html2TextTransformer
-from langchain_community.document_loaders import AsyncChromiumLoader
-
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS as Faiss
+import re
+from collections import OrderedDict
+from pathlib import Path
 
-from langchain.prompts import PromptTemplate
-from langchain.schema.runnable import RunnablePassthrough
-from langchain_community.llms.huggingface_pipeline import HuggingFacePipeline
-from langchain.chains import LLMChain
-from langchain_core.documents import Document
+import numpy as np
 
-from langchain_core.retrievers import BaseRetriever
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from langchain_core.documents import Document
-from typing import List
+from autodrone.base.storage import save_arrays, load_arrays
+from autodrone.locations import COORDINATES, NUMBER
 
-from pydantic import BaseModel, PrivateAttr, computed_field
 
+# The LLM stack (torch, transformers, langchain, FAISS) takes most of a minute
+# to import : it is only imported, and the model only loaded, on first use.
+# Navigation-only runs never pay for it.
 
 # !pip install -q -U  datasets  tensorflow  playwright html2text sentence_transformers faiss-cpu
 # !pip install -q  peft==0.4.0  trl==0.4.7
 # !playwright install
 # !playwright install-deps
 
+logger = logging.getLogger(__name__)
 
 
 PROMPT_TEMPLATES = {
@@ -72,6 +59,210 @@ PROMPT_TEMPLATES = {
 }
 
 
+class EmbeddingCache:
+    def __init__(self, cache_dir, model_name: str):
+        """Embeddings of lines of text (eg. the lines of a position index),
+        saved to disk so that each line is only ever embedded once by a given
+        embedding model.
+
+        Lines are keyed by a hash of their content, and the cache file by the
+        name of the model. When an index changes, only its new or modified
+        lines are embedded again, and the lines it no longer contains are
+        removed from the cache.
+
+        Args:
+            cache_dir (str): Directory holding the cache files.
+            model_name (str): Name of the embedding model.
+        """
+        self.model_name = model_name
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", model_name).strip("-")
+        digest = hashlib.sha256(model_name.encode()).hexdigest()[:8]
+        self.path = Path(cache_dir) / f"{slug}-{digest}.embeddings"
+
+        self._vectors = dict()  # Hash of the line -> vector
+        if self.path.exists():
+            arrays, metadata = load_arrays(self.path, mmap=False)
+            if metadata.get("model") == model_name:
+                self._vectors = dict(zip(metadata["keys"], arrays["vectors"]))
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    @staticmethod
+    def key(line: str) -> str:
+        return hashlib.sha256(line.encode()).hexdigest()
+
+    def embed(self, lines: list, embeddings) -> np.ndarray:
+        """Returns the embedding of each line. Lines which are not in the
+        cache are embedded with embeddings.embed_documents, in a single batch,
+        then saved. Lines of the cache which are not in lines are forgotten.
+
+        Args:
+            lines (list): Lines of text.
+            embeddings (Embeddings): Embedding model, eg. a langchain HuggingFaceEmbeddings.
+
+        Returns:
+            Array of shape (len(lines), dimension).
+        """
+        missing = [line for line in dict.fromkeys(lines) if self.key(line) not in self._vectors]
+        keys = set(self.key(line) for line in lines)
+        stale = [key for key in self._vectors if key not in keys]
+        for key in stale:
+            del self._vectors[key]
+        if len(missing) > 0:
+            vectors = embeddings.embed_documents(missing)
+            for line, vector in zip(missing, vectors):
+                self._vectors[self.key(line)] = np.asarray(vector, dtype=np.float32)
+        if len(missing) > 0 or len(stale) > 0:
+            self.save()
+        logger.info(
+            "Embedded %d new lines, %d lines from the cache",
+            len(missing),
+            len(lines) - len(missing),
+        )
+        return np.array([self._vectors[self.key(line)] for line in lines])
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        save_arrays(
+            self.path,
+            {"vectors": np.array(list(self._vectors.values()), dtype=np.float32)},
+            metadata={"model": self.model_name, "keys": list(self._vectors)},
+        )
+
+
+class LazyEmbeddings:
+    def __init__(self, load):
+        """Embedding model which is only loaded once something is embedded,
+        eg. not when every line of the index was found in the EmbeddingCache
+        and no question was asked yet.
+
+        Args:
+            load (callable): Returns the embedding model, eg. a langchain HuggingFaceEmbeddings.
+        """
+        self.load = load
+        self._embeddings = None
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = self.load()
+        return self._embeddings
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase question with single spaces and without final punctuation, so
+    that "Go to Alice's desk." and "go to  alice's desk" are the same question."""
+    return " ".join(question.lower().split()).rstrip(" .!?")
+
+
+def parse_coordinates(text: str):
+    """The last (x, y, z) tuple of the text, eg. the "(10,20,30)" answered by
+    the LLM, or None if there is none."""
+    matches = COORDINATES.findall(text)
+    if len(matches) == 0:
+        return None
+    return tuple(float(v) for v in matches[-1])
+
+
+# Only a closed tuple is a whole answer : "(5, 5, 0" may still become "(5, 5, 0.5)"
+COORDINATE_TUPLE = re.compile(rf"\(\s*{NUMBER}\s*,\s*{NUMBER}\s*,\s*{NUMBER}\s*\)")
+
+
+class CoordinatesStoppingCriteria:
+    def __init__(self, tokenizer, prompt_length: int):
+        """Stops the generation of a transformers model as soon as it has
+        generated an (x, y, z) tuple, to be given in a StoppingCriteriaList :
+
+            model.generate(..., stopping_criteria=StoppingCriteriaList([criteria]))
+
+        Args:
+            tokenizer (PreTrainedTokenizer): Tokenizer of the model.
+            prompt_length (int): Number of tokens of the prompt, which are not part of the answer.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.coordinates = None  # Once generated
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        text = self.tokenizer.decode(
+            input_ids[0][self.prompt_length :], skip_special_tokens=True
+        )
+        match = COORDINATE_TUPLE.search(text)
+        if match is not None:
+            self.coordinates = tuple(float(v) for v in match.groups())
+        return self.coordinates is not None
+
+
+def format_documents(documents) -> str:
+    """Context given to the prompt : the content of the retrieved documents."""
+    return "\n".join(document.page_content for document in documents)
+
+
+class ResponseCache:
+    def __init__(self, path=None, max_entries=1024):
+        """Answers of the LLM, so that questions which were already asked
+        (operators repeat the same phrases all day) are answered without
+        generating anything.
+
+        The least recently used answers are evicted beyond max_entries. The
+        cache is saved to a JSON file after each new answer, if a path is given.
+
+        Args:
+            path (str, optional): JSON file holding the cache. If None, answers are only kept in memory. Defaults to None.
+            max_entries (int, optional): Maximum number of answers kept. Defaults to 1024.
+        """
+        self.path = Path(path) if path is not None else None
+        self.max_entries = max_entries
+
+        self._answers = OrderedDict()  # Key -> answer, the most recent last
+        if self.path is not None and self.path.exists():
+            entries = json.loads(self.path.read_text())["entries"]
+            self._answers = OrderedDict(entries[-max_entries:])
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    @staticmethod
+    def key(question: str, context_hash: str, model_name: str, template: str) -> str:
+        """Key of the answer to a question, which changes with the context
+        (eg. the index), the model and the prompt template."""
+        text = json.dumps(
+            [normalize_question(question), context_hash, model_name, template]
+        )
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key: str):
+        """The cached answer, or None."""
+        if key not in self._answers:
+            return None
+        self._answers.move_to_end(key)
+        return self._answers[key]
+
+    def put(self, key: str, answer):
+        """Caches a JSON-serializable answer and saves the cache."""
+        self._answers[key] = answer
+        self._answers.move_to_end(key)
+        while len(self._answers) > self.max_entries:
+            self._answers.popitem(last=False)
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Written then renamed, so an interrupted run cannot corrupt the cache
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        temporary_path.write_text(json.dumps({"entries": list(self._answers.items())}))
+        os.replace(temporary_path, self.path)
+
+
 class RAG_LLMAgent:
     def __init__(
         self,
@@ -81,66 +272,203 @@ class RAG_LLMAgent:
         bnb_4bit_quant_type="nf4",  # Quantization type (fp4 or nf4)
         use_nested_quant=False,  # Activate nested quantization for 4-bit base models (double quantization)
         prompt_template_key="standard_rag",
+        embedding_model_name="sentence-transformers/all-mpnet-base-v2",
+        response_cache=None,
+        stop_at_coordinates=False,
+        max_new_tokens=None,
     ):
+        """Answers questions with an LLM, given a context retrieved from a
+        document (see setup_retriever_for_this_context).
+
+        Args:
+            response_cache (ResponseCache, optional): Cache of the answers, so that repeated questions about the same context are not generated again. Defaults to None.
+            stop_at_coordinates (bool, optional): For the "drone_loc" template, stop generating as soon as the answer contains an (x, y, z) tuple (see CoordinatesStoppingCriteria), rather than generating the whole answer then parsing it. Defaults to False.
+            max_new_tokens (int, optional): Maximum number of generated tokens. Defaults to 1000, or 64 for the "drone_loc" template, whose answers are a single tuple.
+        """
+        # The model is loaded by the first call to the agent
+        self.model_name = model_name
+        self.use_4bit = use_4bit
+        self.bnb_4bit_compute_dtype = bnb_4bit_compute_dtype
+        self.bnb_4bit_quant_type = bnb_4bit_quant_type
+        self.use_nested_quant = use_nested_quant
+        self._text_generation_pipeline = None
+
+        self.retriever = None
+        self.context_hash = None  # Changes with the context of the retriever
+        self.embedding_model_name = embedding_model_name
+        self.response_cache = response_cache
+        self.stop_at_coordinates = stop_at_coordinates
+        if max_new_tokens is None:
+            max_new_tokens = 64 if prompt_template_key == "drone_loc" else 1000
+        self.max_new_tokens = max_new_tokens
+
+        # Built once, on first use
+        self._prompt = None
+        self._llm_chain = None
+        self._rag_chain = None
+
+        self.prompt_template_key = prompt_template_key
+
+    @property
+    def text_generation_pipeline(self):
+        if self._text_generation_pipeline is None:
+            self._load_model()
+        return self._text_generation_pipeline
+
+    def _load_model(self):
+        import nest_asyncio
+        import torch
+        from transformers import (
+            AutoTokenizer,
+            AutoModelForCausalLM,
+            BitsAndBytesConfig,
+            pipeline,
+        )
+
         # Tokenizer
         # self.model_config = transformers.AutoConfig.from_pretrained(model_name)
         self.tokenizer = AutoTokenizer.from_pretrained(
-            model_name, trust_remote_code=True
+            self.model_name, trust_remote_code=True
         )
         self.tokenizer.pad_token = self.tokenizer.eos_token
         self.tokenizer.padding_side = "right"
 
         # Set up quantization config
-        compute_dtype = getattr(torch, bnb_4bit_compute_dtype)
+        compute_dtype = getattr(torch, self.bnb_4bit_compute_dtype)
         bnb_config = BitsAndBytesConfig(
-            load_in_4bit=use_4bit,
-            bnb_4bit_quant_type=bnb_4bit_quant_type,
+            load_in_4bit=self.use_4bit,
+            bnb_4bit_quant_type=self.bnb_4bit_quant_type,
             bnb_4bit_compute_dtype=compute_dtype,
-            bnb_4bit_use_double_quant=use_nested_quant,
+            bnb_4bit_use_double_quant=self.use_nested_quant,
         )
 
         self.model = AutoModelForCausalLM.from_pretrained(
-            model_name,
+            self.model_name,
             quantization_config=bnb_config,
         )
 
         nest_asyncio.apply()
 
-        self.text_generation_pipeline = pipeline(
+        self._text_generation_pipeline = pipeline(
             model=self.model,
             tokenizer=self.tokenizer,
             task="text-generation",
             temperature=0.2,
             repetition_penalty=1.1,
-            return_full_text=True,
-            max_new_tokens=1000,
+            return_full_text=False,  # The prompt contains an example answer
+            max_new_tokens=self.max_new_tokens,
         )
 
-        self.retriever = None
-
-        self.prompt_template_key = prompt_template_key
+    @property
+    def prompt(self):
+        if self._prompt is None:
+            from langchain.prompts import PromptTemplate
+
+            # Create prompt template from prompt template
+            self._prompt = PromptTemplate(
+                input_variables=["context", "question"],
+                template=PROMPT_TEMPLATES[self.prompt_template_key],
+            )
+        return self._prompt
+
+    @property
+    def llm_chain(self):
+        """Chain of the prompt template and of the model."""
+        if self._llm_chain is None:
+            from langchain_community.llms.huggingface_pipeline import (
+                HuggingFacePipeline,
+            )
+            from langchain.chains import LLMChain
+
+            mistral_llm = HuggingFacePipeline(pipeline=self.text_generation_pipeline)
+
+            # Create llm chain
+            self._llm_chain = LLMChain(llm=mistral_llm, prompt=self.prompt)
+        return self._llm_chain
+
+    @property
+    def rag_chain(self):
+        """The llm_chain, with the context given by the retriever."""
+        if self._rag_chain is None:
+            from langchain.schema.runnable import RunnablePassthrough
+
+            self._rag_chain = {
+                "context": self.retriever | format_documents,
+                "question": RunnablePassthrough(),
+            } | self.llm_chain
+        return self._rag_chain
 
     def __call__(self, question: str):
-        mistral_llm = HuggingFacePipeline(pipeline=self.text_generation_pipeline)
+        """Answers the question.
 
-        # Create prompt template from prompt template
-        prompt_template = PROMPT_TEMPLATES[self.prompt_template_key]
+        Returns:
+            For the "drone_loc" template, the (x, y, z) tuple answered, or None
+            if the answer contains no coordinates. Otherwise, the text answered.
+        """
+        key = None
+        if self.response_cache is not None:
+            key = ResponseCache.key(
+                question,
+                self.context_hash,
+                self.model_name,
+                PROMPT_TEMPLATES[self.prompt_template_key],
+            )
+            answer = self.response_cache.get(key)
+            if answer is not None:
+                logger.info("Answer of %r found in the cache", question)
+                return tuple(answer) if isinstance(answer, list) else answer
+
+        if self.stop_at_coordinates and self.prompt_template_key == "drone_loc":
+            answer = self._generate_coordinates(question)
+        else:
+            result = self.rag_chain.invoke(question)
+            answer = self._parse_answer(result["text"])
+
+        # Unusable answers are not cached, so they are generated again next time
+        if key is not None and answer is not None:
+            self.response_cache.put(key, answer)
+        return answer
+
+    def _generate_coordinates(self, question: str):
+        """Generates the answer to the question, and stops as soon as it
+        contains an (x, y, z) tuple. Errors of the generation (eg. out of
+        memory) are raised here.
 
-        prompt = PromptTemplate(
-            input_variables=["context", "question"],
-            template=prompt_template,
-        )
+        Returns:
+            The (x, y, z) tuple, or None if the answer contains no coordinates.
+        """
+        from transformers import StoppingCriteriaList
 
-        # Create llm chain
-        llm_chain = LLMChain(llm=mistral_llm, prompt=prompt)
+        if self._text_generation_pipeline is None:
+            self._load_model()
+        context = format_documents(self.retriever.invoke(question))
+        prompt = self.prompt.format(context=context, question=question)
 
-        rag_chain = {
-            "context": self.retriever,
-            "question": RunnablePassthrough(),
-        } | llm_chain
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        stopping_criteria = CoordinatesStoppingCriteria(
+            self.tokenizer, prompt_length=inputs["input_ids"].shape[1]
+        )
+        # The stopping criteria checks the answer after each generated token
+        output_ids = self.model.generate(
+            **inputs,
+            stopping_criteria=StoppingCriteriaList([stopping_criteria]),
+            max_new_tokens=self.max_new_tokens,
+            repetition_penalty=1.1,
+            pad_token_id=self.tokenizer.eos_token_id,
+        )
+        text = self.tokenizer.decode(
+            output_ids[0][inputs["input_ids"].shape[1] :], skip_special_tokens=True
+        )
+
+        logger.info("Generated %r", text)
+        if stopping_criteria.coordinates is not None:
+            return stopping_criteria.coordinates
+        return parse_coordinates(text)
 
-        result = rag_chain.invoke(question)
-        return result
+    def _parse_answer(self, text: str):
+        if self.prompt_template_key == "drone_loc":
+            return parse_coordinates(text)
+        return text.strip()
 
     @staticmethod
     def _retrieve_urls(list_of_urls=["https://www.lipsum.com/feed/html"]):
@@ -152,6 +480,9 @@ class RAG_LLMAgent:
         Returns:
             docs (List[langchain_core.documents.Document])
         """
+        from langchain_community.document_transformers import Html2TextTransformer
+        from langchain_community.document_loaders import AsyncChromiumLoader
+
         # Scrapes the URLs above containing the articles to index
         loader = AsyncChromiumLoader(list_of_urls)
         docs = loader.load()  # Docs is a List[Documents]
@@ -164,15 +495,20 @@ class RAG_LLMAgent:
 
     @staticmethod
     def _text_to_document(text: str):
+        from langchain_core.documents import Document
+
         return Document(page_content=text)
 
-    def setup_retriever_for_this_context(self, list_of_urls=None, text=None):
+    def setup_retriever_for_this_context(
+        self, list_of_urls=None, text=None, cache_dir=None
+    ):
         """Setup the retriever of the model so that the context is what is given
         in the URL of the text.
 
         Args:
             list_of_urls (_type_, optional): _description_. Defaults to None.
             text (_type_, optional): _description_. Defaults to None.
+            cache_dir (str, optional): If given with text, the text is split into one document per line (eg. one position of an index), and the embedding of each line is kept in an EmbeddingCache in this directory, so unchanged lines are not embedded again on the next runs. Defaults to None.
 
         Raises:
             ValueError: _description_
@@ -187,12 +523,40 @@ class RAG_LLMAgent:
         if (list_of_urls is not None) and (text is not None):
             raise ValueError("Cannot specify both list_of_urls and text")
 
+        context = text if text is not None else "\n".join(list_of_urls)
+        self.context_hash = hashlib.sha256(context.encode()).hexdigest()
+        self._rag_chain = None  # Built again with the new retriever
+
+        from langchain.text_splitter import CharacterTextSplitter
+        from langchain_core.embeddings import Embeddings
+        from langchain_community.vectorstores import FAISS as Faiss
+
+        def load_embeddings():
+            from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+
+            return HuggingFaceEmbeddings(model_name=self.embedding_model_name)
+
+        # FAISS only accepts Embeddings, which LazyEmbeddings implements
+        Embeddings.register(LazyEmbeddings)
+        embeddings = LazyEmbeddings(load_embeddings)
+
+        if text is not None and cache_dir is not None:
+            # Comments are not positions
+            lines = [
+                line.strip()
+                for line in text.splitlines()
+                if line.strip() != "" and not line.strip().startswith("#")
+            ]
+            vectors = EmbeddingCache(cache_dir, self.embedding_model_name).embed(
+                lines, embeddings
+            )
+            db = Faiss.from_embeddings(list(zip(lines, vectors.tolist())), embeddings)
+            self.retriever = db.as_retriever()
+            return
+
         text_splitter = CharacterTextSplitter(chunk_size=100, chunk_overlap=0)
         chunked_documents = text_splitter.split_documents(docs_transformed)
 
         # Load chunked documents into the FAISS index (vectorizing them)
-        db = Faiss.from_documents(
-            chunked_documents,
-            HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2"),
-        )
+        db = Faiss.from_documents(chunked_documents, embeddings)
         self.retriever = db.as_retriever()
@@ -0,0 +1,177 @@
+import difflib
+import logging
+import re
+
+from autodrone.utils import parse_position_index
+
+logger = logging.getLogger(__name__)
+
+# Words which may surround the name of a position in a command
+FILLER_WORDS = frozenset(
+    """
+    a an the please now go fly move head navigate travel take bring me us to
+    towards toward into at on over there can could would will you i want find
+    give get show what where is are coordinates coordinate position location of
+    """.split()
+)
+# Words asking for the point between several positions
+MIDPOINT_WORDS = frozenset(
+    "midpoint mid point middle halfway half way center centre between".split()
+)
+
+NUMBER = r"(-?\d+(?:\.\d+)?)"
+COORDINATES = re.compile(rf"\(?\s*{NUMBER}\s*,\s*{NUMBER}\s*,\s*{NUMBER}\s*\)?")
+
+
+def normalize(text: str) -> str:
+    """Lowercase words of the text, without punctuation. Apostrophes are
+    removed, so "Alice's desk" becomes "alices desk"."""
+    text = text.lower().replace("’", "").replace("'", "")
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+class LocationResolver:
+    def __init__(self, positions: dict, cutoff=0.8):
+        """Resolves commands naming positions of an index, eg. "Go to Alice's
+        desk" or "Fly to the midpoint between Alice's and Guillaume's desk",
+        deterministically and without the LLM.
+
+        A command is resolved if it names a position (exactly, or with a
+        typo), several positions for their midpoint, or gives coordinates,
+        and its other words are only filler words like "go to the". Anything
+        else, eg. "2 meters above Alice's desk", is left to the LLM.
+
+        Args:
+            positions (dict): The (x, y, z) coordinates of each name, as returned by utils.parse_position_index.
+            cutoff (float, optional): Minimum similarity (between 0 and 1, see difflib) of each word of a misspelled name to the word of the name of a position. Defaults to 0.8.
+        """
+        self.positions = {
+            name: tuple(float(v) for v in position) for name, position in positions.items()
+        }
+        self.cutoff = cutoff
+
+        # Names are looked up by their normalized words, and for fuzzy
+        # matching also without their filler words
+        self._names = dict()
+        self._stripped_names = dict()
+        for name in self.positions:
+            words = normalize(name).split()
+            self._names[" ".join(words)] = name
+            stripped = " ".join(w for w in words if w not in FILLER_WORDS)
+            self._stripped_names.setdefault(stripped, name)
+        self._max_words = max((len(n.split()) for n in self._names), default=0)
+
+    @classmethod
+    def from_index(cls, text: str, **kwargs):
+        """Creates the resolver of an index file such as scenes/basic.index."""
+        return cls(parse_position_index(text), **kwargs)
+
+    def resolve(self, command: str):
+        """Resolves the position asked for by a command.
+
+        Args:
+            command (str): Command of the user.
+
+        Returns:
+            The (x, y, z) tuple of the position, or None if the command could
+            not be resolved without the LLM.
+        """
+        position = self._resolve_coordinates(command)
+        if position is None:
+            # Lists of positions are separated by "and" or by commas
+            words = normalize(command.replace(",", " and ")).split()
+            if any(w in MIDPOINT_WORDS for w in words):
+                position = self._resolve_midpoint(words)
+            if position is None:
+                # Also when midpoint words were part of a name, eg. "Meeting point"
+                name = self.resolve_name(words)
+                position = self.positions[name] if name is not None else None
+
+        if position is None:
+            logger.info("Could not resolve %r without the LLM", command)
+        else:
+            logger.info("Resolved %r to %s", command, position)
+        return position
+
+    def resolve_name(self, words: list):
+        """Name of the position named by the words, which may also contain
+        filler words, or None.
+
+        Args:
+            words (list): Normalized words, see normalize.
+        """
+        # Exact names, the longest first, eg. "alices desk" before "desk"
+        for length in range(min(self._max_words, len(words)), 0, -1):
+            for start in range(len(words) - length + 1):
+                name = self._names.get(" ".join(words[start : start + length]))
+                others = words[:start] + words[start + length :]
+                if name is not None and all(w in FILLER_WORDS for w in others):
+                    return name
+
+        # Misspelled names : the words of the command but its filler words
+        # must match those of the name one by one, so that any other word
+        # (eg. "dont", "near", or another name) leaves the command to the LLM
+        phrase = [w for w in words if w not in FILLER_WORDS]
+        if len(phrase) == 0:
+            return None
+        best_name, best_similarity = None, 0
+        for stripped, name in self._stripped_names.items():
+            name_words = stripped.split()
+            if len(name_words) != len(phrase):
+                continue
+            similarities = [
+                difflib.SequenceMatcher(None, w, name_word).ratio()
+                for w, name_word in zip(phrase, name_words)
+            ]
+            similarity = sum(similarities) / len(similarities)
+            if min(similarities) >= self.cutoff and similarity > best_similarity:
+                best_name, best_similarity = name, similarity
+        return best_name
+
+    def _resolve_midpoint(self, words: list):
+        """Midpoint of the positions listed after the midpoint words."""
+        start = 0
+        while start < len(words) and (
+            words[start] in MIDPOINT_WORDS or words[start] in FILLER_WORDS
+        ):
+            start += 1
+        if not any(w in MIDPOINT_WORDS for w in words[:start]):
+            return None
+
+        parts, part = [], []
+        for w in words[start:] + ["and"]:
+            if w != "and":
+                part.append(w)
+            elif len(part) > 0:
+                parts.append(part)
+                part = []
+        if len(parts) < 2:
+            return None
+
+        # The end of the last name may be shared, as in "Alice's and
+        # Guillaume's desk"
+        shared_end = parts[-1][1:]
+        names = []
+        for part in parts:
+            name = self.resolve_name(part)
+            if name is None and len(shared_end) > 0:
+                name = self.resolve_name(part + shared_end)
+            if name is None:
+                return None
+            names.append(name)
+
+        return tuple(
+            sum(self.positions[name][axis] for name in names) / len(names)
+            for axis in range(3)
+        )
+
+    @staticmethod
+    def _resolve_coordinates(command: str):
+        """Coordinates given in the command, eg. "Go to (1, 2.5, -3)"."""
+        match = COORDINATES.search(command)
+        if match is None:
+            return None
+        others = normalize(command[: match.start()] + " " + command[match.end() :])
+        if not all(w in FILLER_WORDS for w in others.split()):
+            return None
+        return tuple(float(v) for v in match.groups())
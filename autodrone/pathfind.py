@@ -1,4 +1,13 @@
-import networkx as nx
+import heapq
+import logging
+import math
+
+import numpy as np
+from mathutils import Vector
+
+from autodrone.base import instrumentation
+
+logger = logging.getLogger(__name__)
 
 
 class Pathfinder:
@@ -10,16 +19,17 @@ class Pathfinder:
         endpos,
     ):
         """Tries to find a path in the given scene between startpos and endpos.
-        Uses the A-star algorithm.
+        Uses the A-star algorithm, with the straight line distance to endpos
+        as heuristic.
 
         Args:
             scene_octree (_type_): _description_
-            scene_graph (_type_): _description_
+            scene_graph (NavigationGraph): Graph produced by scene_octree.to_graph
             startpos (_type_): _description_
             endpos (_type_): _description_
 
         Returns:
-            _type_: _description_
+            list: Ids of the cells of the path.
         """
         path = []
         start_cell = scene_octree.get_closest_cell_to_position(startpos)
@@ -40,30 +50,208 @@ class Pathfinder:
             end_cell.outgoing_graph_edges > 0
         ), f"Trying to path into a cell without outgoing graph edges : {end_cell}"
 
-        print(f"PATHING FROM {start_cell} TO {end_cell}")
+        logger.debug("Pathing from %s to %s", start_cell, end_cell)
 
-        try:
-            path += nx.astar_path(
-                scene_graph,
-                start_cell.id,
-                end_cell.id,
-                weight="weight",
+        path += [
+            scene_graph.ids[i]
+            for i in scene_graph.astar(
+                scene_graph.index_of[start_cell.id], scene_graph.index_of[end_cell.id]
             )
-        except:
+        ]
+        if len(path) == 0:
             # Well, if there is no path, just return an empty path.
             # This usually happens if you are evaluating a cell that is in an
             # "island", meaning it has neighbors but is not connected to the
             # destination.
-            print("NO PATH EXISTS.")
+            logger.info("No path exists from %s to %s", start_cell.id, end_cell.id)
 
         return path
 
-    def local_avoidance_behavior(self, desired_path_vector):
+    @staticmethod
+    def shortest_path_tree(
+        scene_octree,
+        scene_graph,
+        endpos,
+    ):
+        """Computes, in a single search, the next hop towards endpos for every
+        cell of the scene graph.
+        Runs Dijkstra once from the destination cell: as the graph is
+        undirected, the predecessor of a cell in the resulting tree is the next
+        cell on its shortest path to the destination.
+
+        Args:
+            scene_octree (Octree): Octree whose cells are the nodes of scene_graph.
+            scene_graph (NavigationGraph): Graph produced by Octree.to_graph.
+            endpos (Vector): Destination position.
+
+        Returns:
+            Tuple of (end_cell, next_hops, distances), where next_hops is the
+            array of the next node towards the destination of each node of
+            the graph (-1 at the destination and for unreachable nodes), and
+            distances the array of their path length to the destination.
+        """
+        end_cell = scene_octree.get_closest_cell_to_position(endpos)
+        assert (
+            end_cell.outgoing_graph_edges > 0
+        ), f"Trying to path into a cell without outgoing graph edges : {end_cell}"
+
+        distances, next_hops = scene_graph.dijkstra(scene_graph.index_of[end_cell.id])
+
+        return end_cell, next_hops, distances
+
+    def local_avoidance_behavior(
+        self,
+        desired_path_vector,
+        scene_octree=None,
+        position=None,
+        safety_distance=1.0,
+        destination_cell=None,
+    ):
         """
         # TODO : before implementing ORCA or depth estimation. Just stop if there is an obstacle at 1 m
         obstacle = raytrace_blender(desired_path_vector, max_distance=1m)
         if obstacle:
             return Vector(0, 0, 0)
+
+        For now, if the octree and the current position are given, the part
+        of the vector heading into an occupied cell closer than
+        safety_distance is removed : the drone slides along the obstacle
+        instead of flying into it, and keeps going where the way is clear.
+
+        Args:
+            desired_path_vector (Vector): Vector given by the flowfield.
+            scene_octree (Octree, optional): Octree whose cells know if they are occupied. Defaults to None.
+            position (Vector, optional): Current position. Defaults to None.
+            safety_distance (float, optional): Distance to the obstacles under which we avoid them. Defaults to 1.0.
+            destination_cell (OctreeNode, optional): Cell of the destination, never avoided. Defaults to None.
         """
+        if scene_octree is None or position is None:
+            return desired_path_vector
 
-        return desired_path_vector
+        vector = Vector(desired_path_vector)
+        for cell in scene_octree.get_cells_near(position, safety_distance)[0]:
+            if not getattr(cell, "is_occupied", None):
+                continue
+            if destination_cell is not None and cell.id == destination_cell.id:
+                continue
+            towards_obstacle = Vector(cell.center) - Vector(position)
+            if towards_obstacle.length == 0:
+                continue
+            towards_obstacle.normalize()
+            heading_into = vector.dot(towards_obstacle)
+            if heading_into > 0:
+                vector -= heading_into * towards_obstacle
+
+        return vector
+
+
+class IncrementalDistanceField:
+    def __init__(self, scene_graph, destination: int, distances=None):
+        """Distance from every node of the graph to a fixed destination, which
+        can be repaired when some edges change instead of being recomputed.
+
+        This is Lifelong Planning A* without heuristic and without start node
+        (the distance field flavour of D* Lite) : each node keeps its distance
+        g and a one-step lookahead rhs = min(g(n) + weight) over its
+        neighbours n. When edges change, only the nodes where g and rhs
+        disagree are processed, in order of distance, which repairs exactly
+        the part of the field affected by the change.
+
+        Args:
+            scene_graph (NavigationGraph): The graph, modified in place by the caller before calling update_nodes.
+            destination (int): Index of the destination node.
+            distances (np.ndarray, optional): Distances of every node to the destination, eg. from Pathfinder.shortest_path_tree, to start from without searching. Defaults to None, in which case they are computed.
+        """
+        self.graph = scene_graph
+        self.destination = destination
+
+        node_count = scene_graph.number_of_nodes()
+        if distances is None:
+            self.g = [math.inf] * node_count
+            self.rhs = [math.inf] * node_count
+            self.rhs[destination] = 0
+            self._queue = [(0, destination)]
+            self._queued = {destination: 0}
+            self.compute()
+        else:
+            # Exact distances are a consistent state, with nothing to process
+            self.g = list(distances)
+            self.rhs = list(distances)
+            self._queue = []
+            self._queued = dict()
+
+    def _neighbours(self, node):
+        """Pairs (neighbour, weight) of the node. The graph is undirected, so
+        these are both the nodes through which node can reach the destination
+        and the nodes which can reach it through node."""
+        targets, weights = self.graph.neighbours(node)
+        return zip(targets.tolist(), weights.tolist())
+
+    def distance(self, node: int) -> float:
+        return self.g[node]
+
+    def next_hop(self, node: int) -> int:
+        """Returns the neighbour of node on its shortest path to the
+        destination, or -1 at the destination or if it cannot be reached."""
+        if node == self.destination or self.g[node] == math.inf:
+            return -1
+        return min(
+            self._neighbours(node),
+            key=lambda item: self.g[item[0]] + item[1],
+        )[0]
+
+    def _update_node(self, node):
+        if node != self.destination:
+            self.rhs[node] = min(
+                (self.g[n] + weight for n, weight in self._neighbours(node)),
+                default=math.inf,
+            )
+        g, rhs = self.g[node], self.rhs[node]
+        if g != rhs:
+            key = min(g, rhs)
+            self._queued[node] = key
+            heapq.heappush(self._queue, (key, node))
+        else:
+            self._queued.pop(node, None)
+
+    def compute(self) -> set:
+        """Processes the inconsistent nodes until the field is exact again.
+
+        Returns:
+            The set of nodes whose distance changed.
+        """
+        changed = set()
+        instrumentation.count("searches")
+        while len(self._queue) > 0:
+            key, node = heapq.heappop(self._queue)
+            if self._queued.get(node) != key:
+                continue  # Outdated entry, the node was queued again since
+            del self._queued[node]
+            changed.add(node)
+
+            rhs = self.rhs[node]
+            if self.g[node] > rhs:
+                # The node got closer to the destination
+                self.g[node] = rhs
+            else:
+                # The node got farther : reevaluate it from its neighbours
+                self.g[node] = math.inf
+                self._update_node(node)
+            for p, _ in self._neighbours(node):
+                self._update_node(p)
+        instrumentation.count("cells_visited", len(changed))
+        return changed
+
+    def update_nodes(self, nodes) -> set:
+        """Repairs the field after edges touching the given nodes were added,
+        removed or reweighted in the graph.
+
+        Args:
+            nodes (iterable): Endpoints of the edges which changed.
+
+        Returns:
+            The set of nodes whose distance changed.
+        """
+        for node in nodes:
+            self._update_node(node)
+        return self.compute()
@@ -1,6 +1,4 @@
-# Tello modules
-import djitellopy as dtp
-
+from autodrone.base import instrumentation
 from autodrone.base.mathutils import (
     project_on_plane,
     euclidian_distance,
@@ -8,12 +6,15 @@ from autodrone.base.mathutils import (
 )
 
 from mathutils import Vector
+import logging
 import math
 
+logger = logging.getLogger(__name__)
+
 
 class DronePiloter:
 
-    def __init__(self, starting_position: Vector, debug_mode=False):
+    def __init__(self, starting_position: Vector, debug_mode=False, drone=None):
         """
         Class responsible for translating directions (given as a velocity vector) into actual instructions for the drone.
 
@@ -25,16 +26,22 @@ class DronePiloter:
         Args:
             starting_position (Vector, optional): _description_. Defaults to None.
             debug_mode (bool, optional): debug_mode (bool, optional): If True, commands are not sent but simply printed. Defaults to False.
+            drone (optional): Drone receiving the commands, with the same methods as djitellopy.Tello, eg. a SimulatedTello. Defaults to a new djitellopy.Tello.
         """
         self.debug_mode = debug_mode
 
         # Connect to the Tello if not in debug mode
         if not self.debug_mode:
-            self.drone = dtp.Tello()
+            if drone is None:
+                # Tello modules, imported here as only real flights need them
+                import djitellopy as dtp
+
+                drone = dtp.Tello()
+            self.drone = drone
             self.drone.connect()
-            print("Connected to Drone")
+            logger.info("Connected to drone")
         else:
-            print("DEBUG MODE WITHOUT DRONE")
+            logger.info("Debug mode without drone")
 
         # What are my starting position and rotation ?
         self.position = starting_position
@@ -75,14 +82,23 @@ class DronePiloter:
         ).z
 
         rotation = desired_orientation - self.rotation_euler.z
-        print(
-            f"DEBUG self.rotation_euler.z {self.rotation_euler.z}, normalized_desired_orientation {normalized_desired_orientation}, desired_orientation {desired_orientation} --> rotation {rotation}"
+        rotation = (rotation + math.pi) % (2 * math.pi) - math.pi  # Shortest way
+        if project_on_plane(desired_velocity, normal=Vector((0, 0, 1))).length == 0:
+            rotation = 0  # Keep the current heading when stopping or going vertically
+        logger.debug(
+            "self.rotation_euler.z %s, normalized_desired_orientation %s, desired_orientation %s --> rotation %s",
+            self.rotation_euler.z,
+            normalized_desired_orientation,
+            desired_orientation,
+            rotation,
         )
 
         if not self.debug_mode:
-            # NOTE rotation is in radians, and but drone function expects it in centidegrees
-            rotation_instruction = math.degrees(rotation) * 100
-            if rotation > 0:
+            # NOTE rotation is in radians, but drone functions expect whole degrees
+            rotation_instruction = round(abs(math.degrees(rotation)))
+            if rotation_instruction == 0:
+                pass  # The drone refuses rotations under one degree
+            elif rotation > 0:
                 self.drone.rotate_counter_clockwise(rotation_instruction)
             else:
                 self.drone.rotate_clockwise(rotation_instruction)
@@ -99,8 +115,10 @@ class DronePiloter:
         if not self.debug_mode:
             self.drone.send_rc_control(
                 left_right_velocity=0,
-                forward_back_velocity=euclidian_distance(projected_on_xy_plane) * speed,
-                up_down_velocity=desired_velocity.z * speed,
+                forward_backward_velocity=int(
+                    euclidian_distance(projected_on_xy_plane) * speed
+                ),
+                up_down_velocity=int(desired_velocity.z * speed),
                 yaw_velocity=0,
             )
 
@@ -108,7 +126,10 @@ class DronePiloter:
         dy = desired_velocity.y * speed
         dz = desired_velocity.z * speed
 
-        print(f"MOVEMENT ORDER GIVEN FOR: dx {dx} dy {dy} dz {dz} rotation {rotation}")
+        logger.debug(
+            "Movement order given for: dx %s dy %s dz %s rotation %s", dx, dy, dz, rotation
+        )
+        instrumentation.count("drone_commands")
 
         # return the expected delta in centimeters per second
         return dx, dy, dz, rotation
@@ -0,0 +1,210 @@
+import asyncio
+import math
+
+import numpy as np
+from mathutils import Vector
+
+from autodrone.control import ControlLoop
+from autodrone.pilot import DronePiloter
+
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        """Clock whose time only moves forward when slept on, so a ControlLoop
+        using it runs as fast as its policy allows, and always the same way.
+
+        Pass `clock=virtual_clock.now, sleep=virtual_clock.sleep` to the loop.
+
+        Args:
+            start (float, optional): Initial time, in seconds. Defaults to 0.0.
+        """
+        self.time = start
+
+    def now(self) -> float:
+        return self.time
+
+    async def sleep(self, duration: float):
+        self.time += max(0.0, duration)
+        # Still let the other tasks and callbacks of the event loop run
+        await asyncio.sleep(0)
+
+
+class SimulatedTello:
+    def __init__(
+        self,
+        clock: VirtualClock,
+        position=(0, 0, 0),
+        yaw=0.0,
+        rotation_speed=90.0,
+    ):
+        """Simulated drone accepting the same commands as djitellopy.Tello, to
+        fly a DronePiloter without a drone or a network.
+
+        The kinematic model is simple : the drone follows the velocity of the
+        last rc command instantly and keeps it until the next one. Rotations
+        are done in place at a constant speed, during which the drone does not
+        move. The state is advanced lazily to the current time of the clock.
+
+        Axes are those of the scene, in meters : at a yaw of 0 the drone faces
+        +Y, and a positive yaw turns it counter-clockwise seen from above (as
+        given by mathutils.vector_to_euler). The start position is the one
+        after takeoff.
+
+        Args:
+            clock (VirtualClock): Clock giving the time of the simulation.
+            position (Vector, optional): Start position, in meters. Defaults to (0, 0, 0).
+            yaw (float, optional): Start yaw, in radians. Defaults to 0.0.
+            rotation_speed (float, optional): Speed of rotations, in degrees per second. Defaults to 90.0.
+        """
+        self.clock = clock
+        self.rotation_speed = rotation_speed
+
+        self.connected = False
+        self.is_flying = False
+        self._position = np.array(position, dtype=np.float64)
+        self._yaw = yaw
+        self._rc_velocity = np.zeros(3)  # (left_right, forward_backward, up_down) in cm/s
+        self._yaw_velocity = 0.0  # in degrees per second
+        self._last_update = clock.now()
+        self._rotating_until = self._last_update
+
+        self.distance_flown = 0.0  # in meters
+        self.commands_received = 0
+
+    @property
+    def position(self) -> Vector:
+        self._advance()
+        return Vector(self._position)
+
+    @property
+    def yaw(self) -> float:
+        self._advance()
+        return self._yaw
+
+    def _advance(self):
+        """Moves the drone until the current time of the clock."""
+        now = self.clock.now()
+        # Rotations are done before anything else
+        moving_time = now - max(self._last_update, self._rotating_until)
+        self._last_update = now
+        if not self.is_flying or moving_time <= 0:
+            return
+
+        # From the frame of the drone to the frame of the scene
+        left_right, forward_backward, up_down = self._rc_velocity / 100
+        forward = np.array([-math.sin(self._yaw), math.cos(self._yaw), 0])
+        right = np.array([math.cos(self._yaw), math.sin(self._yaw), 0])
+        velocity = forward_backward * forward + left_right * right
+        velocity[2] = up_down
+
+        self._position += velocity * moving_time
+        self.distance_flown += float(np.linalg.norm(velocity)) * moving_time
+        self._yaw -= math.radians(self._yaw_velocity) * moving_time
+
+    # -------------------------------- Commands ------------------------------ #
+
+    def connect(self, wait_for_state=True):
+        self.connected = True
+
+    def end(self):
+        self.connected = False
+
+    def takeoff(self):
+        if not self.connected:
+            raise RuntimeError("The drone must be connected before taking off")
+        self._advance()
+        self.commands_received += 1
+        self.is_flying = True
+
+    def land(self):
+        self._advance()
+        self.commands_received += 1
+        self.is_flying = False
+        self._rc_velocity[:] = 0
+        self._yaw_velocity = 0.0
+
+    def send_rc_control(
+        self,
+        left_right_velocity: int,
+        forward_backward_velocity: int,
+        up_down_velocity: int,
+        yaw_velocity: int,
+    ):
+        """Like djitellopy, velocities are clamped to [-100, 100] cm/s."""
+        self._advance()
+        self.commands_received += 1
+
+        def clamp100(x):
+            return max(-100, min(100, int(x)))
+
+        self._rc_velocity = np.array(
+            [
+                clamp100(left_right_velocity),
+                clamp100(forward_backward_velocity),
+                clamp100(up_down_velocity),
+            ],
+            dtype=np.float64,
+        )
+        self._yaw_velocity = clamp100(yaw_velocity)
+
+    def rotate_clockwise(self, x: int):
+        self._rotate(-x)
+
+    def rotate_counter_clockwise(self, x: int):
+        self._rotate(x)
+
+    def _rotate(self, degrees: int):
+        if not 1 <= abs(degrees) <= 360:
+            raise ValueError(f"Rotations must be of 1 to 360 degrees, not {abs(degrees)}")
+        self._advance()
+        self.commands_received += 1
+        if not self.is_flying:
+            return
+
+        # Queued after the current rotation, if any
+        start = max(self._last_update, self._rotating_until)
+        self._rotating_until = start + abs(degrees) / self.rotation_speed
+        self._yaw += math.radians(degrees)
+
+
+def simulate_flight(
+    policy,
+    starting_position,
+    rate=10.0,
+    speed=100,
+    timeout=60.0,
+    **drone_kwargs,
+):
+    """Flies a SimulatedTello with a ControlLoop on a VirtualClock, from takeoff
+    to landing. The flight runs as fast as the policy allows.
+
+    Args:
+        policy (callable): Policy of the ControlLoop, taking the estimated position and returning the desired velocity, or None once arrived.
+        starting_position (Vector): Start position of the drone.
+        rate (float, optional): Ticks per second of the loop. Defaults to 10.0.
+        speed (int, optional): Speed of the drone, in cm/s. Defaults to 100.
+        timeout (float, optional): Duration of the flight after which the loop stops, in simulated seconds. Defaults to 60.0.
+        **drone_kwargs: Given to SimulatedTello.
+
+    Returns:
+        Tuple (control_loop, drone). The stats of the loop are in control_loop.stats
+        and the true final position in drone.position.
+    """
+    clock = VirtualClock()
+    drone = SimulatedTello(clock, position=starting_position, **drone_kwargs)
+    piloter = DronePiloter(starting_position=Vector(starting_position), drone=drone)
+    control_loop = ControlLoop(
+        piloter,
+        policy,
+        rate=rate,
+        speed=speed,
+        timeout=timeout,
+        clock=clock.now,
+        sleep=clock.sleep,
+        threaded=False,
+    )
+
+    piloter.takeoff()
+    asyncio.run(control_loop.run())
+    piloter.land()
+    return control_loop, drone
@@ -1,5 +1,14 @@
-from autodrone.flowfield import FlowField, OctreeVectorNode
+from autodrone.flowfield import FlowField, ArrayFlowField, OctreeVectorNode
+from autodrone.base import instrumentation
+from autodrone.base.raycast import EdgeVisibilityCache, MeshRaycaster
 from mathutils import Vector
+from pathlib import Path
+import hashlib
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 
 class SpaceRepresentation:
@@ -13,6 +22,11 @@ class SpaceRepresentation:
         origin_vector=Vector((0, 0, 5)),
         scene_diameter=10,
         max_depth_flowfield=4,
+        octree_backend="object",
+        raycaster=None,
+        adaptive=False,
+        clearance=0.0,
+        occupancy_exclude=("Navigator", "Destination"),
     ):
         """_summary_
 
@@ -20,19 +34,107 @@ class SpaceRepresentation:
             origin_vector (_type_, optional): _description_. Defaults to Vector((0, 0, 5)) which representes center of the scene at 5m of height.
             scene_diameter (int, optional): _description_. Defaults to 10.
             max_depth_flowfield (int, optional): _description_. Defaults to 4.
+            octree_backend (str, optional): How the octree cells are stored. "object" for one OctreeVectorNode per cell, "array" for the NumPy arrays of an ArrayFlowField, which is much lighter for deep octrees. Defaults to "object".
+            raycaster (MeshRaycaster, optional): Raycaster used to check the edges of the navigation graph against the scene. If None, rays are cast in the current Blender scene. Defaults to None.
+            adaptive (bool, optional): If True, only the cells intersecting the scene mesh (or closer to it than clearance) are subdivided, and empty space is left coarse. The is_occupied flag of the cells is set along the way. If False, every cell is subdivided down to max_depth_flowfield. Defaults to False.
+            clearance (float, optional): In adaptive mode, cells closer than this to the mesh are considered occupied. Defaults to 0.0.
+            occupancy_exclude (tuple, optional): In adaptive mode, names of the Blender objects which are not obstacles, when the mesh is read from the current Blender scene. Defaults to ("Navigator", "Destination").
         """
+        if octree_backend == "object":
+            flowfield_class = FlowField
+        elif octree_backend == "array":
+            flowfield_class = ArrayFlowField
+        else:
+            raise ValueError(
+                f"Unknown octree_backend {octree_backend}, expected 'object' or 'array'"
+            )
 
         ## CREATE THE REPRESENTATION
         # Completely fill the space around me with an octree, and subdivide it when needed
-        self.octree = FlowField(
+        self.octree = flowfield_class(
             # The root cell encompasses the entire scene
             root_center=origin_vector,
             root_size=scene_diameter,
             max_depth=max_depth_flowfield,
         )
-        self._subdivide_flowfield(self.octree)
+        if raycaster is not None:
+            self.octree.edge_visibility = EdgeVisibilityCache(
+                raycast_many=raycaster.raycast_many
+            )
+
+        if adaptive:
+            # The occupancy tests need the triangles of the scene
+            if raycaster is None:
+                raycaster = MeshRaycaster.from_blender_scene(exclude=occupancy_exclude)
+            self._subdivide_flowfield_adaptively(self.octree, raycaster, clearance)
+        else:
+            self._subdivide_flowfield(self.octree)
 
     @staticmethod
+    def cache_path(cache_dir, scene_path, **parameters) -> Path:
+        """Path of the cached representation of a scene, keyed by a hash of the
+        scene file and of the parameters used to build it.
+
+        Args:
+            cache_dir (str): Directory holding the cached representations.
+            scene_path (str): Path of the .blend file of the scene.
+            **parameters: Parameters of the representation, eg. max_depth_flowfield or those of the graph.
+        """
+        digest = hashlib.sha256()
+        with open(scene_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(json.dumps(parameters, sort_keys=True, default=tuple).encode())
+        return Path(cache_dir) / f"{digest.hexdigest()[:32]}.flowfield"
+
+    @classmethod
+    def from_cache(cls, cache_dir, scene_path=None, graph_parameters=None, **kwargs):
+        """Loads the representation of the scene from the cache if it was saved
+        before with the same parameters, otherwise builds it. Call save() once
+        it is populated to store it in the cache.
+
+        Args:
+            cache_dir (str): Directory holding the cached representations.
+            scene_path (str, optional): Path of the .blend file of the scene. Defaults to the currently open Blender file.
+            graph_parameters (dict, optional): Parameters given to populate_self to build the graph, which are part of the cache key. Defaults to None.
+            **kwargs: Parameters of SpaceRepresentation, except the raycaster.
+        """
+        if scene_path is None:
+            import bpy
+
+            scene_path = bpy.data.filepath
+
+        parameters = {k: v for k, v in kwargs.items() if k != "raycaster"}
+        path = cls.cache_path(
+            cache_dir, scene_path, graph_parameters=graph_parameters, **parameters
+        )
+
+        if path.exists():
+            logger.info("Loading the scene representation from %s", path)
+            space = cls.__new__(cls)
+            space.octree = FlowField.load(path)
+            if kwargs.get("raycaster") is not None:
+                space.octree.edge_visibility = EdgeVisibilityCache(
+                    raycast_many=kwargs["raycaster"].raycast_many
+                )
+        else:
+            space = cls(**kwargs)
+
+        space.cache_file = path
+        return space
+
+    def save(self, path=None):
+        """Saves the octree, its graph and its vectors.
+
+        Args:
+            path (str, optional): Path of the file to write. Defaults to the cache file, when created with from_cache.
+        """
+        path = Path(path if path is not None else self.cache_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.octree.save(path)
+
+    @staticmethod
+    @instrumentation.timed_function("subdivide")
     def _subdivide_flowfield(flowfield: FlowField):
         """
         For the given flowfield, will recursively subdivide each cell if it has
@@ -40,10 +142,34 @@ class SpaceRepresentation:
         """
         depth = 0
         while depth < flowfield.max_depth:
-            current_cells = flowfield.get_all_cells(leaf_nodes_only=False)
-            print(f"DIVIDING, {len(current_cells)}")
-            for cell in current_cells:
-                print(f"DIV {cell}")
-                if cell.children is None:
+            logger.info("Subdividing, depth %d", depth)
+            flowfield.subdivide_leaves(node_class=OctreeVectorNode)
+            depth += 1
+
+    @staticmethod
+    @instrumentation.timed_function("subdivide")
+    def _subdivide_flowfield_adaptively(
+        flowfield: FlowField, raycaster: MeshRaycaster, clearance: float
+    ):
+        """
+        For the given flowfield, will recursively subdivide only the cells
+        which intersect the scene mesh (or are within clearance of it), and
+        record whether each cell is occupied.
+        """
+        depth = 0
+        cells_to_check = [flowfield.root]
+        while len(cells_to_check) > 0:
+            centers = np.array([tuple(cell.center) for cell in cells_to_check])
+            half_sizes = np.array([cell.size / 2 for cell in cells_to_check])
+            occupied = raycaster.boxes_intersect(centers, half_sizes + clearance)
+            logger.info("Subdividing, depth %d, %d occupied cells", depth, occupied.sum())
+
+            next_cells_to_check = []
+            for cell, is_occupied in zip(cells_to_check, occupied):
+                cell.is_occupied = bool(is_occupied)
+                if is_occupied and depth < flowfield.max_depth:
                     cell.subdivide(node_class=OctreeVectorNode)
+                    next_cells_to_check += cell.children
+
+            cells_to_check = next_cells_to_check
             depth += 1
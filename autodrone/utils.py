@@ -1,4 +1,5 @@
 import sys
+import re
 import argparse
 
 
@@ -39,3 +40,25 @@ class ArgumentParserForBlender(argparse.ArgumentParser):
         usage examples and details.
         """
         return super().parse_args(args=self._get_argv_after_doubledash())
+
+
+def parse_position_index(text: str) -> dict:
+    """
+    Parses an index of remarkable positions, such as scenes/basic.index. Each
+    line gives a name followed by its x, y and z coordinates, separated by
+    tabs or spaces. Names may be quoted, and lines starting with '#' are
+    comments.
+
+    Returns a dict giving the (x, y, z) coordinates of each name.
+    """
+    positions = dict()
+    for line in text.splitlines():
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        match = re.fullmatch(r"(.+?)\s+(\S+)\s+(\S+)\s+(\S+)", line)
+        if match is None:
+            raise ValueError(f"Cannot parse index line, expected 'name x y z': {line}")
+        name = match.group(1).strip().strip("\"'")
+        positions[name] = tuple(float(v) for v in match.groups()[1:])
+    return positions
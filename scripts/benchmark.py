@@ -0,0 +1,326 @@
+"""
+Benchmarks the main stages of autodrone on synthetic scenes : building the
+SpaceRepresentation, its navigation graph and its flowfield, finding the cell
+of positions, and flying simulated drones through it.
+
+Each stage is timed, along with its peak memory usage (as seen by tracemalloc,
+which slows down pure Python code a little, see --no_memory), the size of
+the octree and of the graph, and the counters of autodrone.base.instrumentation
+(rays cast, searches run, ...). Results are written as JSON, one record per
+stage and configuration, so that runs can be compared. Flights which did not
+reach their destination before the timeout are reported as warnings, as they
+make the piloting timings meaningless.
+
+The scenes are meshes generated with NumPy and checked with a MeshRaycaster,
+so Blender is not needed:
+    python scripts/benchmark.py -- --depths 3 4 --output benchmark.json
+"""
+
+import sys
+
+sys.path.append(".")  # necessary to import script from the blender python interpreter
+sys.path.append("..")
+
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+from mathutils import Vector
+
+from autodrone.base import instrumentation
+from autodrone.base.raycast import MeshRaycaster
+from autodrone.control import flowfield_policy
+from autodrone.pathfind import Pathfinder
+from autodrone.simulation import simulate_flight
+from autodrone.space import SpaceRepresentation
+from autodrone.utils import ArgumentParserForBlender
+
+# Same scene as scenes/basic.blend : a cube of 10 m above the floor
+ORIGIN = (0, 0, 5)
+SCENE_DIAMETER = 10
+
+
+# ----------------------------- Synthetic scenes ----------------------------- #
+
+
+def box_triangles(box_min, box_max) -> np.ndarray:
+    """Triangles of the surface of an axis-aligned box, of shape (12, 3, 3)."""
+    corners = np.array(
+        [
+            (x, y, z)
+            for x in (box_min[0], box_max[0])
+            for y in (box_min[1], box_max[1])
+            for z in (box_min[2], box_max[2])
+        ]
+    )
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    return MeshRaycaster._triangulate(corners, quads)
+
+
+def synthetic_scene(name: str, seed=0) -> MeshRaycaster:
+    """Mesh of a synthetic scene, all of them with a floor.
+
+    Args:
+        name (str): "empty" for the floor only, "pillars" for a grid of pillars from floor to ceiling, or "boxes" for boxes of random sizes and positions.
+        seed (int, optional): Seed of the random boxes. Defaults to 0.
+    """
+    half = SCENE_DIAMETER / 2
+    boxes = [((-half, -half, -0.2), (half, half, 0.2))]  # Floor
+
+    if name == "pillars":
+        for x in (-3, 0, 3):
+            for y in (-3, 0, 3):
+                boxes.append(((x - 0.4, y - 0.4, 0), (x + 0.4, y + 0.4, SCENE_DIAMETER)))
+    elif name == "boxes":
+        rng = np.random.default_rng(seed)
+        for _ in range(12):
+            size = rng.uniform(0.5, 2.5, size=3)
+            corner = rng.uniform((-half, -half, 0), (half, half, SCENE_DIAMETER)) - size / 2
+            boxes.append((corner, corner + size))
+    elif name != "empty":
+        raise ValueError(f"Unknown scene {name}, expected 'empty', 'pillars' or 'boxes'")
+
+    return MeshRaycaster(np.concatenate([box_triangles(*box) for box in boxes]))
+
+
+# ------------------------------- Measurements ------------------------------- #
+
+
+def measure(function, memory=True):
+    """Runs the function.
+
+    Returns:
+        Tuple (result of the function, dict of the measurements).
+    """
+    gc.collect()
+    instrumentation.reset()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    measurements = {"seconds": time.perf_counter() - start}
+    if memory:
+        measurements["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    measurements["counters"] = instrumentation.summary()["counters"]
+    return result, measurements
+
+
+def fly(octree, destination_cell, starts, rate, timeout):
+    """Flies a simulated drone from each start position to the destination."""
+    policy = flowfield_policy(octree, destination_cell, Pathfinder())
+    flights = [
+        simulate_flight(policy, Vector(start), rate=rate, timeout=timeout)
+        for start in starts
+    ]
+    arrived = [not control_loop.timed_out for control_loop, _ in flights]
+    ticks = [control_loop.stats.ticks for control_loop, _ in flights]
+    # How far the estimated position drifted from the simulated drone
+    drifts = [
+        (control_loop.piloter.position - drone.position).length
+        for control_loop, drone in flights
+    ]
+    return {
+        "flights": len(flights),
+        "arrived": int(np.sum(arrived)),
+        "ticks": int(np.sum(ticks)),
+        "simulated_seconds": float(np.sum(ticks)) / rate,
+        "mean_drift": float(np.mean(drifts)) if len(drifts) > 0 else None,
+    }
+
+
+def benchmark_configuration(scene_name, depth, backend, subdivision, args) -> list:
+    """Runs every stage on one configuration. Returns the list of records."""
+    rng = np.random.default_rng(args.seed)
+    raycaster = synthetic_scene(scene_name, seed=args.seed)
+    configuration = {
+        "scene": scene_name,
+        "triangles": len(raycaster.triangles),
+        "depth": depth,
+        "backend": backend,
+        "subdivision": subdivision,
+    }
+    records = []
+
+    def record(stage, measurements, **counts):
+        records.append({**configuration, "stage": stage, **measurements, **counts})
+        print(f"{configuration} {stage}: {measurements['seconds']:.3f}s", file=sys.stderr)
+
+    space, measurements = measure(
+        lambda: SpaceRepresentation(
+            origin_vector=Vector(ORIGIN),
+            scene_diameter=SCENE_DIAMETER,
+            max_depth_flowfield=depth,
+            octree_backend=backend,
+            raycaster=raycaster,
+            adaptive=subdivision == "adaptive",
+        ),
+        memory=args.memory,
+    )
+    octree = space.octree
+    leaves = octree.get_all_cells(leaf_nodes_only=True)
+    record("space_representation", measurements, nodes=len(leaves))
+
+    octree.graph, measurements = measure(
+        lambda: octree.to_graph(processes=args.graph_processes), memory=args.memory
+    )
+    record(
+        "to_graph",
+        measurements,
+        nodes=octree.graph.number_of_nodes(),
+        edges=octree.graph.number_of_edges(),
+    )
+
+    # The destination and the start positions are in free cells
+    free_leaves = [leaf for leaf in leaves if not getattr(leaf, "is_occupied", False)]
+    destination = free_leaves[rng.integers(len(free_leaves))].center
+    _, measurements = measure(
+        lambda: octree.populate_self(endpos=destination, pathfinder=Pathfinder()),
+        memory=args.memory,
+    )
+    record("populate_self", measurements, nodes=len(leaves))
+
+    positions = rng.uniform(-0.5, 0.5, size=(args.queries, 3)) * SCENE_DIAMETER + ORIGIN
+    _, measurements = measure(
+        lambda: [octree.get_closest_cell_to_position(p) for p in positions],
+        memory=args.memory,
+    )
+    record("get_closest_cell_to_position", measurements, queries=len(positions))
+
+    # Only start from cells with a path to the destination
+    distance_field, index_of = octree.distance_field, octree.graph.index_of
+    reachable = [
+        leaf
+        for leaf in free_leaves
+        if np.isfinite(distance_field.distance(index_of[leaf.id]))
+    ]
+    starts = [
+        tuple(reachable[i].center)
+        for i in rng.integers(len(reachable), size=args.flights)
+    ]
+    destination_cell = octree.get_closest_cell_to_position(destination)
+    results, measurements = measure(
+        lambda: fly(octree, destination_cell, starts, args.control_rate, args.timeout),
+        memory=args.memory,
+    )
+    if results["arrived"] < results["flights"]:
+        # The timings then include flights which hovered until the timeout
+        results["warning"] = (
+            f"only {results['arrived']} of {results['flights']} flights arrived"
+        )
+        print(f"WARNING {configuration} piloting: {results['warning']}", file=sys.stderr)
+    record("piloting", measurements, **results)
+
+    return records
+
+
+if __name__ == "__main__":
+    parser = ArgumentParserForBlender()
+    parser.add_argument(
+        "--scenes",
+        nargs="+",
+        default=["empty", "pillars", "boxes"],
+        help=""" Synthetic scenes to benchmark, among empty, pillars and boxes""",
+    )
+    parser.add_argument(
+        "--depths",
+        nargs="+",
+        type=int,
+        default=[3, 4],
+        help=""" Maximum depths of the octree""",
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=["object"],
+        help=""" Octree backends, among object and array""",
+    )
+    parser.add_argument(
+        "--subdivisions",
+        nargs="+",
+        default=["uniform", "adaptive"],
+        help=""" Subdivision of the octree : uniform down to the depth, or adaptive around the mesh""",
+    )
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=1000,
+        help=""" Number of positions whose closest cell is searched""",
+    )
+    parser.add_argument(
+        "--flights",
+        type=int,
+        default=10,
+        help=""" Number of simulated flights, from random start positions""",
+    )
+    parser.add_argument(
+        "--control_rate",
+        type=float,
+        default=10.0,
+        help=""" Ticks per second of the control loop of the flights""",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help=""" Duration after which a flight is stopped, in simulated seconds""",
+    )
+    parser.add_argument(
+        "--graph_processes",
+        type=int,
+        default=None,
+        help=""" Number of processes used to build the navigation graph. Defaults to a single process""",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no_memory",
+        dest="memory",
+        action="store_false",
+        help=""" Do not measure the peak memory, which slows down the stages""",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help=""" JSON file where the results are written. Defaults to the standard output""",
+    )
+    args = parser.parse_args()
+    instrumentation.enable()
+
+    records = []
+    for scene_name in args.scenes:
+        for depth in args.depths:
+            for backend in args.backends:
+                for subdivision in args.subdivisions:
+                    records += benchmark_configuration(
+                        scene_name, depth, backend, subdivision, args
+                    )
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "parameters": vars(args),
+        "results": records,
+        "warnings": [
+            f"{record['scene']} depth {record['depth']} {record['backend']} {record['subdivision']} {record['stage']}: {record['warning']}"
+            for record in records
+            if "warning" in record
+        ],
+    }
+    text = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(text)
+    else:
+        print(text)
+    if len(results["warnings"]) > 0:
+        print(f"{len(results['warnings'])} warnings:", file=sys.stderr)
+        for warning in results["warnings"]:
+            print(f"  {warning}", file=sys.stderr)
@@ -1,20 +1,30 @@
 import sys
+import time
+
+startup_start_time = time.perf_counter()
 
 sys.path.append(".")  # necessary to import script from the blender python interpreter
 sys.path.append("..")
 
 
+import asyncio
+import logging
+from contextlib import ExitStack
 from pathlib import Path
-import time
-from autodrone.utils import ArgumentParserForBlender
+from autodrone.utils import ArgumentParserForBlender, parse_position_index
+from autodrone.base import instrumentation
 
 
 from autodrone.space import SpaceRepresentation
 from autodrone.pilot import DronePiloter
 from autodrone.pathfind import Pathfinder
+from autodrone.control import ControlLoop, flowfield_policy
+from autodrone.simulation import simulate_flight
+from autodrone.locations import LocationResolver
 
 # from autodrone.main import update
-from autodrone.llm import RAG_LLMAgent
+# Cheap : the LLM stack is only imported when an instruction is given
+from autodrone.llm import RAG_LLMAgent, ResponseCache
 
 # Blender modules
 try:
@@ -25,6 +35,8 @@ except ImportError:
         "Cannot find Blender modules. Did you run this script using the Blender Python interpreter?"
     )
 
+imports_end_time = time.perf_counter()
+
 # Argparser
 parser = ArgumentParserForBlender()
 parser.add_argument(
@@ -43,8 +55,83 @@ parser.add_argument(
     help=""" Path to the index text file, each line giving a remarkable position in format: name\tx\ty\tz""",
     default=None,
 )
+parser.add_argument(
+    "-cd",
+    "--cache_dir",
+    type=str,
+    required=False,
+    help=""" Directory where the scene representation, the embeddings of the index and the answers of the LLM are saved, and loaded from on the next runs with the same scene and index""",
+    default=None,
+)
+parser.add_argument(
+    "-pi",
+    "--precompute_index",
+    action="store_true",
+    help=""" Precompute the flowfield towards every position of the index, so that going to any of them later is instant""",
+)
+parser.add_argument(
+    "-gp",
+    "--graph_processes",
+    type=int,
+    required=False,
+    help=""" Number of processes used to build the navigation graph of the scene. Defaults to a single process""",
+    default=None,
+)
+parser.add_argument(
+    "-cr",
+    "--control_rate",
+    type=float,
+    required=False,
+    help=""" Number of commands sent to the drone per second. Defaults to 10""",
+    default=10.0,
+)
+parser.add_argument(
+    "-sim",
+    "--simulate",
+    action="store_true",
+    help=""" Fly a simulated drone on a virtual clock instead of the real one, faster than real time""",
+)
+parser.add_argument(
+    "-ll",
+    "--log_level",
+    type=str,
+    required=False,
+    help=""" Level of the messages shown : DEBUG, INFO, WARNING or ERROR. Defaults to INFO""",
+    default="INFO",
+)
+parser.add_argument(
+    "-in",
+    "--instrument",
+    action="store_true",
+    help=""" Count the rays cast, edges added, searches run, cells visited and time the main stages, and print a summary at the end""",
+)
+parser.add_argument(
+    "-pr",
+    "--profile",
+    type=str,
+    required=False,
+    help=""" Profile the run with cProfile and dump the statistics to this file""",
+    default=None,
+)
+parser.add_argument(
+    "-st",
+    "--startup_time",
+    action="store_true",
+    help=""" Measure the time taken to start (imports and scene representation), print it and exit""",
+)
 args = parser.parse_args()
 
+logging.basicConfig(
+    level=args.log_level.upper(),
+    format="%(asctime)s %(name)s %(levelname)s: %(message)s",
+)
+if args.instrument:
+    instrumentation.enable()
+# Closed at the end of the run
+exit_stack = ExitStack()
+if args.profile is not None:
+    exit_stack.enter_context(instrumentation.profile(args.profile))
+
 
 if args.start_pos is not None:
     start_position = Vector((float(i) for i in args.start_pos.split(",")))
@@ -66,9 +153,27 @@ print(f"Start position: {start_position}")
 
 # Create a SpaceRepresentation based on the currently open Blender file (the
 # file with which the script was called).
-scene = SpaceRepresentation(max_depth_flowfield=3)
+if args.cache_dir is not None:
+    scene = SpaceRepresentation.from_cache(args.cache_dir, max_depth_flowfield=3)
+else:
+    scene = SpaceRepresentation(max_depth_flowfield=3)
 # NOTE If the scene changes (new obstacles, ...) the SpaceRepresentation must
-# be updated.
+# be updated : once populated, call scene.octree.update_cells with the cells
+# around the change to repair the graph and the flowfield.
+
+if args.startup_time:
+    startup_end_time = time.perf_counter()
+    heavy_modules = ["torch", "transformers", "langchain", "djitellopy", "networkx"]
+    print(f"Imports: {imports_end_time - startup_start_time:.2f} s")
+    print(f"Scene representation: {startup_end_time - imports_end_time:.2f} s")
+    print(f"Startup: {startup_end_time - startup_start_time:.2f} s")
+    print(
+        f"Heavy modules imported: {[m for m in heavy_modules if m in sys.modules]}"
+    )
+    exit_stack.close()  # Writes the profile, if any
+    if args.instrument:
+        print(instrumentation.format_summary())
+    sys.exit(0)
 
 
 # ------------------------ Command interpretation ---------------------------- #
@@ -83,19 +188,37 @@ user_input = input(
 # Continue the code after Enter is pressed
 print(f"You said: {user_input}. Your request will now be processed.")
 
-try:  # TODO This big try except is here until the LLM is setup properly
-    llm_rag_agent = RAG_LLMAgent(
-        model_name="mistralai/Mistral-7B-Instruct-v0.2", prompt_template_key="drone_loc"
+if user_input == "":
+    # The LLM is not needed, so it is not even loaded
+    print(
+        "You returned an empty input. We will default to the position of the 'Destination' object if present in the scene."
     )
+    target_position = bpy.data.objects["Destination"].location
+else:
     index = Path(args.index_path).read_text()
-    llm_rag_agent.setup_retriever_for_this_context(text=index)
+    # Commands simply naming positions of the index are resolved without the LLM
+    target_position = LocationResolver.from_index(index).resolve(user_input)
 
-    if user_input == "":
-        print(
-            "You returned an empty input. We will default to the position of the 'Destination' object if present in the scene."
+if target_position is not None:
+    target_position = Vector(target_position)
+else:
+    try:  # TODO This big try except is here until the LLM is setup properly
+        llm_rag_agent = RAG_LLMAgent(
+            model_name="mistralai/Mistral-7B-Instruct-v0.2",
+            prompt_template_key="drone_loc",
+            # Generation stops as soon as the coordinates were generated
+            stop_at_coordinates=True,
+            # Repeated instructions are answered without generating again
+            response_cache=ResponseCache(
+                Path(args.cache_dir) / "responses.json"
+                if args.cache_dir is not None
+                else None
+            ),
         )
-        target_position = bpy.data.objects["Destination"].location
-    else:
+        llm_rag_agent.setup_retriever_for_this_context(
+            text=index, cache_dir=args.cache_dir
+        )
+
         target_position = llm_rag_agent(question=user_input)
         # TODO Sanity checks !
         try:
@@ -107,113 +230,91 @@ try:  # TODO This big try except is here until the LLM is setup properly
                 Output of the LLM: {target_position}
                 """
             )
-    print(f"Target position: {target_position}")
-except:
-    print(
-        "Error setting up the LLM, likely due to NotImplementedError. We will instead use the position of the 'Destination' object until this is fixed."
-    )
-    target_position = bpy.data.objects["Destination"].location
+    except:
+        print(
+            "Error setting up the LLM, likely due to NotImplementedError. We will instead use the position of the 'Destination' object until this is fixed."
+        )
+        target_position = bpy.data.objects["Destination"].location
+print(f"Target position: {target_position}")
 
 
 # ----------------------------- Pathfinding ---------------------------------- #
 
 # Initialize modules
 pathfinder = Pathfinder()
-drone_piloter = DronePiloter(
-    starting_position=start_position,
-    debug_mode=True,  # TODO Remove this argument to test on a real drone
-)
-
-# Now that we have the targets, compute the paths and populate the flowfield.
-scene.octree.populate_self(
-    endpos=target_position, pathfinder=pathfinder, top_k_neighbors_graph_conversion=8
-)
-scene.octree.produce_visualisation()
-
 
 # In theory, as long as the target does not change, we do not need to recompute
 # the paths even if the starting position changes (that's the entire point of
 # the flowfield).
 
+if args.precompute_index:
+    index_positions = parse_position_index(Path(args.index_path).read_text())
+    scene.octree.precompute_destinations(
+        [Vector(position) for position in index_positions.values()],
+        pathfinder=pathfinder,
+        graph_processes=args.graph_processes,
+    )
+
 destination_cell = scene.octree.get_closest_cell_to_position(target_position)
 
+# Now that we have the targets, compute the paths and populate the flowfield,
+# unless it was loaded from the cache with this destination already.
+if scene.octree.destination_cell_id != destination_cell.id:
+    scene.octree.populate_self(
+        endpos=target_position,
+        pathfinder=pathfinder,
+        graph_processes=args.graph_processes,
+    )
+    if args.cache_dir is not None:
+        scene.save()
+scene.octree.produce_visualisation()
+
 
 # ------------------------------ Piloting ------------------------------------ #
-stop = False
-start_time = time.time()
-
-drone_piloter.takeoff()
-
-while not stop:
-    print("Main loop...")
-    # The main pathfiding relies on the scene cartography obtained by photogrammetry.
-    # We use it to get a velocity vector towards next waypoint. Then, we combine
-    # it with a local avoidance which corrects this vector to ensure we don't
-    # bump into anything.
-    # I don't think we need to update the scene representation by adding
-    # obstacles unless they are massive, new, and immobile.
-
-    # My pathing_vector is the vector (in the flowfield) of the cell I am
-    # currently standing inside of.
-    closest_cell = scene.octree.get_closest_cell_to_position(
-        drone_piloter.position
-    )  # TODO closest, or inside ?
-    pathing_vector = closest_cell.vector
-
-    print(f"Current pathing vector {pathing_vector} from cell {closest_cell}")
-
-    # Apply local avoidance behavior to edit the pathing_vector
-    final_vector_velocity = pathfinder.local_avoidance_behavior(
-        desired_path_vector=pathing_vector
-    )
+TIMEOUT = 60
+SPEED = 100
+
 
-    # Finally, instruct the drone piloter to move at this velocity
-    # We maintain the instruction for one entire second
-    # Each step, we get the estimated dx dy dz in cm/s
-    COMMAND_MAINTAIN_TIME = 1
-    SPEED = 100
-    piloting_start_time = order_time = time.time()
+# Follow the flowfield until the destination cell is reached
+piloting_policy = flowfield_policy(scene.octree, destination_cell, pathfinder)
 
-    order_time = time.time()
-    dx, dy, dz, rotation = drone_piloter.send_instructions(
-        final_vector_velocity, speed=SPEED
+if args.simulate:
+    # Fly a simulated drone, on a virtual clock : as fast as possible
+    control_loop, simulated_drone = simulate_flight(
+        piloting_policy,
+        start_position,
+        rate=args.control_rate,
+        speed=SPEED,
+        timeout=TIMEOUT,
     )
-    time.sleep(
-        COMMAND_MAINTAIN_TIME
-    )  # Maintain the current command for COMMAND_MAINTAIN_TIME
-
-    print(f"dx {dx}, dy {dy}, dz {dz}, rotation {rotation}")
-
-    # Update our estimated position based on our speed
-    # Recall that the speed was given in cm/s in the vector (as per DJiTelloPy's doc), and
-    # that we update the position every second, so we just divide by 100
-    # 100 cm in a meter, multiplied by one second (by default the command maintain time is one second)
-    drone_piloter.update_position(
-        dx=dx / 100 * COMMAND_MAINTAIN_TIME,
-        dy=dy / 100 * COMMAND_MAINTAIN_TIME,
-        dz=dz / 100 * COMMAND_MAINTAIN_TIME,
-        rotation=rotation,
+    print(f"Simulated drone landed at {simulated_drone.position}")
+else:
+    drone_piloter = DronePiloter(
+        starting_position=start_position,
+        debug_mode=True,  # TODO Remove this argument to test on a real drone
     )
-    # dx, dy, dz, rotation = 0, 0, 0, 0  # Reset memorized movement
 
-    # If we have arrived at our destination, stop
-    current_closest_cell = scene.octree.get_closest_cell_to_position(
-        drone_piloter.position
+    # The drone is instructed several times per second, each command being sent
+    # without blocking the loop. The position is estimated in between from the
+    # velocity of the last command.
+    control_loop = ControlLoop(
+        drone_piloter,
+        piloting_policy,
+        rate=args.control_rate,
+        speed=SPEED,
+        timeout=TIMEOUT,
     )
 
-    print(f"Current cell {current_closest_cell} -> Destination {destination_cell}")
-
-    if current_closest_cell == destination_cell:
-        stop = True
-        print("Destination reached.")
+    drone_piloter.takeoff()
+    asyncio.run(control_loop.run())  # Stops the drone when done
 
-    # If we have timed out, stop
-    TIMEOUT = 60
-    if time.time() > start_time + TIMEOUT:
-        stop = True
-        print("Timed out.")
+    # Tell the drone to land
+    drone_piloter.land()
 
+if control_loop.timed_out:
+    print("Timed out.")
+print(f"Control loop: {control_loop.stats}")
 
-# Stop the drone and tell it to land
-drone_piloter.send_instructions(Vector((0, 0, 0)), speed=0)
-drone_piloter.land()
+exit_stack.close()
+if args.instrument:
+    print(instrumentation.format_summary())
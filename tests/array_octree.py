@@ -0,0 +1,50 @@
+import sys
+sys.path.append(".")
+
+from autodrone.base.array_octree import ArrayOctree
+from mathutils import Vector
+
+# Test subdivision
+t = ArrayOctree(root_center=Vector((0, 0, 0)), root_size=10)
+t.root.subdivide()
+
+assert set([tuple(n.center) for n in t.root.children]) == set(
+    [
+        (-2.5, -2.5, -2.5),
+        (-2.5, -2.5, 2.5),
+        (-2.5, 2.5, -2.5),
+        (-2.5, 2.5, 2.5),
+        (2.5, -2.5, -2.5),
+        (2.5, -2.5, 2.5),
+        (2.5, 2.5, -2.5),
+        (2.5, 2.5, 2.5),
+    ]
+)
+assert all(n.parent == t.root for n in t.root.children)
+
+# Views write through to the arrays
+cell = t.root.children[3]
+cell.vector = Vector((1, 2, 3))
+cell.is_occupied = True
+assert tuple(t.vectors[cell.id]) == (1, 2, 3)
+assert t.get_cell_by_name(cell.id).is_occupied
+
+# Subdivide every leaf, then grow beyond the initial capacity
+t.subdivide_leaves()
+assert len(t.get_all_cells()) == 1 + 8 + 8 * 8
+t.subdivide_leaves()
+t.subdivide_leaves()
+assert len(t.get_all_cells(leaf_nodes_only=True)) == 8**4
+assert all(n.size == 10 / 2**4 for n in t.get_all_cells(leaf_nodes_only=True))
+
+# Test distance
+closenode = t.get_closest_cell_to_position((4.6875, 4.6875, 4.6875))
+assert tuple(closenode.center) == (4.6875, 4.6875, 4.6875)
+
+# Test point location
+assert t.locate_cell((20, 20, 20)) is None
+assert tuple(t.get_closest_cell_to_position((20, 20, 20)).center) == (4.6875, 4.6875, 4.6875)
+positions = [(4.6875, 4.6875, 4.6875), (1, -4, 0.5), (20, 20, 20)]
+indices = t.locate_indices(positions)
+assert indices[-1] == -1
+assert list(indices[:2]) == [t.locate_cell(p).id for p in positions[:2]]
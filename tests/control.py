@@ -0,0 +1,113 @@
+import sys
+
+sys.path.append(".")
+
+import asyncio
+
+from autodrone.control import ControlLoop
+from autodrone.pilot import DronePiloter
+
+from mathutils import Vector
+
+
+# Virtual time, so the test does not depend on the speed of the machine
+now = [0.0]
+
+
+def clock():
+    return now[0]
+
+
+async def sleep(duration):
+    now[0] += duration
+    # Leave time to the worker thread to send the command
+    await asyncio.sleep(0.01)
+
+
+def make_loop(policy, **kwargs):
+    now[0] = 0.0
+    piloter = DronePiloter(starting_position=Vector((0, 0, 5)), debug_mode=True)
+    return piloter, ControlLoop(
+        piloter, policy, rate=10.0, speed=100, clock=clock, sleep=sleep, **kwargs
+    )
+
+
+# ------------------------------ Dead reckoning ------------------------------ #
+# Fly along x at 1 m/s for one second
+calls = []
+
+
+def policy(position):
+    calls.append(position.copy())
+    if len(calls) > 10:
+        return None
+    return Vector((1, 0, 0))
+
+
+piloter, loop = make_loop(policy)
+stats = asyncio.run(loop.run())
+print(stats)
+
+assert stats.ticks == 11
+assert stats.overruns == 0
+assert stats.dispatched == 11  # 10 commands, then the stop command
+assert not loop.timed_out
+# Positions are estimated from the velocity of the last command sent (Vector
+# stores single precision floats)
+assert calls[0] == Vector((0, 0, 5))
+assert abs(calls[1].x - 0.1) < 1e-5
+assert abs(piloter.position.x - 1.0) < 1e-5
+assert piloter.position.y == 0 and piloter.position.z == 5
+assert loop.velocity == (0, 0, 0)  # Stopped
+
+
+# --------------------------------- Overruns --------------------------------- #
+calls = []
+
+
+def slow_policy(position):
+    calls.append(position.copy())
+    if len(calls) == 3:
+        now[0] += 0.35  # This step takes longer than the period
+    if len(calls) > 5:
+        return None
+    return Vector((1, 0, 0))
+
+
+piloter, loop = make_loop(slow_policy)
+stats = asyncio.run(loop.run())
+print(stats)
+
+assert stats.overruns == 1
+assert abs(stats.max_lateness - 0.25) < 1e-5
+# The position still follows the elapsed time
+assert abs(piloter.position.x - (0.5 + 0.25)) < 1e-5
+
+
+# ---------------------------------- Timeout --------------------------------- #
+piloter, loop = make_loop(lambda position: Vector((0, 1, 0)), timeout=0.55)
+stats = asyncio.run(loop.run())
+print(stats)
+
+assert loop.timed_out
+assert stats.ticks == 6
+
+
+# --------------------------- Errors from the drone -------------------------- #
+class FailingPiloter(DronePiloter):
+    def send_instructions(self, desired_velocity, speed=100):
+        raise ConnectionError("Tello unreachable")
+
+
+now[0] = 0.0
+loop = ControlLoop(
+    FailingPiloter(starting_position=Vector((0, 0, 0)), debug_mode=True),
+    lambda position: Vector((1, 0, 0)),
+    clock=clock,
+    sleep=sleep,
+)
+try:
+    asyncio.run(loop.run())
+    raise AssertionError("The error of the drone was not raised")
+except ConnectionError:
+    pass
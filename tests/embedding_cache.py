@@ -0,0 +1,72 @@
+import sys
+
+sys.path.append(".")
+
+import tempfile
+
+import numpy as np
+
+from autodrone.llm import EmbeddingCache, LazyEmbeddings
+
+
+class CountingEmbeddings:
+    """Stands in for a langchain embedding model, counting embedded texts."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded += texts
+        return [[len(text), text.count("desk"), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+index = ["Alice's desk\t10\t10\t0", "Guillaume's desk\t0\t0\t0", "Kitchen\t5\t0\t0"]
+
+with tempfile.TemporaryDirectory() as directory:
+    embeddings = CountingEmbeddings()
+    vectors = EmbeddingCache(directory, "some/model").embed(index, embeddings)
+    assert vectors.shape == (3, 3)
+    assert embeddings.embedded == index
+
+    # Reloaded from the disk : nothing is embedded again
+    cache = EmbeddingCache(directory, "some/model")
+    assert len(cache) == 3
+    assert np.array_equal(cache.embed(index, embeddings), vectors)
+    assert len(embeddings.embedded) == 3
+
+    # Only the modified and new lines are embedded
+    changed_index = [index[0], "Guillaume's desk\t1\t0\t0", index[2], "Door\t0\t5\t0"]
+    changed_vectors = EmbeddingCache(directory, "some/model").embed(
+        changed_index, embeddings
+    )
+    assert embeddings.embedded[3:] == changed_index[1:2] + changed_index[3:]
+    assert np.array_equal(changed_vectors[[0, 2]], vectors[[0, 2]])
+
+    # The lines removed from the index are removed from the cache
+    assert len(EmbeddingCache(directory, "some/model")) == 4
+
+    # Another model has its own embeddings
+    EmbeddingCache(directory, "other/model").embed(index, embeddings)
+    assert len(embeddings.embedded) == 5 + 3
+
+# The embedding model is only loaded when something is embedded
+loads = []
+
+
+def load():
+    loads.append(1)
+    return CountingEmbeddings()
+
+
+with tempfile.TemporaryDirectory() as directory:
+    EmbeddingCache(directory, "some/model").embed(index, LazyEmbeddings(load))
+    assert len(loads) == 1
+
+    embeddings = LazyEmbeddings(load)
+    EmbeddingCache(directory, "some/model").embed(index, embeddings)
+    assert len(loads) == 1
+    embeddings.embed_query("Go to Alice's desk")
+    assert len(loads) == 2
@@ -0,0 +1,119 @@
+import sys
+sys.path.append(".")
+
+from autodrone.flowfield import FlowField, ArrayFlowField
+from autodrone.base.raycast import EdgeVisibilityCache
+from autodrone.pathfind import Pathfinder
+from tests.helpers import no_obstacle
+from mathutils import Vector
+
+
+class CountingPathfinder(Pathfinder):
+    searches = 0
+
+    def shortest_path_tree(self, *args, **kwargs):
+        self.searches += 1
+        return super().shortest_path_tree(*args, **kwargs)
+
+
+for flowfield_class in (FlowField, ArrayFlowField):
+    flowfield = flowfield_class(root_center=Vector((0, 0, 0)), root_size=10, max_depth=2)
+    flowfield.edge_visibility = EdgeVisibilityCache(raycast_many=no_obstacle)
+    flowfield.subdivide_leaves()
+    flowfield.subdivide_leaves()
+    pathfinder = CountingPathfinder()
+
+    # Going back to a previous destination reuses its cached vectors
+    flowfield.populate_self(endpos=Vector((4, 4, 4)), pathfinder=pathfinder)
+    vectors_a = flowfield.get_vector_layer()
+    flowfield.populate_self(endpos=Vector((-4, -4, -4)), pathfinder=pathfinder)
+    vectors_b = flowfield.get_vector_layer()
+    assert (vectors_a != vectors_b).any()
+
+    flowfield.populate_self(endpos=Vector((4, 4, 4)), pathfinder=pathfinder)
+    assert pathfinder.searches == 2
+    assert (flowfield.get_vector_layer() == vectors_a).all()
+    assert flowfield.destination_cell_id == flowfield.locate_cell((4, 4, 4)).id
+
+    # Least recently used layers are evicted beyond the memory budget
+    flowfield.vector_layers.max_bytes = 2 * vectors_a.nbytes
+    flowfield.precompute_destinations(
+        [Vector((-4, -4, -4)), Vector((4, -4, 4))], pathfinder=pathfinder
+    )
+    assert len(flowfield.vector_layers) == 2
+    assert flowfield.locate_cell((4, 4, 4)).id not in flowfield.vector_layers
+    assert flowfield.locate_cell((-4, -4, -4)).id in flowfield.vector_layers
+    assert pathfinder.searches == 3
+
+
+# Test repairing the flowfield after obstacles appear and disappear
+import math
+import networkx as nx
+
+for flowfield_class in (FlowField, ArrayFlowField):
+    flowfield = flowfield_class(root_center=Vector((0, 0, 0)), root_size=8, max_depth=3)
+    flowfield.edge_visibility = EdgeVisibilityCache(raycast_many=no_obstacle)
+    for _ in range(3):
+        flowfield.subdivide_leaves()
+    flowfield.populate_self(endpos=Vector((3.5, 3.5, 3.5)), pathfinder=Pathfinder())
+
+    # A wall at x = 0.5 with a hole in a corner
+    wall = [
+        cell
+        for cell in flowfield.get_all_cells(leaf_nodes_only=True)
+        if cell.center.x == 0.5 and (cell.center.y, cell.center.z) != (-3.5, -3.5)
+    ]
+    for changes in ([True] * len(wall), [False] * (len(wall) // 2)):
+        for cell, is_occupied in zip(wall, changes):
+            cell.is_occupied = is_occupied
+        flowfield.update_cells(wall[: len(changes)])
+
+        expected_graph = flowfield.to_graph().to_networkx()
+        graph = flowfield.graph.to_networkx()
+        assert sorted(map(sorted, graph.edges())) == sorted(
+            map(sorted, expected_graph.edges())
+        )
+        expected = nx.single_source_dijkstra_path_length(
+            expected_graph, flowfield.destination_cell_id
+        )
+        for cell in flowfield.get_all_cells(leaf_nodes_only=True):
+            distance = flowfield.distance_field.distance(flowfield.graph.index_of[cell.id])
+            assert math.isclose(distance, expected.get(cell.id, math.inf))
+            # Vectors follow a shortest path
+            if distance not in (0, math.inf):
+                next_cell = flowfield.locate_cell(cell.center + cell.vector)
+                weight = graph.edges[cell.id, next_cell.id]["weight"]
+                assert math.isclose(expected[next_cell.id] + weight, distance)
+
+
+# Test sampling the flowfield between cells
+import numpy as np
+
+for flowfield_class in (FlowField, ArrayFlowField):
+    flowfield = flowfield_class(root_center=Vector((0, 0, 0)), root_size=8, max_depth=3)
+    for _ in range(2):
+        flowfield.subdivide_leaves()
+    leaves = flowfield.get_all_cells(leaf_nodes_only=True)
+    for cell in leaves:
+        cell.vector = Vector((cell.center.x, 2 * cell.center.y, 0))
+    flowfield.set_vector_layer(flowfield.get_vector_layer())
+
+    # A linear field is reproduced exactly between the cell centers
+    positions = np.random.default_rng(0).uniform(-3, 3, size=(100, 3))
+    expected = positions * (1, 2, 0)
+    assert np.allclose(flowfield.sample(positions), expected)
+
+    # Leaves get their own vector at their center, and farther away the vector
+    # of the closest leaf
+    centers = np.array([tuple(cell.center) for cell in leaves])
+    assert np.allclose(flowfield.sample(centers), centers * (1, 2, 0))
+    assert np.allclose(flowfield.sample([(10, 3, 3)]), [(3, 6, 0)])
+
+    # Occupied cells are left out, and smaller cells are handled
+    flowfield.locate_cell((1, 1, 1)).is_occupied = True
+    flowfield.locate_cell((-1, -1, -1)).subdivide()
+    for cell in flowfield.get_all_cells(leaf_nodes_only=True):
+        cell.vector = Vector((cell.center.x, 2 * cell.center.y, 0))
+    flowfield.set_vector_layer(flowfield.get_vector_layer())
+    sampled = flowfield.sample([(2, 1, 1), (-1.5, -1.5, -1.5), (-0.5, -0.5, 0.5)])
+    assert np.allclose(sampled, [(3, 2, 0), (-1.5, -3, 0), (-0.5, -1, 0)])
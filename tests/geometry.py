@@ -0,0 +1,59 @@
+import sys
+sys.path.append(".")
+
+import math
+
+import numpy as np
+from autodrone.base.mathutils import (
+    distances_to_point,
+    euclidian_distance,
+    k_nearest,
+    pairwise_distances,
+    project_on_plane,
+    project_on_plane_many,
+    vector_to_euler,
+    vectors_to_euler,
+)
+from mathutils import Vector
+
+rng = np.random.default_rng(0)
+points = rng.uniform(-5, 5, size=(300, 3))
+queries = rng.uniform(-5, 5, size=(40, 3))
+
+# Distances
+assert euclidian_distance((1, 2, 3), (4, 6, 3)) == 5
+assert euclidian_distance(Vector((3, 4, 0))) == 5
+assert np.allclose(
+    distances_to_point(points, queries[0]),
+    [math.dist(p, queries[0]) for p in points],
+)
+d = pairwise_distances(queries, points)
+assert d.shape == (40, 300)
+assert math.isclose(d[3, 7], math.dist(queries[3], points[7]))
+
+# Nearest neighbours, by brute force in small batches
+indices, distances = k_nearest(points, queries, k=5, batch_size=16)
+assert (indices == np.argsort(d, axis=1)[:, :5]).all()
+assert np.allclose(distances, np.sort(d, axis=1)[:, :5])
+indices, distances = k_nearest(points, queries, k=5, max_distance=1.5)
+assert ((indices == -1) == (distances > 1.5)).all()
+indices, _ = k_nearest(points[:3], queries, k=5)
+assert (indices[:, 3:] == -1).all()
+
+# Projection
+up = Vector((0, 0, 1))
+assert project_on_plane(Vector((1, 2, 3)), up) == Vector((1, 2, 0))
+assert np.allclose(project_on_plane_many(points, up)[:, 2], 0)
+
+# Same angles as Blender, for random and axis-aligned vectors
+axes = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+vectors = np.concatenate([rng.normal(size=(500, 3)), axes])
+angles = vectors_to_euler(vectors)
+for vector, angle in zip(vectors, angles):
+    expected = Vector(vector).to_track_quat("-Z", "Y").to_euler()
+    difference = np.abs(np.array(angle) - np.array(expected))
+    assert np.all(np.minimum(difference, abs(difference - 2 * math.pi)) < 1e-4)
+assert tuple(vectors_to_euler([(0, 0, 0)])[0]) == (0, 0, 0)
+assert np.allclose(
+    vectors_to_euler([(1, 2, 3)])[0], vector_to_euler(Vector((1, 2, 3))), atol=1e-6
+)
@@ -0,0 +1,7 @@
+"""Helpers shared by the tests, imported with `from tests.helpers import ...`
+from the root of the repository."""
+
+
+def no_obstacle(origins, targets):
+    """raycast_many of an empty scene : no segment hits anything."""
+    return [None for _ in origins]
@@ -0,0 +1,64 @@
+import sys
+
+sys.path.append(".")
+
+import os
+import pstats
+import tempfile
+
+from autodrone.base import instrumentation
+from autodrone.base.octree import Octree
+from autodrone.base.raycast import EdgeVisibilityCache
+from tests.helpers import no_obstacle
+
+
+def build_graph():
+    t = Octree((0, 0, 0), 10, 10)
+    t.root.subdivide()
+    t.edge_visibility = EdgeVisibilityCache(raycast_many=no_obstacle)
+    graph = t.to_graph()
+    graph.dijkstra(0)
+    graph.astar(0, 7)
+    return graph
+
+
+# Nothing is recorded until enabled
+build_graph()
+assert instrumentation.summary() == {"counters": {}, "timers": {}}
+
+instrumentation.enable()
+graph = build_graph()
+summary = instrumentation.summary()
+print(instrumentation.format_summary())
+
+# The 8 children of the root all touch each other
+assert summary["counters"]["rays_cast"] == 28
+assert summary["counters"]["edges_checked"] == 28
+assert summary["counters"]["graph_edges_added"] == graph.number_of_edges() == 28
+assert summary["counters"]["searches"] == 2
+assert summary["counters"]["cells_visited"] == 8 + 2
+assert summary["timers"]["to_graph"]["count"] == 1
+assert summary["timers"]["dijkstra"]["count"] == 1
+assert summary["timers"]["astar"]["count"] == 1
+
+# Cached edges are not cast again
+graph = build_graph()
+assert instrumentation.summary()["counters"]["rays_cast"] == 28 * 2
+
+with instrumentation.timed("block"):
+    pass
+instrumentation.record_time("block", 2.0)
+timer = instrumentation.summary()["timers"]["block"]
+assert timer["count"] == 2 and timer["max_seconds"] == 2.0
+
+instrumentation.reset()
+assert instrumentation.summary() == {"counters": {}, "timers": {}}
+instrumentation.enable(False)
+
+# Profiles can be dumped for pstats
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "graph.prof")
+    with instrumentation.profile(path):
+        build_graph()
+    stats = pstats.Stats(path)
+    assert any(function == "to_graph" for _, _, function in stats.stats)
@@ -37,4 +37,18 @@ result = my_rag_agent(
     question="Give me the coordinates of the midpoint between Alice's and Guillaume's desk.",
 )
 print(result)
-assert result == "(5, 5, 0)"
+assert result == (5, 5, 0)
+
+# Generation stops once the coordinates are generated
+my_rag_agent = RAG_LLMAgent(
+    model_name="microsoft/phi-2",
+    prompt_template_key="drone_loc",
+    stop_at_coordinates=True,
+)
+my_rag_agent.setup_retriever_for_this_context(text=index)
+
+result = my_rag_agent(
+    question="Give me the coordinates of the midpoint between Alice's and Guillaume's desk.",
+)
+print(result)
+assert result == (5, 5, 0)
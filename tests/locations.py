@@ -0,0 +1,66 @@
+import sys
+
+sys.path.append(".")
+
+from pathlib import Path
+
+from autodrone.locations import LocationResolver
+
+index = """
+#Name\tx\ty\tz
+Alice's desk\t10\t10\t0
+Guillaume's desk\t0\t0\t0
+Desk\t1\t1\t1
+Kitchen\t5\t0\t0
+"Meeting point"\t4\t2\t0
+Top of the stairs\t-5\t3\t2.5
+"""
+resolver = LocationResolver.from_index(index)
+
+# Exact names, whatever the case and punctuation, the longest one first
+assert resolver.resolve("Go to Alice's desk") == (10, 10, 0)
+assert resolver.resolve("Give me the coordinates of Alice's desk.") == (10, 10, 0)
+assert resolver.resolve("fly to the DESK please") == (1, 1, 1)
+assert resolver.resolve("Go to the meeting point") == (4, 2, 0)
+assert resolver.resolve("Go to the top of the stairs") == (-5, 3, 2.5)
+
+# Misspelled names
+assert resolver.resolve("Go to Alise's desk") == (10, 10, 0)
+assert resolver.resolve("go to top of stairs") == (-5, 3, 2.5)
+assert resolver.resolve("Go to Bob's office") is None
+
+# Commands saying more than a name are left to the LLM
+assert resolver.resolve("Dont go to Alice's desk") is None
+assert resolver.resolve("Do not go to Alice's desk") is None
+assert resolver.resolve("Avoid Alice's desk") is None
+assert resolver.resolve("Go near Alice's desk") is None
+assert resolver.resolve("Go next to Alice's desk") is None
+assert resolver.resolve("Go behind Alice's desk") is None
+assert resolver.resolve("Go to Alicia's desk") is None
+assert resolver.resolve("Go to Alice's desk and not the kitchen") is None
+
+# Midpoints, including names sharing their end
+assert resolver.resolve(
+    "Give me the coordinates of the midpoint between Alice's and Guillaume's desk."
+) == (5, 5, 0)
+assert resolver.resolve("Halfway between the desk and the meeting point") == (2.5, 1.5, 0.5)
+assert resolver.resolve("Middle of Alice's desk, Guillaume's desk and the desk") == (
+    11 / 3,
+    11 / 3,
+    1 / 3,
+)
+assert resolver.resolve("Midpoint between Alice's desk and Bob's office") is None
+
+# Coordinates
+assert resolver.resolve("Go to (1, 2.5, -3)") == (1, 2.5, -3)
+assert resolver.resolve("Move 2 meters above (1, 2.5, -3)") is None
+
+# Anything else is left to the LLM
+assert resolver.resolve("Go 2 meters above Alice's desk") is None
+assert resolver.resolve("Go to the desk which is the farthest from Alice's desk") is None
+assert resolver.resolve("") is None
+
+# The index of the demonstration scene
+resolver = LocationResolver.from_index(Path("scenes/basic.index").read_text())
+assert resolver.resolve("Go to the first target") == (10, 10, 0)
+assert resolver.resolve("Between the first target and the second target") == (15, 15, 2.5)
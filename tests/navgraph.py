@@ -0,0 +1,57 @@
+import sys
+sys.path.append(".")
+
+import math
+import random
+
+import networkx as nx
+import numpy as np
+from autodrone.base.navgraph import NavigationGraph
+
+# Random points, linked to their close neighbours by their distance
+random.seed(0)
+positions = np.array([[random.uniform(0, 10) for _ in range(3)] for _ in range(200)])
+edges = [
+    (i, j, float(np.linalg.norm(positions[i] - positions[j])))
+    for i in range(len(positions))
+    for j in range(i + 1, len(positions))
+    if np.linalg.norm(positions[i] - positions[j]) < 2.5
+]
+ids = [f"cell-{i}" for i in range(len(positions))]
+graph = NavigationGraph.from_edges(
+    ids,
+    positions,
+    sources=[i for i, _, _ in edges],
+    targets=[j for _, j, _ in edges],
+    weights=[w for _, _, w in edges],
+)
+assert graph.number_of_nodes() == 200
+assert graph.number_of_edges() == len(edges)
+
+# Same results as networkx
+G = graph.to_networkx()
+assert G.number_of_edges() == len(edges)
+distances, predecessors = graph.dijkstra(0)
+expected = nx.single_source_dijkstra_path_length(G, "cell-0")
+for i, cell_id in enumerate(ids):
+    assert math.isclose(distances[i], expected.get(cell_id, math.inf))
+    if predecessors[i] >= 0:
+        weight = G.edges[cell_id, ids[predecessors[i]]]["weight"]
+        assert math.isclose(distances[predecessors[i]] + weight, distances[i])
+
+for target in range(1, 200, 7):
+    path = graph.astar(0, target)
+    if distances[target] == math.inf:
+        assert path == []
+    else:
+        assert path[0] == 0 and path[-1] == target
+        length = sum(G.edges[ids[u], ids[v]]["weight"] for u, v in zip(path, path[1:]))
+        assert math.isclose(length, distances[target])
+
+# Replacing the edges of a node
+neighbours, _ = graph.neighbours(5)
+graph.replace_edges([5], sources=[5], targets=[199], weights=[1.0])
+assert graph.neighbours(5)[0].tolist() == [199]
+assert graph.degree(5) == 1
+assert graph.number_of_edges() == len(edges) - len(neighbours) + 1
+assert 5 in graph.neighbours(199)[0].tolist()
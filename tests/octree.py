@@ -29,5 +29,37 @@ closenode = t.get_closest_cell_to_position((2.5, 2.5, 2.5))
 assert tuple(closenode.center) == (2.5, 2.5, 2.5)
 assert len(t.get_all_cells(leaf_nodes_only=True)) == 8
 
+# Test point location
+assert tuple(t.get_closest_cell_to_position((1, -4, 0.5)).center) == (2.5, -2.5, 2.5)
+assert t.locate_cell((20, 20, 20)) is None
+assert tuple(t.get_closest_cell_to_position((20, 20, 20)).center) == (2.5, 2.5, 2.5)
+
 
 graph = t.to_graph(dist_threshold=100, top_k_neighbors=999)
+
+
+# Test adjacency in a mixed-resolution tree
+t = Octree((0, 0, 0), 10, 10)
+t.root.subdivide()
+t.root.children[0].subdivide()
+adjacent_ids = set(n.id for n in t.get_adjacent_cells(t.get_cell_by_name("root-0-7")))
+assert adjacent_ids == set(f"root-0-{i}" for i in range(7)) | set(
+    f"root-{i}" for i in range(1, 8)
+)
+adjacent_ids = set(n.id for n in t.get_adjacent_cells(t.get_cell_by_name("root-7")))
+assert adjacent_ids == set(f"root-{i}" for i in range(1, 7))
+pairs = set((a.id, b.id) for a, b in t._get_adjacent_pairs(t.get_all_cells(leaf_nodes_only=True)))
+assert ("root-0-7", "root-7") in pairs
+assert ("root-0-0", "root-7") not in pairs
+
+
+# Cell lists and the index by id are updated when a cell is subdivided
+t = Octree((0, 0, 0), 10, 10)
+t.root.subdivide()
+assert t.get_cell_by_name("root-3-1") is None
+t.get_cell_by_name("root-3").subdivide()
+assert t.get_cell_by_name("root-3-1").center == Vector((-3.75, 1.25, 3.75))
+leaves = t.get_all_cells(leaf_nodes_only=True)
+assert len(leaves) == 7 + 8
+assert all(n.children is None for n in leaves)
+assert len(t.get_all_cells()) == 1 + 8 + 8
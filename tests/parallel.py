@@ -0,0 +1,37 @@
+import sys
+sys.path.append(".")
+
+import numpy as np
+from autodrone.base.array_octree import ArrayOctree
+from autodrone.base.octree import Octree
+from autodrone.base.parallel import spatial_partitions
+from autodrone.base.raycast import EdgeVisibilityCache, MeshRaycaster
+
+# Partitions are the octants of the root, split again for more processes
+positions = np.random.default_rng(0).uniform(-5, 5, size=(1000, 3))
+for count, expected in ((1, 8), (8, 8), (9, 64)):
+    partitions = spatial_partitions(positions, (0, 0, 0), 10, count)
+    assert len(partitions) == expected
+    assert sorted(np.concatenate(partitions).tolist()) == list(range(1000))
+    for p in partitions:
+        corners = np.floor(positions[p] / 10 * (expected ** (1 / 3)))
+        assert (corners == corners[0]).all()
+
+# A wall in the middle of the scene
+corners = np.array([(x, y, z) for x in (-0.1, 0.1) for y in (-3, 3) for z in (-3, 3)])
+quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+wall = MeshRaycaster(MeshRaycaster._triangulate(corners, quads))
+
+# The graph built by several processes is the same as the sequential one
+for octree_class in (Octree, ArrayOctree):
+    graphs = []
+    for processes in (None, 4):
+        t = octree_class((0, 0, 0), 10, 10)
+        t.subdivide_leaves()
+        t.subdivide_leaves()
+        t.get_all_cells(leaf_nodes_only=True)[5].subdivide()
+        t.edge_visibility = EdgeVisibilityCache(raycast_many=wall.raycast_many)
+        graph = t.to_graph(processes=processes)
+        graphs.append(sorted(map(sorted, graph.to_networkx().edges())))
+        assert len(t.edge_visibility) > graph.number_of_edges()
+    assert graphs[0] == graphs[1]
@@ -16,8 +16,38 @@ gridgraph = t.to_graph(dist_threshold=100, top_k_neighbors=999)
 # Test pathfinding
 path = Pathfinder.pathfind(
     scene_octree=t,
+    scene_graph=gridgraph,
     startpos=Vector((0, 0, 0)),
     endpos=Vector((7.5, 7.5, 7.5)),
-    dist_threshold_graph_conversion=100,
 )
-assert path == ["root-0", "root-0-7", "root-7", "root-7-7"]
+assert path[0] == "root-7-0" and path[-1] == "root-7-7"
+
+# Test avoiding an occupied cell : the part of the vector heading into it is
+# removed, so the drone slides along it
+from autodrone.flowfield import FlowField
+
+flowfield = FlowField(root_center=Vector((0, 0, 0)), root_size=8, max_depth=2)
+flowfield.subdivide_leaves()
+flowfield.subdivide_leaves()
+obstacle = flowfield.locate_cell((1.5, 0.5, 0.5))
+obstacle.is_occupied = True
+assert tuple(obstacle.center) == (1, 1, 1)
+pathfinder = Pathfinder()
+for direction, expected in (
+    ((1, 0, 0), (0, 0, 0)),
+    ((-1, 0, 0), (-1, 0, 0)),
+    ((1, 1, 0), (0, 1, 0)),
+):
+    vector = pathfinder.local_avoidance_behavior(
+        Vector(direction), scene_octree=flowfield, position=Vector((0.2, 1, 1))
+    )
+    assert (vector - Vector(expected)).length < 1e-6
+
+# Unless it is the destination
+vector = pathfinder.local_avoidance_behavior(
+    Vector((1, 0, 0)),
+    scene_octree=flowfield,
+    position=Vector((0.2, 1, 1)),
+    destination_cell=obstacle,
+)
+assert tuple(vector) == (1, 0, 0)
@@ -0,0 +1,63 @@
+import sys
+sys.path.append(".")
+
+from autodrone.base.octree import Octree
+from autodrone.base.raycast import EdgeVisibilityCache
+
+# Count the rays cast, and block every segment going through the plane x = 0
+rays_cast = []
+
+
+def raycast_many(origins, targets):
+    rays_cast.extend(zip(origins, targets))
+    return [(0, 0, 0) if o[0] * t[0] < 0 else None for o, t in zip(origins, targets)]
+
+
+t = Octree((0, 0, 0), 10, 10)
+t.root.subdivide()
+t.edge_visibility = EdgeVisibilityCache(raycast_many=raycast_many)
+cells = t.get_all_cells(leaf_nodes_only=True)
+a, b, c = t.get_cell_by_name("root-0"), t.get_cell_by_name("root-1"), t.get_cell_by_name("root-4")
+
+# Symmetric edges are only cast once
+assert t.edge_visibility.are_blocked([(a, b), (b, a), (a, c)]) == [False, False, True]
+assert len(rays_cast) == 2
+
+# Cached edges are not cast again
+assert t.edge_visibility.are_blocked([(b, a), (c, a)]) == [False, True]
+assert len(rays_cast) == 2
+
+# Invalidating a cell only recasts the edges touching it
+t.edge_visibility.invalidate([c.id])
+assert len(t.edge_visibility) == 1
+t.edge_visibility.are_blocked([(a, b), (a, c)])
+assert len(rays_cast) == 3
+
+# Building the graph casts each undirected edge once, and only links cells on the same side
+graph = t.to_graph()
+assert len(rays_cast) == 3 + 28 - 2
+assert graph.number_of_edges() == 12
+
+
+# Test the NumPy raycaster on a cube of side 2 centered on the origin
+import tempfile
+import numpy as np
+from autodrone.base.raycast import MeshRaycaster
+
+corners = np.array([(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)])
+quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+cube = MeshRaycaster(MeshRaycaster._triangulate(corners, quads), leaf_size=2)
+
+origins = np.array([(-5, 0, 0), (-5, 0, 0), (0, 0, 0), (-5, 3, 0), (-5, 0, 0)])
+targets = np.array([(5, 0, 0), (-2, 0, 0), (0, 0, 5), (5, 3, 0), (-1, 0.5, 0.5)])
+t = cube.intersect_segments(origins, targets)
+assert np.allclose(t, [0.4, np.inf, 0.2, np.inf, 1.0])
+assert list(cube.segments_are_blocked(origins, targets)) == [True, False, True, False, True]
+assert tuple(cube.raycast_many(origins, targets)[0]) == (-1, 0, 0)
+
+# Round trip through an OBJ file
+with tempfile.TemporaryDirectory() as directory:
+    cube.write_obj(f"{directory}/cube.obj")
+    loaded = MeshRaycaster.from_obj(f"{directory}/cube.obj")
+assert len(loaded.triangles) == 12
+assert np.allclose(loaded.intersect_segments(origins, targets), t)
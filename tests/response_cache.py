@@ -0,0 +1,73 @@
+import sys
+
+sys.path.append(".")
+
+import tempfile
+from pathlib import Path
+
+from autodrone.llm import RAG_LLMAgent, ResponseCache, parse_coordinates
+
+
+class CountingChain:
+    """Stands in for the langchain chain of the agent, counting questions."""
+
+    def __init__(self, text):
+        self.text = text
+        self.questions = []
+
+    def invoke(self, question):
+        self.questions.append(question)
+        return {"question": question, "text": self.text}
+
+
+assert parse_coordinates("[/INST] (5, 5, 0)") == (5, 5, 0)
+# The answer comes after the example of the prompt
+assert parse_coordinates('answer "(10,20,30)". [/INST]\n(-1.5,2,0)') == (-1.5, 2, 0)
+assert parse_coordinates("I do not know") is None
+
+# Questions are normalized
+key = ResponseCache.key("Go to Alice's desk.", "index", "model", "template")
+assert key == ResponseCache.key("go to  alice's desk", "index", "model", "template")
+assert key != ResponseCache.key("Go to Alice's desk.", "other index", "model", "template")
+assert key != ResponseCache.key("Go to Alice's desk.", "index", "other model", "template")
+assert key != ResponseCache.key("Go to Alice's desk.", "index", "model", "other template")
+
+# The least recently used answers are evicted
+cache = ResponseCache(max_entries=2)
+cache.put("a", 1)
+cache.put("b", 2)
+assert cache.get("a") == 1
+cache.put("c", 3)
+assert len(cache) == 2 and cache.get("b") is None and cache.get("a") == 1
+
+with tempfile.TemporaryDirectory() as directory:
+    path = Path(directory) / "responses.json"
+
+    agent = RAG_LLMAgent(
+        prompt_template_key="drone_loc", response_cache=ResponseCache(path)
+    )
+    agent.context_hash = "index"
+    agent._rag_chain = CountingChain("[/INST] (5, 5, 0)")
+    assert agent("Go to the midpoint between Alice's and Guillaume's desk.") == (5, 5, 0)
+    assert agent("go to the midpoint between alice's and guillaume's desk") == (5, 5, 0)
+    assert len(agent._rag_chain.questions) == 1
+
+    # The answers are kept for the next runs
+    agent = RAG_LLMAgent(
+        prompt_template_key="drone_loc", response_cache=ResponseCache(path)
+    )
+    agent.context_hash = "index"
+    agent._rag_chain = CountingChain("[/INST] (0, 0, 0)")
+    assert agent("Go to the midpoint between Alice's and Guillaume's desk") == (5, 5, 0)
+    assert len(agent._rag_chain.questions) == 0
+
+    # Unless the index changed
+    agent.context_hash = "modified index"
+    assert agent("Go to the midpoint between Alice's and Guillaume's desk") == (0, 0, 0)
+
+    # Answers without coordinates are not cached
+    agent._rag_chain = CountingChain("I do not know")
+    assert agent("Go to Bob's desk") is None
+    assert agent("Go to Bob's desk") is None
+    assert len(agent._rag_chain.questions) == 2
+    assert len(ResponseCache(path)) == 2
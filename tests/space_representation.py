@@ -15,3 +15,13 @@ space.octree.populate_self(
     top_k_neighbors_graph_conversion=8,
 )
 space.octree.produce_visualisation()
+
+
+# Adaptive subdivision only refines the cells touching the scene mesh
+adaptive_space = SpaceRepresentation(max_depth_flowfield=4, adaptive=True)
+leaves = adaptive_space.octree.get_all_cells(leaf_nodes_only=True)
+print(f"CREATED adaptively with nodes: {len(leaves)}")
+assert len(leaves) < 8**4
+assert all(leaf.is_occupied is not None for leaf in leaves)
+assert any(leaf.is_occupied for leaf in leaves)
+assert any(not leaf.is_occupied for leaf in leaves)
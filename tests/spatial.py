@@ -0,0 +1,44 @@
+import sys
+sys.path.append(".")
+
+import numpy as np
+from autodrone.base.mathutils import k_nearest, pairwise_distances
+from autodrone.base.octree import Octree
+from autodrone.base.spatial import KDTree
+
+rng = np.random.default_rng(0)
+queries = rng.uniform(-7, 7, size=(200, 3))
+
+# Same neighbours as a brute force search, including with very few points
+for count in (0, 1, 5, 1000):
+    points = rng.uniform(-5, 5, size=(count, 3))
+    tree = KDTree(points, leaf_size=4, batch_size=64)
+    for k in (1, 3, 20):
+        for max_distance in (None, 2.0):
+            indices, distances = tree.query(queries, k, max_distance)
+            expected_indices, expected_distances = k_nearest(
+                points, queries, k, max_distance
+            )
+            assert np.allclose(distances, expected_distances)
+            assert ((indices == expected_indices) | (distances == expected_distances)).all()
+
+    d = pairwise_distances(queries, points)
+    for i, found in enumerate(tree.query_radius(queries, 2.5)):
+        assert sorted(found.tolist()) == np.flatnonzero(d[i] <= 2.5).tolist()
+        assert (np.diff(d[i, found]) >= 0).all()
+
+# Points on a grid, with many neighbours at the same distance
+grid = np.array([(x, y, z) for x in range(10) for y in range(10) for z in range(10)], float)
+_, distances = KDTree(grid).query(grid, 27)
+assert np.allclose(distances, k_nearest(grid, grid, 27)[1])
+
+# The index of an octree follows its subdivisions
+t = Octree((0, 0, 0), 10, 10)
+t.root.subdivide()
+assert len(t.get_leaf_index()) == 8
+t.root.children[0].subdivide()
+assert len(t.get_leaf_index()) == 15
+near = t.get_cells_near([(-5, -5, -5), (20, 20, 20)], 2.2)
+assert [cell.id for cell in near[0]] == ["root-0-0"]
+assert near[1] == []
+assert t.get_closest_cell_to_position((-20, -20, -20)).id == "root-0-0"
@@ -0,0 +1,44 @@
+import sys
+
+sys.path.append(".")
+
+from autodrone.llm import CoordinatesStoppingCriteria, format_documents
+
+
+class CharacterTokenizer:
+    """Stands in for a transformers tokenizer, with one token per character."""
+
+    def encode(self, text):
+        return [ord(c) for c in text]
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(chr(i) for i in ids)
+
+
+tokenizer = CharacterTokenizer()
+prompt = 'answer directly "(10,20,30)". [/INST]'
+answer = " (5, 5, 0.5)</s> and then much more text"
+
+criteria = CoordinatesStoppingCriteria(tokenizer, prompt_length=len(prompt))
+ids = tokenizer.encode(prompt + answer)
+
+# The example of the prompt is not the answer, and generation goes on until
+# the tuple is closed
+stops = [criteria([ids[: len(prompt) + n]], None) for n in range(len(answer) + 1)]
+assert stops.index(True) == answer.index(")") + 1
+assert criteria.coordinates == (5, 5, 0.5)
+
+criteria = CoordinatesStoppingCriteria(tokenizer, prompt_length=len(prompt))
+assert not criteria([tokenizer.encode(prompt + " I do not know")], None)
+assert criteria.coordinates is None
+
+
+class Document:
+    def __init__(self, page_content):
+        self.page_content = page_content
+
+
+assert (
+    format_documents([Document("Alice's desk\t10\t10\t0"), Document("Kitchen\t5\t0\t0")])
+    == "Alice's desk\t10\t10\t0\nKitchen\t5\t0\t0"
+)
@@ -0,0 +1,55 @@
+import sys
+sys.path.append(".")
+
+import tempfile
+import numpy as np
+from autodrone.base.storage import save_arrays, load_arrays
+from autodrone.flowfield import FlowField, ArrayFlowField
+from autodrone.base.raycast import EdgeVisibilityCache
+from autodrone.pathfind import Pathfinder
+from tests.helpers import no_obstacle
+from mathutils import Vector
+
+directory = tempfile.mkdtemp()
+
+# Test the array file format
+arrays = {"a": np.arange(10, dtype=np.int32), "b": np.ones((3, 3)), "empty": np.zeros(0)}
+save_arrays(f"{directory}/arrays", arrays, metadata={"key": "value"})
+for mmap in (True, False):
+    loaded, metadata = load_arrays(f"{directory}/arrays", mmap=mmap)
+    assert metadata == {"key": "value"}
+    assert all(np.array_equal(loaded[k], arrays[k]) for k in arrays)
+    assert all(loaded[k].dtype == arrays[k].dtype for k in arrays)
+
+
+# Test saving and loading a populated flowfield, with both backends
+for flowfield_class in (FlowField, ArrayFlowField):
+    flowfield = flowfield_class(root_center=Vector((0, 0, 0)), root_size=10, max_depth=2)
+    flowfield.edge_visibility = EdgeVisibilityCache(raycast_many=no_obstacle)
+    flowfield.subdivide_leaves()
+    flowfield.root.children[0].subdivide()
+    flowfield.populate_self(endpos=Vector((4, 4, 4)), pathfinder=Pathfinder())
+
+    flowfield.save(f"{directory}/flowfield")
+    loaded = FlowField.load(f"{directory}/flowfield")
+
+    assert type(loaded) is flowfield_class
+    assert loaded.destination_cell_id == flowfield.destination_cell_id
+    assert list(loaded.storage_ids()) == list(flowfield.storage_ids())
+    assert sorted(loaded.graph.to_networkx().edges(data="weight")) == sorted(
+        flowfield.graph.to_networkx().edges(data="weight")
+    )
+    for a, b in zip(loaded._storage_order(), flowfield._storage_order()):
+        assert a.center == b.center and a.size == b.size
+        assert a.vector == b.vector
+        assert a.outgoing_graph_edges == b.outgoing_graph_edges
+
+    # A loaded flowfield can be saved again to its own file, which it still
+    # memory-maps, eg. with a new destination
+    loaded.edge_visibility = EdgeVisibilityCache(raycast_many=no_obstacle)
+    loaded.populate_self(endpos=Vector((-4, -4, -4)), pathfinder=Pathfinder())
+    loaded.save(f"{directory}/flowfield")
+    reloaded = FlowField.load(f"{directory}/flowfield")
+    assert reloaded.destination_cell_id == loaded.destination_cell_id
+    for a, b in zip(reloaded._storage_order(), loaded._storage_order()):
+        assert a.vector == b.vector